@@ -0,0 +1,297 @@
+"""
+Матрица ответов на диске, которую можно отобразить в память (mmap).
+
+Формат: заголовок фиксированной длины, затем capacity строк одинаковой
+ширины — telegram_id (int64, little-endian) и по одному байту на вопрос:
+битовая маска выбранных вариантов (у вопросов не больше 8 вариантов).
+За строками лежит индекс telegram_id -> номер строки: хеш-таблица с
+открытой адресацией, слоты (telegram_id, номер строки + 1), 0 — пустой слот.
+
+Файл общий для всех процессов на хосте: один процесс-писатель
+(AnswerMatrixWriter, см. matrix_writer.py) обновляет строки на месте и
+дописывает новые в запас capacity, читатели (AnswerMatrix) отображают файл
+только для чтения и считают совместимость прямо по байтам mmap — без JSON,
+без словаря на каждого пользователя и без отдельной копии в каждом процессе.
+Когда запас кончается, писатель пишет новый файл и подменяет его через
+os.replace; читатели замечают это по смене inode и переоткрывают файл.
+"""
+import logging
+import mmap
+import os
+import struct
+
+from questions import MAX_OPTIONS, answers_to_masks, masks_to_answers
+
+MAGIC = b"HLAM"
+FORMAT_VERSION = 2
+# magic, формат, версия анкеты, число вопросов, ширина строки,
+# число строк, ёмкость (строк), число слотов индекса
+HEADER = struct.Struct("<4sHHHHQQQ")
+HEADER_SIZE = 64
+# Смещение счётчика строк: писатель увеличивает его последним, после записи строки
+ROWS = struct.Struct("<Q")
+ROWS_OFFSET = 12
+ID = struct.Struct("<q")
+SLOT = struct.Struct("<qq")
+MIN_CAPACITY = 1024
+
+_MASK64 = (1 << 64) - 1
+
+logger = logging.getLogger("answer_matrix")
+
+
+class IncompatibleMatrixError(ValueError):
+    """Файл не матрица, другой формат или другая версия анкеты."""
+
+
+def _check_engine(test_engine):
+    if any(len(q['options']) > MAX_OPTIONS for q in test_engine.questions):
+        raise ValueError(f"❌ В матрице ответов не больше {MAX_OPTIONS} вариантов на вопрос")
+
+
+def _slot_hash(telegram_id):
+    return ((telegram_id * 0x9E3779B97F4A7C15) & _MASK64) >> 16
+
+
+def _write(path, masked_rows, test_engine, capacity=None):
+    """Пишет файл из списка (telegram_id, маски) атомарно, через временный файл."""
+    questions_count = len(test_engine.questions)
+    row_size = ID.size + questions_count
+    capacity = max(capacity or 0, MIN_CAPACITY, len(masked_rows) * 2)
+    slots = 1 << (capacity * 2 - 1).bit_length()
+
+    rows = bytearray(capacity * row_size)
+    index = bytearray(slots * SLOT.size)
+    count = 0
+    for telegram_id, masks in masked_rows:
+        slot = _slot_hash(telegram_id) & (slots - 1)
+        while True:
+            slot_id, slot_position = SLOT.unpack_from(index, slot * SLOT.size)
+            if slot_id == 0 or slot_id == telegram_id:
+                break
+            slot = (slot + 1) & (slots - 1)
+
+        if slot_id == telegram_id:
+            position = slot_position - 1
+        else:
+            position = count
+            count += 1
+            SLOT.pack_into(index, slot * SLOT.size, telegram_id, position + 1)
+
+        offset = position * row_size
+        ID.pack_into(rows, offset, telegram_id)
+        rows[offset + ID.size:offset + row_size] = masks
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        header = bytearray(HEADER_SIZE)
+        HEADER.pack_into(
+            header, 0, MAGIC, FORMAT_VERSION, test_engine.version,
+            questions_count, row_size, count, capacity, slots
+        )
+        f.write(header)
+        f.write(rows)
+        f.write(index)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    return count
+
+
+def write_answer_matrix(path, rows, test_engine, capacity=None):
+    """
+    Записывает матрицу атомарно (через временный файл и os.replace).
+    rows: итерируемое (telegram_id, answers) в индексах текущей версии анкеты.
+    capacity — сколько строк поместится без пересоздания файла
+    (по умолчанию вдвое больше текущего числа). Возвращает число строк.
+    """
+    _check_engine(test_engine)
+    questions_count = len(test_engine.questions)
+    masked_rows = [
+        (telegram_id, answers_to_masks(answers, questions_count))
+        for telegram_id, answers in rows
+    ]
+    return _write(path, masked_rows, test_engine, capacity)
+
+
+class _MappedMatrix:
+    """Разбор заголовка, чтение строк и поиск по индексу — общее для читателя и писателя."""
+
+    ACCESS = mmap.ACCESS_READ
+    MODE = "rb"
+
+    def __init__(self, path, test_engine):
+        _check_engine(test_engine)
+        self.path = path
+        self.test_engine = test_engine
+        self._mmap = None
+        self._view = None
+        self._open()
+
+    def _open(self):
+        with open(self.path, self.MODE) as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < HEADER_SIZE:
+                raise IncompatibleMatrixError(f"❌ {self.path} не является матрицей ответов")
+            self._inode = stat.st_ino
+            self._mmap = mmap.mmap(f.fileno(), 0, access=self.ACCESS)
+
+        magic, fmt, version, questions_count, row_size, _, capacity, slots = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            self.close()
+            raise IncompatibleMatrixError(f"❌ {self.path} не является матрицей ответов формата {FORMAT_VERSION}")
+        if version != self.test_engine.version or questions_count != len(self.test_engine.questions):
+            self.close()
+            raise IncompatibleMatrixError(
+                f"❌ Матрица {self.path} построена для версии анкеты {version}, "
+                f"текущая — {self.test_engine.version}"
+            )
+
+        self.questions_count = questions_count
+        self.row_size = row_size
+        self.capacity = capacity
+        self.slots = slots
+        self._index_offset = HEADER_SIZE + capacity * row_size
+        self._view = memoryview(self._mmap)
+
+    def __len__(self):
+        # Читается из mmap каждый раз: писатель дописывает строки на лету
+        return ROWS.unpack_from(self._mmap, ROWS_OFFSET)[0]
+
+    def _offset(self, position):
+        return HEADER_SIZE + position * self.row_size
+
+    def telegram_id(self, position):
+        return ID.unpack_from(self._mmap, self._offset(position))[0]
+
+    def masks(self, position):
+        start = self._offset(position) + ID.size
+        return self._view[start:start + self.questions_count]
+
+    def _probe(self, telegram_id):
+        """(номер слота, номер строки или None) для telegram_id."""
+        slot = _slot_hash(telegram_id) & (self.slots - 1)
+        while True:
+            slot_id, slot_position = SLOT.unpack_from(self._mmap, self._index_offset + slot * SLOT.size)
+            if slot_id == telegram_id:
+                return slot, slot_position - 1
+            if slot_id == 0:
+                return slot, None
+            slot = (slot + 1) & (self.slots - 1)
+
+    def find(self, telegram_id):
+        """Номер строки пользователя или None."""
+        return self._probe(telegram_id)[1]
+
+    def answers(self, telegram_id):
+        """Ответы пользователя {индекс вопроса: [варианты]} или None."""
+        position = self.find(telegram_id)
+        if position is None:
+            return None
+        return masks_to_answers(self.masks(position))
+
+    def __iter__(self):
+        """(telegram_id, маски) по всем строкам; маски — memoryview без копирования."""
+        for position in range(len(self)):
+            yield self.telegram_id(position), self.masks(position)
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+class AnswerMatrix(_MappedMatrix):
+    """Матрица, отображённая в память только для чтения."""
+
+    def refresh(self):
+        """Переоткрывает файл, если писатель подменил его новым. True, если переоткрыли."""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return False
+        if inode == self._inode:
+            return False
+
+        self.close()
+        self._open()
+        return True
+
+    def top_matches(self, target_answers, top_n=5, exclude_id=None):
+        """[(telegram_id, similarity), ...] лучших top_n по убыванию схожести."""
+        self.refresh()
+        candidates = (
+            (telegram_id, masks)
+            for telegram_id, masks in self
+            if telegram_id != exclude_id
+        )
+        return self.test_engine.top_matches_encoded(target_answers, candidates, top_n)
+
+
+class AnswerMatrixWriter(_MappedMatrix):
+    """
+    Единственный писатель матрицы. Порядок записи рассчитан на читателей
+    в других процессах: сначала строка, затем слот индекса (номер строки,
+    потом telegram_id), и только потом счётчик строк в заголовке.
+    Перезапись существующей строки не атомарна: читатель может один раз
+    увидеть анкету наполовину обновлённой.
+    """
+
+    ACCESS = mmap.ACCESS_WRITE
+    MODE = "r+b"
+
+    def __init__(self, path, test_engine):
+        if not os.path.exists(path):
+            write_answer_matrix(path, [], test_engine)
+        try:
+            super().__init__(path, test_engine)
+        except IncompatibleMatrixError as e:
+            # Файл от прошлой версии анкеты или формата: пересоздаём пустым
+            # (атомарно, читатели переоткроют его по смене inode), затем rebuild
+            logger.warning("Матрица несовместима, пересоздаю", extra={"path": path, "error": str(e)})
+            write_answer_matrix(path, [], test_engine)
+            super().__init__(path, test_engine)
+
+    def rebuild(self, rows):
+        """Пересоздаёт файл целиком из (telegram_id, answers). Возвращает число строк."""
+        count = write_answer_matrix(self.path, rows, self.test_engine)
+        self._reopen()
+        return count
+
+    def upsert(self, telegram_id, answers):
+        masks = answers_to_masks(answers, self.questions_count)
+        slot, position = self._probe(telegram_id)
+
+        if position is not None:
+            start = self._offset(position) + ID.size
+            self._mmap[start:start + self.questions_count] = masks
+            return
+
+        rows = len(self)
+        if rows >= self.capacity:
+            self._grow(telegram_id, masks)
+            return
+
+        offset = self._offset(rows)
+        ID.pack_into(self._mmap, offset, telegram_id)
+        self._mmap[offset + ID.size:offset + self.row_size] = masks
+
+        slot_offset = self._index_offset + slot * SLOT.size
+        ID.pack_into(self._mmap, slot_offset + ID.size, rows + 1)
+        ID.pack_into(self._mmap, slot_offset, telegram_id)
+
+        ROWS.pack_into(self._mmap, ROWS_OFFSET, rows + 1)
+
+    def _grow(self, telegram_id, masks):
+        masked_rows = [(row_id, bytes(row_masks)) for row_id, row_masks in self]
+        masked_rows.append((telegram_id, masks))
+        _write(self.path, masked_rows, self.test_engine, self.capacity * 2)
+        self._reopen()
+
+    def _reopen(self):
+        self.close()
+        self._open()
@@ -0,0 +1,201 @@
+"""
+HTTP API только для чтения: результаты совместимости для Mini App / веб-страницы.
+
+    GET /api/users/{telegram_id}/matches?limit=10   лучшие совпадения
+    GET /api/pairs/{telegram_id}/{telegram_id}      совместимость пары
+
+Совпадения — сохранённый в matches полный и свежий топ, иначе они
+считаются по снимку анкет в памяти, как в «✨ Совместимость», но не
+сохраняются: GET ничего не пишет в БД, топы записывает рассылка
+(fanout.py). Пара — из PairScoreCache или снимка, без запросов к БД.
+
+Ответ — компактный JSON с ETag: If-None-Match с тем же ETag даёт 304 без
+тела, Cache-Control разрешает клиенту не переспрашивать API_CACHE_SECONDS.
+
+Авторизация пока заглушка: общий токен API_TOKEN в заголовке
+Authorization: Bearer <токен>. Для Mini App его заменит проверка initData.
+
+Запускается вместе с ботом, если задан API_PORT, или отдельно:
+
+    API_PORT=8081 API_TOKEN=dev python api.py
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+import metrics
+from top_matches import top_matches_for
+
+logger = logging.getLogger("api")
+
+API_CACHE_SECONDS = int(os.getenv("API_CACHE_SECONDS", 60))
+API_MAX_LIMIT = 50
+DEFAULT_LIMIT = 10
+
+API_REQUESTS = metrics.Counter("bot_api_http_requests_total", "Запросы к HTTP API", labels=("route", "status"))
+
+
+def _match_json(telegram_id, username, full_name, similarity):
+    # REAL из matches округляем, как calculate_similarity
+    return {"id": telegram_id, "username": username, "name": full_name, "score": round(similarity, 2)}
+
+
+def _etag(body):
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+class MatchesApi:
+    def __init__(self, db, snapshot_cache, test_engine, pair_scores, token):
+        self.db = db
+        self.snapshot_cache = snapshot_cache
+        self.test_engine = test_engine
+        self.pair_scores = pair_scores
+        self.token = token
+
+    def app(self):
+        app = web.Application(middlewares=[self._auth])
+        app.router.add_get("/api/users/{telegram_id}/matches", self.user_matches, name="user_matches")
+        app.router.add_get("/api/pairs/{a}/{b}", self.pair, name="pair")
+        return app
+
+    @web.middleware
+    async def _auth(self, request, handler):
+        route = request.match_info.route.name or "unknown"
+        header = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(header.encode(), f"Bearer {self.token}".encode()):
+            API_REQUESTS.inc(1, route, 401)
+            raise web.HTTPUnauthorized()
+        try:
+            response = await handler(request)
+        except web.HTTPException as e:
+            API_REQUESTS.inc(1, route, e.status)
+            raise
+        API_REQUESTS.inc(1, route, response.status)
+        return response
+
+    def _respond(self, request, payload):
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+        etag = _etag(body)
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"private, max-age={API_CACHE_SECONDS}",
+            "Vary": "Authorization",
+        }
+        if _etag_matches(request.headers.get("If-None-Match"), etag):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type="application/json", charset="utf-8", headers=headers)
+
+    @staticmethod
+    def _telegram_id(value):
+        try:
+            return int(value)
+        except ValueError:
+            raise web.HTTPBadRequest(text="telegram_id должен быть числом")
+
+    async def user_matches(self, request):
+        telegram_id = self._telegram_id(request.match_info["telegram_id"])
+        try:
+            limit = max(1, min(int(request.query.get("limit", DEFAULT_LIMIT)), API_MAX_LIMIT))
+        except ValueError:
+            raise web.HTTPBadRequest(text="limit должен быть числом")
+
+        stored, computed = await top_matches_for(
+            self.db, self.snapshot_cache, self.test_engine, [telegram_id], limit, save=False
+        )
+        if telegram_id in stored:
+            source, found = "matches", stored[telegram_id]
+        elif telegram_id in computed:
+            source, found = "snapshot", computed[telegram_id]
+        else:
+            raise web.HTTPNotFound(text="Пользователь не найден или не прошёл тест")
+
+        matches = [_match_json(m.telegram_id, m.username, m.full_name, m.similarity) for m in found]
+        return self._respond(request, {"user": telegram_id, "source": source, "matches": matches})
+
+    async def pair(self, request):
+        a = self._telegram_id(request.match_info["a"])
+        b = self._telegram_id(request.match_info["b"])
+
+        similarity = self.pair_scores.get(a, b)
+        if similarity is None:
+            snapshot = await self.snapshot_cache.get()
+            answers_a, answers_b = snapshot.answers(a), snapshot.answers(b)
+            if answers_a is None or answers_b is None:
+                raise web.HTTPNotFound(text="Один из пользователей не найден или не прошёл тест")
+            similarity = self.test_engine.calculate_similarity(answers_a, answers_b)
+            metrics.SIMILARITY_COMPUTATIONS.inc()
+            self.pair_scores.put(a, b, similarity)
+
+        return self._respond(request, {"users": [a, b], "score": similarity})
+
+
+async def start_api_server(api, port=None, host=None):
+    """
+    Поднимает API, если задан API_PORT (или port) и API_TOKEN.
+    Возвращает AppRunner, который нужно закрыть при остановке, либо None.
+    """
+    port = port or os.getenv("API_PORT")
+    if not port:
+        return None
+    if not api.token:
+        logger.warning("API_PORT задан, но API_TOKEN пуст — API не запущен")
+        return None
+
+    host = host or os.getenv("API_HOST", "127.0.0.1")
+
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, host, int(port)).start()
+    logger.info(f"🌐 API доступно на http://{host}:{port}/api")
+    return runner
+
+
+def main():
+    """Отдельный процесс API: своё соединение с БД и свой снимок анкет."""
+    from database import Database
+    from pair_cache import PairScoreCache
+    from questions import TestEngine
+    from snapshot import SnapshotCache
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    test_engine = TestEngine()
+    db = Database()
+    api = MatchesApi(
+        db, SnapshotCache(db.load_answers_snapshot, test_engine), test_engine,
+        PairScoreCache(), os.getenv("API_TOKEN")
+    )
+
+    async def serve():
+        runner = await start_api_server(api, port=os.getenv("API_PORT", 8081))
+        if runner is None:
+            return
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+            db.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Сессия Bot API: один настроенный пул соединений на весь бот.
+
+- Пул на BOT_API_CONNECTIONS соединений с keep-alive BOT_API_KEEPALIVE
+  секунд: ответы пользователям не открывают новое TLS-соединение.
+- Две полосы. Рассылки (broadcast, fanout) выполняются внутри bulk_lane()
+  и занимают не больше BOT_API_BULK_CONNECTIONS соединений, остальные
+  всегда свободны для ответов пользователям — они не стоят в очереди за
+  рассылкой.
+- Таймаут на вызов: BOT_API_TIMEOUT по умолчанию, METHOD_TIMEOUTS для
+  загрузки файлов. getUpdates передаёт свой таймаут сам.
+- Длительность и ошибки каждого метода — в метриках bot_api_*.
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.aiohttp import AiohttpSession
+
+import metrics
+
+BOT_API_CONNECTIONS = int(os.getenv("BOT_API_CONNECTIONS", 100))
+BOT_API_BULK_CONNECTIONS = int(os.getenv("BOT_API_BULK_CONNECTIONS", 30))
+BOT_API_KEEPALIVE = float(os.getenv("BOT_API_KEEPALIVE", 60))
+BOT_API_TIMEOUT = float(os.getenv("BOT_API_TIMEOUT", 15))
+
+# Метод Bot API -> таймаут, если вызов не задал свой
+METHOD_TIMEOUTS = {
+    "sendPhoto": 60,
+    "sendDocument": 60,
+}
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+_lane = ContextVar("bot_api_lane", default=INTERACTIVE)
+
+BOT_API_SECONDS = metrics.Histogram(
+    "bot_api_request_seconds", "Длительность вызовов Bot API", labels=("method", "lane")
+)
+BOT_API_ERRORS = metrics.Counter(
+    "bot_api_errors_total", "Ошибки вызовов Bot API", labels=("method", "error")
+)
+BOT_API_LANE_WAIT = metrics.Histogram(
+    "bot_api_lane_wait_seconds", "Ожидание свободного соединения полосы", labels=("lane",)
+)
+
+
+@contextmanager
+def bulk_lane():
+    """Вызовы Bot API внутри блока (и в созданных из него задачах) идут по полосе рассылок."""
+    token = _lane.set(BULK)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class BotApiSession(AiohttpSession):
+    def __init__(self, connections=BOT_API_CONNECTIONS, bulk_connections=BOT_API_BULK_CONNECTIONS,
+                 keepalive=BOT_API_KEEPALIVE, timeout=BOT_API_TIMEOUT, **kwargs):
+        super().__init__(limit=connections, timeout=timeout, **kwargs)
+        self._connector_init["keepalive_timeout"] = keepalive
+        self._bulk = asyncio.Semaphore(min(bulk_connections, connections - 1))
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        lane = _lane.get()
+        if timeout is None:
+            timeout = METHOD_TIMEOUTS.get(name, self.timeout)
+
+        if lane == BULK:
+            wait_start = time.perf_counter()
+            async with self._bulk:
+                BOT_API_LANE_WAIT.observe(time.perf_counter() - wait_start, lane)
+                return await self._timed_request(bot, method, timeout, name, lane)
+        return await self._timed_request(bot, method, timeout, name, lane)
+
+    async def _timed_request(self, bot, method, timeout, name, lane):
+        start = time.perf_counter()
+        try:
+            return await super().make_request(bot, method, timeout)
+        except Exception as e:
+            BOT_API_ERRORS.inc(1, name, type(e).__name__)
+            raise
+        finally:
+            BOT_API_SECONDS.observe(time.perf_counter() - start, name, lane)
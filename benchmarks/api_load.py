@@ -0,0 +1,125 @@
+"""
+Нагрузочный прогон HTTP API (api.py).
+
+По умолчанию поднимает API в этом же процессе на синтетических
+пользователях (StubDatabase, без PostgreSQL) с токеном-заглушкой:
+
+    python -m benchmarks.api_load --users 10000 --requests 5000 --concurrency 50
+
+С --url бьёт по уже запущенному API (например, API_PORT=8081 API_TOKEN=dev python api.py):
+
+    python -m benchmarks.api_load --url http://127.0.0.1:8081 --token dev --ids 1,2,3
+
+Доля --revalidate запросов повторяет If-None-Match с полученным ETag —
+так видно, сколько ответов обходится 304 без тела.
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+
+from aiohttp import ClientSession, TCPConnector
+
+from benchmarks.loadtest import latency_summary
+
+STUB_TOKEN = "loadtest"
+
+
+async def start_stub_api(users):
+    from aiohttp import web
+
+    from api import MatchesApi
+    from benchmarks.synthetic import StubDatabase, generate_users
+    from pair_cache import PairScoreCache
+    from questions import TestEngine
+    from snapshot import SnapshotCache
+
+    test_engine = TestEngine()
+    db = StubDatabase(generate_users(test_engine, users))
+    api = MatchesApi(db, SnapshotCache(db.load_answers_snapshot, test_engine), test_engine, PairScoreCache(), STUB_TOKEN)
+
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}", [u['telegram_id'] for u in db.users]
+
+
+async def run(args):
+    runner = None
+    if args.url:
+        base_url, token = args.url.rstrip("/"), args.token
+        ids = [int(x) for x in args.ids.split(",")]
+    else:
+        runner, base_url, ids = await start_stub_api(args.users)
+        token = STUB_TOKEN
+
+    rng = random.Random(args.seed)
+    headers = {"Authorization": f"Bearer {token}"}
+    etags = {}
+    latencies = {"matches": [], "pair": []}
+    statuses = Counter()
+    queue = asyncio.Queue()
+    for _ in range(args.requests):
+        queue.put_nowait(rng.random() < args.pair_share)
+
+    async def worker(session):
+        while not queue.empty():
+            is_pair = queue.get_nowait()
+            if is_pair:
+                route, path = "pair", f"/api/pairs/{rng.choice(ids)}/{rng.choice(ids)}"
+            else:
+                route, path = "matches", f"/api/users/{rng.choice(ids)}/matches"
+
+            request_headers = dict(headers)
+            if path in etags and rng.random() < args.revalidate:
+                request_headers["If-None-Match"] = etags[path]
+
+            start = time.perf_counter()
+            async with session.get(base_url + path, headers=request_headers) as resp:
+                await resp.read()
+                if "ETag" in resp.headers:
+                    etags[path] = resp.headers["ETag"]
+            latencies[route].append(time.perf_counter() - start)
+            statuses[resp.status] += 1
+
+    start = time.perf_counter()
+    async with ClientSession(connector=TCPConnector(limit=args.concurrency)) as session:
+        # Прогрев снимка анкет, чтобы первый запрос не попал в замер
+        async with session.get(f"{base_url}/api/users/{ids[0]}/matches", headers=headers) as resp:
+            await resp.read()
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    if runner is not None:
+        await runner.cleanup()
+
+    print(f"Запросов: {args.requests} за {elapsed:.1f} с ({args.requests / elapsed:.0f}/с), "
+          f"статусы: {dict(sorted(statuses.items()))}")
+    print(f"{'маршрут':<10} {'n':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for route, values in latencies.items():
+        s = latency_summary(values)
+        print(f"{route:<10} {s['count']:>7} {s['p50_ms']:>8.1f}ms {s['p95_ms']:>8.1f}ms {s['p99_ms']:>8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон HTTP API совместимости")
+    parser.add_argument('--users', type=int, default=5000, help="синтетических пользователей (без --url)")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--pair-share', type=float, default=0.5, help="доля запросов /api/pairs")
+    parser.add_argument('--revalidate', type=float, default=0.5, help="доля повторов с If-None-Match")
+    parser.add_argument('--url', help="адрес запущенного API")
+    parser.add_argument('--token', default=STUB_TOKEN)
+    parser.add_argument('--ids', help="telegram_id через запятую (с --url)")
+    parser.add_argument('--seed', type=int, default=14)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Стоимость маршрутизации одного апдейта: цепочка lambda-фильтров
+против ButtonRouter, в зависимости от числа кнопок.
+
+    python -m benchmarks.bench_routing --output routing.json
+
+Для каждого числа кнопок подаётся апдейт с последней зарегистрированной
+кнопкой (худший случай для цепочки) и с текстом, который не совпал
+ни с одной кнопкой (уходит в обработчик «всё остальное»).
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime
+
+from aiogram import Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+
+from benchmarks.synthetic import StubBot
+from routing import ButtonRouter
+
+DEFAULT_FEATURES = [4, 16, 64, 256]
+
+
+async def _noop(message):
+    pass
+
+
+def build_lambda_dispatcher(texts):
+    dp = Dispatcher(storage=MemoryStorage())
+    for text in texts:
+        dp.message(lambda message, text=text: message.text == text)(_noop)
+    dp.message()(_noop)
+    return dp
+
+
+def build_router_dispatcher(texts):
+    dp = Dispatcher(storage=MemoryStorage())
+    buttons = ButtonRouter(dp)
+    for text in texts:
+        buttons.text(text)(_noop)
+    dp.message()(_noop)
+    return dp
+
+
+def make_update(bot, update_id, text):
+    return Update.model_validate({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': datetime.now(),
+            'chat': {'id': 1, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': False, 'first_name': 'Bench'},
+            'text': text,
+        },
+    }, context={'bot': bot})
+
+
+async def time_dispatch(dp, bot, text, iterations):
+    updates = [make_update(bot, i, text) for i in range(iterations)]
+    start = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - start) / iterations
+
+
+async def run(features, iterations, repeat):
+    bot = StubBot()
+    results = []
+    for count in features:
+        texts = [f"🔘 Кнопка {i}" for i in range(count)]
+        for kind, builder in (('lambda', build_lambda_dispatcher), ('router', build_router_dispatcher)):
+            dp = builder(texts)
+            for case, text in (('last_button', texts[-1]), ('no_match', "просто текст")):
+                timings = [await time_dispatch(dp, bot, text, iterations) for _ in range(repeat)]
+                per_update = statistics.median(timings)
+                results.append({
+                    'name': f"dispatch_{kind}_{case}",
+                    'features': count,
+                    'per_update_us': per_update * 1e6,
+                })
+                print(f"{kind:<7} {case:<12} {count:>4} кнопок  {per_update * 1e6:8.1f} мкс/апдейт")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк маршрутизации кнопок")
+    parser.add_argument('--features', type=int, nargs='+', default=DEFAULT_FEATURES)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='bench_routing.json')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.features, args.iterations, args.repeat))
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'meta': {'timestamp': datetime.now().isoformat(timespec='seconds')},
+            'results': results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Нагрузочный прогон bot.py целиком: синтетические Update подаются
+в dp.feed_update, исходящие вызовы Bot API уходят в локальную
+фейковую сессию, данные пишутся в настоящий (локальный) PostgreSQL.
+
+    DATABASE_URL=postgresql://localhost/hits_loadtest \\
+        python -m benchmarks.loadtest --users 2000 --concurrency 200
+
+Каждый симулированный пользователь проходит /start, весь тест
+(TestStates) и отправку валентинки другому участнику (ValentineStates).
+В конце печатаются p50/p95/p99 задержки по шагам, пропускная
+способность и задержка event loop; --output пишет то же в JSON.
+
+⚠️ Используйте отдельную базу: прогон регистрирует пользователей
+loadtest_user_*.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Message, Update
+
+LOOP_LAG_INTERVAL = 0.01
+USERNAME_PREFIX = "loadtest_user_"
+
+
+class FakeBotAPISession(BaseSession):
+    """
+    Сессия Bot API без сети: отвечает сразу (или через latency секунд)
+    правдоподобными объектами и считает вызовы по методам.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = {}
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method.__returning__ is Message:
+            chat_id = getattr(method, 'chat_id', 0)
+            return Message.model_validate({
+                'message_id': next(self._message_ids),
+                'date': datetime.now(),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': getattr(method, 'text', None),
+            }, context={'bot': bot})
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class Recorder:
+    """Собирает длительности обработки апдейтов по шагам сценария."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.loop_lags = []
+        self.errors = 0
+        self.updates = 0
+
+    def add(self, step, seconds):
+        self.latencies.setdefault(step, []).append(seconds)
+        self.updates += 1
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def latency_summary(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': (values[-1] if values else 0.0) * 1000,
+    }
+
+
+class SimulatedUser:
+    """Один пользователь, который шаг за шагом проходит сценарии бота."""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, index, bot, dp, test_engine, recorder, rng, think_time):
+        self.telegram_id = 7_000_000 + index
+        self.username = f"{USERNAME_PREFIX}{index}"
+        self.bot = bot
+        self.dp = dp
+        self.test_engine = test_engine
+        self.recorder = recorder
+        self.rng = rng
+        self.think_time = think_time
+        self._message_ids = itertools.count(1)
+
+    def _user(self):
+        return {'id': self.telegram_id, 'is_bot': False, 'first_name': 'Load', 'username': self.username}
+
+    def _message(self, text):
+        return {
+            'message_id': next(self._message_ids),
+            'date': datetime.now(),
+            'chat': {'id': self.telegram_id, 'type': 'private'},
+            'from': self._user(),
+            'text': text,
+        }
+
+    async def _feed(self, step, payload):
+        update = Update.model_validate(
+            {'update_id': next(self._update_ids), **payload},
+            context={'bot': self.bot}
+        )
+        start = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.recorder.errors += 1
+            print(f"❌ {step}: {e}")
+        self.recorder.add(step, time.perf_counter() - start)
+
+        if self.think_time:
+            await asyncio.sleep(self.rng.uniform(0, self.think_time))
+
+    async def send_text(self, step, text):
+        await self._feed(step, {'message': self._message(text)})
+
+    async def press(self, step, callback_data):
+        await self._feed(step, {'callback_query': {
+            'id': str(next(self._update_ids)),
+            'from': self._user(),
+            'chat_instance': str(self.telegram_id),
+            'message': self._message("…"),
+            'data': callback_data,
+        }})
+
+    async def take_test(self, quiz_mode='reply'):
+        await self.send_text('start', "/start")
+        await self.send_text('start_test', "📝 Пройти тест")
+
+        if quiz_mode == 'inline':
+            await self.take_inline_test()
+            return
+
+        for question in self.test_engine.questions:
+            options = question['options']
+            if question['type'] == 'single':
+                choice = self.rng.randrange(len(options))
+                await self.send_text('single_answer', f"{choice + 1}. {options[choice]}")
+            else:
+                for choice in self.rng.sample(range(len(options)), self.rng.randint(1, 2)):
+                    await self.send_text('multi_toggle', f"{choice + 1}. {options[choice]}")
+                await self.send_text('multi_next', "✅ Далее")
+
+    async def take_inline_test(self):
+        for index, question in enumerate(self.test_engine.questions):
+            options = question['options']
+            if question['type'] == 'single':
+                choice = self.rng.randrange(len(options))
+                await self.press('single_answer', f"q:{index}:{choice}")
+            else:
+                for choice in self.rng.sample(range(len(options)), self.rng.randint(1, 2)):
+                    await self.press('multi_toggle', f"q:{index}:{choice}")
+                await self.press('multi_next', f"q:{index}:-1")
+
+    async def send_valentine(self, recipient_username):
+        await self.send_text('valentines_menu', "💌 Валентинки")
+        await self.press('valentine_start', "send_valentine")
+        await self.send_text('valentine_recipient', recipient_username)
+        await self.send_text('valentine_text', "С днём святого Валентина!")
+        await self.press('valentine_skip_photo', "skip_photo")
+        await self.press('valentine_send', "send_anonymous")
+
+
+async def watch_loop_lag(recorder, stop_event):
+    loop = asyncio.get_running_loop()
+    while not stop_event.is_set():
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        recorder.loop_lags.append(max(0.0, loop.time() - start - LOOP_LAG_INTERVAL))
+
+
+async def run(args):
+    os.environ.setdefault('BOT_TOKEN', '42:LOADTEST')
+    # Симулированные пользователи жмут кнопки без пауз — лимиты отключаем, если не просили иного
+    os.environ.setdefault('THROTTLING', '1' if args.throttling else '0')
+    import bot as bot_module
+
+    session = FakeBotAPISession(latency=args.api_latency / 1000)
+    # Все исходящие вызовы, включая ValentinesManager, идут через модульный bot
+    bot_module.bot.session = session
+    bot = bot_module.bot
+    bot_module.QUIZ_MODE = args.quiz_mode
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    users = [
+        SimulatedUser(i, bot, bot_module.dp, bot_module.test_engine, recorder,
+                      random.Random(rng.random()), args.think_time / 1000)
+        for i in range(args.users)
+    ]
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def walk(user):
+        async with semaphore:
+            await user.take_test(args.quiz_mode)
+            if args.valentines:
+                recipient = rng.choice(users)
+                await user.send_valentine(recipient.username)
+
+    stop_event = asyncio.Event()
+    lag_task = asyncio.create_task(watch_loop_lag(recorder, stop_event))
+
+    # Сначала регистрируем всех, чтобы получатели валентинок существовали
+    for user in users:
+        bot_module.db.register_user(user.telegram_id, user.username, "Load Test")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(walk(user) for user in users))
+    elapsed = time.perf_counter() - start
+
+    stop_event.set()
+    await lag_task
+
+    all_latencies = list(itertools.chain.from_iterable(recorder.latencies.values()))
+    report = {
+        'meta': {
+            'users': args.users,
+            'concurrency': args.concurrency,
+            'api_latency_ms': args.api_latency,
+            'quiz_mode': args.quiz_mode,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+        },
+        'elapsed_s': elapsed,
+        'updates': recorder.updates,
+        'errors': recorder.errors,
+        'throughput_updates_per_s': recorder.updates / elapsed if elapsed else 0.0,
+        'overall': latency_summary(all_latencies),
+        'steps': {step: latency_summary(values) for step, values in sorted(recorder.latencies.items())},
+        'loop_lag': latency_summary(recorder.loop_lags),
+        'bot_api_calls': session.calls,
+    }
+
+    print(f"\nАпдейтов: {report['updates']} за {elapsed:.1f} с "
+          f"({report['throughput_updates_per_s']:.0f}/с), ошибок: {report['errors']}")
+    print(f"{'шаг':<22} {'n':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for step, s in [('ВСЕГО', report['overall']), *report['steps'].items(), ('event loop lag', report['loop_lag'])]:
+        print(f"{step:<22} {s['count']:>7} {s['p50_ms']:>8.1f}ms {s['p95_ms']:>8.1f}ms {s['p99_ms']:>8.1f}ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ Отчёт сохранён в {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон диспетчера aiogram")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--api-latency', type=float, default=0.0, help="задержка фейкового Bot API, мс")
+    parser.add_argument('--think-time', type=float, default=0.0, help="макс. пауза пользователя между шагами, мс")
+    parser.add_argument('--quiz-mode', choices=['reply', 'inline'], default='reply')
+    parser.add_argument('--throttling', action='store_true', help="не отключать ThrottlingMiddleware")
+    parser.add_argument('--no-valentines', dest='valentines', action='store_false')
+    parser.add_argument('--seed', type=int, default=14)
+    parser.add_argument('--output', help="путь для JSON-отчёта")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Память на пользователя в снимке анкет и в списке совпадений.
+
+    python -m benchmarks.memory                 # 100k пользователей
+    python -m benchmarks.memory --users 10000
+
+«before» — прежняя раскладка (словарь на пользователя со словарём
+списков ответов, словарь на совпадение), «after» — AnswersSnapshot
+и Match из records.py. Считается через tracemalloc.
+"""
+import argparse
+import gc
+import tracemalloc
+
+from questions import TestEngine
+from records import Match, UserProfile
+from snapshot import AnswersSnapshot
+from benchmarks.synthetic import generate_users
+
+
+def allocated(build):
+    """(объект, байт выделено при его построении)."""
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size
+
+
+def legacy_snapshot(rows, test_engine):
+    users = []
+    index = {}
+    for row in rows:
+        index[row['telegram_id']] = len(users)
+        users.append({
+            'telegram_id': row['telegram_id'],
+            'username': row['username'],
+            'full_name': row['full_name'],
+            'answers': test_engine.deserialize_answers(row['answers_json'], row['questionnaire_version']),
+        })
+    return users, index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память снимка анкет и совпадений")
+    parser.add_argument('--users', type=int, default=100000)
+    args = parser.parse_args()
+
+    test_engine = TestEngine()
+    rows = generate_users(test_engine, args.users)
+    # Строки имён живут в rows в обоих вариантах, поэтому в замер не попадают
+    profiles = [UserProfile(r['telegram_id'], r['username'], r['full_name']) for r in rows]
+
+    results = [
+        ('snapshot', 'before', allocated(lambda: legacy_snapshot(rows, test_engine))[1]),
+        ('snapshot', 'after', allocated(lambda: AnswersSnapshot(rows, test_engine))[1]),
+        ('matches', 'before', allocated(lambda: [
+            {'telegram_id': p.telegram_id, 'username': p.username, 'full_name': p.full_name, 'similarity': 0.5}
+            for p in profiles
+        ])[1]),
+        ('matches', 'after', allocated(lambda: [Match.of(p, 0.5) for p in profiles])[1]),
+    ]
+
+    for name, variant, size in results:
+        print(f"{name:<10} {variant:<7} {size / 1024 / 1024:8.1f} MiB  {size / args.users:8.0f} B/пользователь")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Бенчмарки горячих путей подбора совместимости.
+
+    python -m benchmarks.run                          # 1k / 10k / 100k
+    python -m benchmarks.run --sizes 1000 --output bench.json
+    python -m benchmarks.run --compare old.json       # сравнить с прошлым прогоном
+
+Результаты пишутся в JSON, чтобы сравнивать прогоны между коммитами.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from answer_matrix import AnswerMatrix, write_answer_matrix
+from questions import TestEngine
+from benchmarks.synthetic import (
+    StubBot,
+    StubDatabase,
+    generate_answers,
+    generate_users,
+    import_bot_module,
+    make_message,
+    make_state,
+)
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def measure(func, repeat):
+    """Запускает func repeat раз, возвращает список длительностей в секундах."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(name, users, ops, timings):
+    median = statistics.median(timings)
+    return {
+        'name': name,
+        'users': users,
+        'ops': ops,
+        'repeat': len(timings),
+        'min_s': min(timings),
+        'median_s': median,
+        'mean_s': statistics.fmean(timings),
+        'per_op_us': median / ops * 1e6 if ops else None,
+    }
+
+
+def bench_engine(test_engine, users, answers, repeat):
+    size = len(users)
+    target = answers[0]
+    answers_strings = [u['answers_json'] for u in users]
+    rows = [(u['telegram_id'], u['answers_json'], u['questionnaire_version']) for u in users]
+
+    yield summarize('serialize_answers', size, size, measure(
+        lambda: [test_engine.serialize_answers(a) for a in answers], repeat))
+
+    yield summarize('deserialize_answers', size, size, measure(
+        lambda: [test_engine.deserialize_answers(s) for s in answers_strings], repeat))
+
+    yield summarize('calculate_similarity', size, size, measure(
+        lambda: [test_engine.calculate_similarity(target, a) for a in answers], repeat))
+
+    yield summarize('find_matches', size, size, measure(
+        lambda: test_engine.find_matches(target, rows), repeat))
+
+    # Тот же top-K по mmap-матрице ответов (dump.py matrix)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'answers.matrix')
+        write_answer_matrix(path, ((u['telegram_id'], a) for u, a in zip(users, answers)), test_engine)
+        matrix = AnswerMatrix(path, test_engine)
+        try:
+            yield summarize('matrix_top_matches', size, size, measure(
+                lambda: matrix.top_matches(target), repeat))
+        finally:
+            matrix.close()
+
+
+def bench_handler(bot_module, stub_db, users, repeat):
+    """
+    Полный find_matches_handler: снимок анкет, скоринг, ответ.
+    _cold — каждый раз с загрузкой и декодированием таблицы,
+    без суффикса — по уже загруженному общему снимку,
+    _stream — потоково порциями (COMPATIBILITY_SOURCE=stream),
+    _matrix — по общей mmap-матрице ответов (COMPATIBILITY_SOURCE=matrix).
+    peak_kib — пик выделенной памяти за один вызов (tracemalloc).
+    """
+    size = len(users)
+    stub_db.set_users(users)
+    stub_bot = StubBot()
+    storage = MemoryStorage()
+    telegram_id = users[0]['telegram_id']
+
+    async def run_once(mode):
+        bot_module.COMPATIBILITY_SOURCE = mode if mode in ('stream', 'matrix') else 'snapshot'
+        if mode == 'cold':
+            bot_module.answers_snapshot.invalidate()
+        message = make_message(stub_bot, telegram_id, "✨ Совместимость")
+        state = make_state(storage, stub_bot, telegram_id)
+        await bot_module.find_matches_handler(message, state)
+
+    matrix_dir = tempfile.TemporaryDirectory()
+    bot_module.ANSWER_MATRIX_PATH = os.path.join(matrix_dir.name, 'answers.matrix')
+    bot_module.answer_matrix = None
+    write_answer_matrix(bot_module.ANSWER_MATRIX_PATH, (
+        (u['telegram_id'], bot_module.test_engine.deserialize_answers(u['answers_json'])) for u in users
+    ), bot_module.test_engine)
+
+    loop = asyncio.new_event_loop()
+    try:
+        for mode, name in (
+            ('cold', 'find_matches_handler_cold'),
+            ('warm', 'find_matches_handler'),
+            ('stream', 'find_matches_handler_stream'),
+            ('matrix', 'find_matches_handler_matrix'),
+        ):
+            stub_bot.calls.clear()
+            timings = measure(lambda: loop.run_until_complete(run_once(mode)), repeat)
+            result = summarize(name, size, 1, timings)
+            result['bot_api_calls'] = sum(stub_bot.calls.values()) / repeat
+
+            tracemalloc.start()
+            loop.run_until_complete(run_once(mode))
+            result['peak_kib'] = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+            yield result
+    finally:
+        loop.close()
+        bot_module.COMPATIBILITY_SOURCE = 'snapshot'
+        if bot_module.answer_matrix is not None:
+            bot_module.answer_matrix.close()
+            bot_module.answer_matrix = None
+        matrix_dir.cleanup()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    old = {(r['name'], r['users']): r for r in baseline['results']}
+    print(f"\nСравнение с {baseline_path} ({baseline['meta'].get('revision')}):")
+    for result in current['results']:
+        prev = old.get((result['name'], result['users']))
+        if not prev:
+            continue
+        ratio = result['median_s'] / prev['median_s'] if prev['median_s'] else float('inf')
+        print(f"  {result['name']:<28} {result['users']:>7}  x{ratio:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки подбора совместимости")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    test_engine = TestEngine()
+    stub_db = StubDatabase()
+    bot_module = import_bot_module(stub_db)
+
+    results = []
+    for size in args.sizes:
+        answers = generate_answers(test_engine, size)
+        users = generate_users(test_engine, size)
+        # На 100k полный прогон долгий, поэтому повторов меньше
+        repeat = max(1, args.repeat if size < 100000 else args.repeat // 2)
+
+        for result in bench_engine(test_engine, users, answers, repeat):
+            results.append(result)
+            print(f"{result['name']:<28} {size:>7}  {result['median_s'] * 1000:10.2f} ms")
+
+        for result in bench_handler(bot_module, stub_db, users, repeat):
+            results.append(result)
+            print(f"{result['name']:<28} {size:>7}  {result['median_s'] * 1000:10.2f} ms")
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': results,
+    }
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Результаты сохранены в {args.output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
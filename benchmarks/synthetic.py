@@ -0,0 +1,184 @@
+"""
+Синтетические пользователи и заглушки Database/Bot для бенчмарков.
+
+Распределение ответов приближено к реальному: у каждого вопроса есть
+«популярные» варианты (веса убывают по Ципфу), в multi-вопросах чаще
+выбирают 1–2 варианта, реже 3–4.
+"""
+import os
+import random
+from datetime import datetime
+
+from questions import TestEngine, QUESTIONNAIRE_VERSION
+from records import UserProfile
+
+SEED = 14022025
+# Сколько вариантов обычно выбирают в multi-вопросе и с какой вероятностью
+MULTI_PICK_WEIGHTS = {1: 0.35, 2: 0.35, 3: 0.2, 4: 0.1}
+
+
+def _option_weights(rng, count):
+    """Веса вариантов по Ципфу в случайном порядке (у каждого вопроса свой фаворит)."""
+    weights = [1.0 / (rank + 1) for rank in range(count)]
+    rng.shuffle(weights)
+    return weights
+
+
+def generate_answers(test_engine, count, seed=SEED):
+    """Возвращает список словарей ответов {индекс вопроса: [варианты]} длиной count."""
+    rng = random.Random(seed)
+    weights = [_option_weights(rng, len(q['options'])) for q in test_engine.questions]
+    picks = list(MULTI_PICK_WEIGHTS)
+    pick_weights = list(MULTI_PICK_WEIGHTS.values())
+
+    result = []
+    for _ in range(count):
+        answers = {}
+        for i, question in enumerate(test_engine.questions):
+            options = range(len(question['options']))
+            if question['type'] == 'single':
+                answers[i] = rng.choices(options, weights[i])
+            else:
+                k = min(rng.choices(picks, pick_weights)[0], len(question['options']))
+                chosen = set()
+                while len(chosen) < k:
+                    chosen.add(rng.choices(options, weights[i])[0])
+                answers[i] = sorted(chosen)
+        result.append(answers)
+    return result
+
+
+def generate_users(test_engine, count, seed=SEED):
+    """Строки в формате Database.get_all_users_with_answers()."""
+    return [
+        {
+            'telegram_id': 100000 + i,
+            'username': f"user{i}",
+            'full_name': f"Пользователь {i}",
+            'answers_json': test_engine.serialize_answers(answers),
+            'questionnaire_version': QUESTIONNAIRE_VERSION,
+        }
+        for i, answers in enumerate(generate_answers(test_engine, count, seed))
+    ]
+
+
+class StubConnection:
+    def cursor(self, *args, **kwargs):
+        return None
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StubDatabase:
+    """Заглушка Database: все данные в памяти, без PostgreSQL."""
+
+    def __init__(self, users=None):
+        self.conn = StubConnection()
+        self.set_users(users or [])
+
+    def set_users(self, users):
+        self.users = users
+        self.by_telegram_id = {u['telegram_id']: u for u in users}
+        self.by_username = {u['username']: u for u in users}
+
+    def register_user(self, telegram_id, username, full_name):
+        return True
+
+    def is_registered(self, username):
+        return username.lstrip('@') in self.by_username
+
+    def get_user_by_username(self, username):
+        return self.by_username.get(username.lstrip('@'))
+
+    def get_user_answers(self, telegram_id):
+        user = self.by_telegram_id.get(telegram_id)
+        return user['answers_json'] if user else None
+
+    def get_user_answers_record(self, telegram_id):
+        return self.by_telegram_id.get(telegram_id)
+
+    def get_all_users_with_answers(self):
+        return self.users
+
+    def load_answers_snapshot(self):
+        return self.users
+
+    def iter_users_with_answers(self, chunk_size=2000):
+        for start in range(0, len(self.users), chunk_size):
+            yield self.users[start:start + chunk_size]
+
+    def get_users_by_telegram_ids(self, telegram_ids):
+        return {
+            i: UserProfile(i, self.by_telegram_id[i]['username'], self.by_telegram_id[i]['full_name'])
+            for i in telegram_ids
+            if i in self.by_telegram_id
+        }
+
+    def get_matches_for_users(self, telegram_ids, limit=5, questionnaire_version=QUESTIONNAIRE_VERSION,
+                              max_age=None):
+        # Таблицы matches нет: API и рассылка считают топ по снимку
+        return {}
+
+    def save_top_matches(self, top_matches, k, questionnaire_version=QUESTIONNAIRE_VERSION):
+        pass
+
+    def save_user_answers(self, telegram_id, answers_json, questionnaire_version=QUESTIONNAIRE_VERSION):
+        return True
+
+    def close(self):
+        pass
+
+
+class StubBot:
+    """Заглушка Bot: принимает любой метод Bot API и только считает вызовы."""
+
+    id = 1
+
+    def __init__(self):
+        self.calls = {}
+
+    async def __call__(self, method, request_timeout=None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        return True
+
+
+def import_bot_module(stub_db):
+    """
+    Импортирует bot.py с заглушкой вместо Database.
+    bot.py при импорте создаёт Database (нужен DATABASE_URL), поэтому подменяем класс заранее.
+    """
+    import database
+
+    os.environ.setdefault('BOT_TOKEN', '42:BENCHMARK')
+    database.Database = lambda: stub_db
+
+    import bot
+    bot.db = stub_db
+    return bot
+
+
+def make_message(stub_bot, telegram_id, text):
+    from aiogram import types
+
+    return types.Message(
+        message_id=1,
+        date=datetime.now(),
+        chat=types.Chat(id=telegram_id, type='private'),
+        from_user=types.User(id=telegram_id, is_bot=False, first_name='Bench'),
+        text=text,
+    ).as_(stub_bot)
+
+
+def make_state(storage, stub_bot, telegram_id):
+    from aiogram.fsm.context import FSMContext
+    from aiogram.fsm.storage.base import StorageKey
+
+    return FSMContext(
+        storage=storage,
+        key=StorageKey(bot_id=stub_bot.id, chat_id=telegram_id, user_id=telegram_id),
+    )
@@ -1,4 +1,6 @@
 import asyncio
+import datetime
+import logging
 import os
 import json
 from aiogram import Bot, Dispatcher, types
@@ -6,22 +8,60 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 from dotenv import load_dotenv
 
-from database import Database
+import metrics
+from answer_matrix import AnswerMatrix
+from api import MatchesApi, start_api_server
+from api_session import BotApiSession
+from broadcast import broadcast
+from fanout import fan_out_matches
+from jobs import JobCoordinator
+from lifecycle import InFlightMiddleware, Lifecycle
+from logs import CorrelationMiddleware, setup_logging, stop_logging
+from profiling import SlowHandlerProfiler
+from routing import ButtonRouter
+from pair_cache import PAIR_CACHE_LOOKUPS, PairScoreCache
+from snapshot import SnapshotCache
+import stats
+from throttling import ThrottlingMiddleware
+
+from database import AUDIENCE_SEGMENTS, Database
 from questions import TestEngine
-from valentines import (
-    ValentinesManager, 
-    get_valentine_menu_keyboard,
-    get_anonymity_keyboard,
-    get_photo_choice_keyboard
+from records import Match, UserProfile
+from valentines import ValentinesManager
+from keyboards import (
+    ANONYMITY_KEYBOARD,
+    BUTTON_COMPATIBILITY,
+    BUTTON_MY_ANSWERS,
+    BUTTON_NEXT,
+    BUTTON_TEST,
+    BUTTON_VALENTINES,
+    COMPATIBILITY_MENU_KEYBOARD,
+    MAIN_KEYBOARD,
+    MAIN_MENU_BUTTONS,
+    PHOTO_CHOICE_KEYBOARD,
+    QUESTION_VIEWS,
+    QUIZ_NEXT,
+    RETRY_VALENTINE_KEYBOARD,
+    TEXTS,
+    VALENTINES_MENU_KEYBOARD,
+    VALENTINE_BOXES,
+    VALENTINE_DIRECTIONS,
+    QuizCallback,
+    ValentinesPage,
+    format_top_matches,
+    format_valentines_page,
+    inline_question_keyboard,
+    valentines_page_keyboard,
 )
 
 load_dotenv()
+setup_logging()
+logger = logging.getLogger("bot")
 
 TOKEN = os.getenv('BOT_TOKEN')
 if not TOKEN:
@@ -29,24 +69,72 @@ if not TOKEN:
     print("📝 Создайте файл .env с содержимым: BOT_TOKEN=ваш_токен")
     exit(1)
 
+# Режим теста: "reply" — ответы кнопками под полем ввода, новое сообщение на каждый ответ;
+# "inline" — инлайн-кнопки, один и тот же вопрос редактируется на месте
+QUIZ_MODE = os.getenv('QUIZ_MODE', 'reply')
+
+# Откуда брать анкеты для подбора совместимости: "snapshot" — общий снимок в памяти
+# (см. snapshot.py); "stream" — каждый раз потоково из БД, память не растёт с таблицей;
+# "matrix" — общий mmap-файл ответов, который ведёт matrix_writer.py (один на хост)
+COMPATIBILITY_SOURCE = os.getenv('COMPATIBILITY_SOURCE', 'snapshot')
+ANSWER_MATRIX_PATH = os.getenv('ANSWER_MATRIX_PATH', 'answers.matrix')
+# Сколько лучших совпадений считаем и храним в состоянии
+TOP_MATCHES = 5
+
+# Telegram ID администраторов через запятую: ADMIN_IDS=123,456
+ADMIN_IDS = {int(x) for x in os.getenv('ADMIN_IDS', '').replace(' ', '').split(',') if x}
+
 db = Database()
 test_engine = TestEngine()
+answers_snapshot = SnapshotCache(db.load_answers_snapshot, test_engine)
+answer_matrix = None
+answer_matrix_missing_logged = False
+# Оценки «проверить конкретного человека» по паре пользователей (см. pair_cache.py)
+pair_scores = PairScoreCache()
+# Задачи, которые при нескольких экземплярах бота должны идти в одном (см. jobs.py)
+jobs = JobCoordinator(db)
 
 bot = Bot(
     token=TOKEN,
+    session=BotApiSession(),
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
+dp.update.outer_middleware(CorrelationMiddleware())
+
+# Остановка: дождаться начатых обработчиков и фоновых задач, потом закрывать сессию и БД
+lifecycle = Lifecycle()
+dp.update.outer_middleware(InFlightMiddleware(lifecycle))
+dp.shutdown.register(lifecycle.shutdown)
+lifecycle.on_shutdown(answers_snapshot.wait_idle)
+
+# Кнопки меню и callback_data: поиск обработчика по словарю (см. routing.py)
+buttons = ButtonRouter(dp)
+
+if os.getenv('THROTTLING', '1') == '1':
+    throttling = ThrottlingMiddleware()
+    dp.message.middleware(throttling)
+    dp.callback_query.middleware(throttling)
+
+dp.message.middleware(metrics.HandlerMetricsMiddleware())
+dp.callback_query.middleware(metrics.HandlerMetricsMiddleware())
+metrics.register_fsm_storage(storage)
+
+profiler = SlowHandlerProfiler()
+dp.message.middleware(profiler)
+dp.callback_query.middleware(profiler)
+
 class TestStates(StatesGroup):
     not_waiting = State()
     waiting_for_single_answer = State()
     waiting_for_multi_answer = State()
+    waiting_for_inline_answer = State()
 
 
-valentines_manager = ValentinesManager(bot, db.conn)
+valentines_manager = ValentinesManager(bot, db)
 
 class ValentineStates(StatesGroup):
     waiting_for_recipient = State()
@@ -57,21 +145,6 @@ class ValentineStates(StatesGroup):
 class CompatibilityStates(StatesGroup):
     waiting_for_username = State()
 
-def create_options_keyboard(question_data, question_index):
-    question_type = question_data['type']
-    options = question_data['options']
-    
-    if question_type == 'single':
-        buttons = [[KeyboardButton(text=f"{i+1}. {option}")] for i, option in enumerate(options)]
-    else:
-        buttons = []
-        for i, option in enumerate(options):
-            buttons.append([KeyboardButton(text=f"{i+1}. {option}")])
-        buttons.append([KeyboardButton(text="✅ Далее")])
-
-    keyboard = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
-    return keyboard
-
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
     #await broadcast_message()
@@ -82,18 +155,11 @@ async def cmd_start(message: types.Message, state: FSMContext):
     
     db.register_user(user_id, username, full_name)
 
-    welcome_text = (
-        f"👋 Привет, {full_name}!\n\n"
-        f"Добро пожаловать в <b>HitsLoversBot</b>!\n\n"
-        f"🎯 <b>Как это работает:</b>\n\n"
-        f"📝 Здесь ты можешь пройти тест из {len(test_engine.questions)} вопросов, чтобы 14 февраля Бот мог определить совместимых с тобой людей!\n\n"
-        f"💌 Кроме этого, уже сейчас ты можешь отправить праздничные валентинки людям, которые тоже активировали бота!\n\n"
-        f"🔧 Техподдержка: @MerlinLokot"
-    )
+    welcome_text = TEXTS['welcome'].format(full_name=full_name)
     
-    await message.answer(welcome_text, reply_markup=get_main_keyboard())
+    await message.answer(welcome_text, reply_markup=MAIN_KEYBOARD)
 
-@dp.message(lambda message: message.text == "📝 Пройти тест")
+@buttons.text(BUTTON_TEST)
 async def start_test(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     username = message.from_user.username
@@ -111,15 +177,18 @@ async def start_test(message: types.Message, state: FSMContext):
         await message.answer("Ошибка загрузки вопросов.")
         return
 
+    if QUIZ_MODE == 'inline':
+        await state.set_state(TestStates.waiting_for_inline_answer)
+        await message.answer(QUESTION_VIEWS[0].text, reply_markup=inline_question_keyboard(0))
+        return
+
     if question_data['type'] == 'single':
         await state.set_state(TestStates.waiting_for_single_answer)
     else:
         await state.set_state(TestStates.waiting_for_multi_answer)
 
-    question_text = f"<b>Вопрос 1/{len(test_engine.questions)}</b>\n\n{question_data['text']}"
-    keyboard = create_options_keyboard(question_data, 0)
-    
-    await message.answer(question_text, reply_markup=keyboard)
+    view = QUESTION_VIEWS[0]
+    await message.answer(view.text, reply_markup=view.keyboard)
 
 @dp.message(TestStates.waiting_for_single_answer)
 async def process_single_answer(message: types.Message, state: FSMContext):
@@ -141,14 +210,14 @@ async def process_single_answer(message: types.Message, state: FSMContext):
         if answer_text[0].isdigit():
             option_num = int(answer_text.split('.')[0]) - 1
         else:
-            await message.answer("Пожалуйста, выберите вариант из списка.")
+            await message.answer(TEXTS['choose_option'])
             return
     except (ValueError, IndexError):
-        await message.answer("Пожалуйста, выберите вариант из списка.")
+        await message.answer(TEXTS['choose_option'])
         return
 
     if option_num < 0 or option_num >= len(question_data['options']):
-        await message.answer("Пожалуйста, выберите вариант из списка.")
+        await message.answer(TEXTS['choose_option'])
         return
 
     answers[current_q] = [option_num]
@@ -169,7 +238,7 @@ async def process_multi_answer(message: types.Message, state: FSMContext):
 
     answer_text = message.text.strip()
 
-    if answer_text == "✅ Далее":
+    if answer_text == BUTTON_NEXT:
         if current_q not in answers or not answers[current_q]:
             await message.answer("Пожалуйста, выберите хотя бы один вариант перед тем как продолжить.")
             return
@@ -181,14 +250,14 @@ async def process_multi_answer(message: types.Message, state: FSMContext):
         if answer_text[0].isdigit():
             option_num = int(answer_text.split('.')[0]) - 1
         else:
-            await message.answer("Пожалуйста, выберите вариант из списка.")
+            await message.answer(TEXTS['choose_option'])
             return
     except (ValueError, IndexError):
-        await message.answer("Пожалуйста, выберите вариант из списка.")
+        await message.answer(TEXTS['choose_option'])
         return
 
     if option_num < 0 or option_num >= len(question_data['options']):
-        await message.answer("Пожалуйста, выберите вариант из списка.")
+        await message.answer(TEXTS['choose_option'])
         return
     
     if current_q not in answers:
@@ -231,44 +300,91 @@ async def go_to_next_question(message: types.Message, state: FSMContext, current
         else:
             await state.set_state(TestStates.waiting_for_multi_answer)
 
-        question_text = f"<b>Вопрос {next_q+1}/{len(test_engine.questions)}</b>\n\n{question_data['text']}"
-        if question_data['type'] == 'multi':
-            question_text += " \n\n<b>(несколько вариантов ответа)</b>"
-        
-        keyboard = create_options_keyboard(question_data, next_q)
-        
-        await message.answer(question_text, reply_markup=keyboard)
+        view = QUESTION_VIEWS[next_q]
+        await message.answer(view.text, reply_markup=view.keyboard)
     else:
-        answers_json = test_engine.serialize_answers(answers)
-        db.save_user_answers(user_id, answers_json)
-        
-        await state.clear()
+        await save_test_answers(message.from_user, state, answers)
+
+        await message.answer(TEXTS['test_completed'], reply_markup=MAIN_KEYBOARD)
+
+async def save_test_answers(user: types.User, state: FSMContext, answers):
+    answers_json = test_engine.serialize_answers(answers)
+    if db.save_user_answers(user.id, answers_json, test_engine.version):
+        answers_snapshot.upsert(user.id, user.username, user.full_name, answers)
+        pair_scores.invalidate_user(user.id)
+
+    await state.clear()
+
+@dp.callback_query(TestStates.waiting_for_inline_answer, QuizCallback.filter())
+async def process_inline_answer(callback: CallbackQuery, callback_data: QuizCallback, state: FSMContext):
+    """
+    Ответ в инлайн-режиме: вместо нового сообщения на каждый ответ
+    редактируется одно и то же сообщение с вопросом.
+    """
+    data = await state.get_data()
+    current_q = data.get('current_question', 0)
+    answers = data.get('answers', {})
+
+    # Нажатие на кнопку старого вопроса
+    if callback_data.question != current_q:
+        await callback.answer()
+        return
+
+    question_data = test_engine.get_question(current_q)
+    option = callback_data.option
+
+    if option == QUIZ_NEXT:
+        if not answers.get(current_q):
+            await callback.answer("Выберите хотя бы один вариант")
+            return
+    elif not 0 <= option < len(question_data['options']):
+        await callback.answer()
+        return
+    elif question_data['type'] == 'single':
+        answers[current_q] = [option]
+    else:
+        selected = answers.setdefault(current_q, [])
+        if option in selected:
+            selected.remove(option)
+        else:
+            selected.append(option)
 
-        congrats_text = (
-            "🎉 <b>Поздравляю! Ты завершил тест!</b>\n\n"
-            f"Твои ответы сохранены и могут быть использованы для анализа совместимости\n\n"
-            f"Теперь ты можешь:\n"
-            f"• 📊 Посмотреть свои ответы\n"
-            f"• 📝 Перепройти тест\n"
-            f"• 💝 Ждать подбора совместимых людей 14 февраля!\n\n"
+        await state.update_data(answers=answers)
+        await callback.answer()
+        await callback.message.edit_reply_markup(
+            reply_markup=inline_question_keyboard(current_q, frozenset(selected))
         )
-        
-        await message.answer(congrats_text, reply_markup=get_main_keyboard())
+        return
+
+    await callback.answer()
+
+    next_q = current_q + 1
+    if next_q < len(test_engine.questions):
+        await state.update_data(current_question=next_q, answers=answers)
+        await callback.message.edit_text(
+            QUESTION_VIEWS[next_q].text,
+            reply_markup=inline_question_keyboard(next_q)
+        )
+    else:
+        await save_test_answers(callback.from_user, state, answers)
+        await callback.message.edit_text(TEXTS['test_completed'])
 
-@dp.message(lambda message: message.text == "📊 Мои ответы")
+@buttons.text(BUTTON_MY_ANSWERS, yield_to=TestStates)
 async def show_my_answers(message: types.Message):
     user_id = message.from_user.id
     
-    answers_json = db.get_user_answers(user_id)
+    answers_record = db.get_user_answers_record(user_id)
     
-    if not answers_json:
+    if not answers_record:
         await message.answer(
             "Вы ещё не проходили тест. Нажмите '📝 Пройти тест' чтобы начать!",
-            reply_markup=get_main_keyboard()
+            reply_markup=MAIN_KEYBOARD
         )
         return
 
-    answers_dict = test_engine.deserialize_answers(answers_json)
+    answers_dict = test_engine.deserialize_answers(
+        answers_record['answers_json'], answers_record['questionnaire_version']
+    )
 
     text = "📋 <b>Ваши ответы:</b>\n\n"
     
@@ -290,80 +406,119 @@ async def show_my_answers(message: types.Message):
             text += "❌ Нет ответа\n\n"
 
     
-    await message.answer(text, reply_markup=get_main_keyboard())
+    await message.answer(text, reply_markup=MAIN_KEYBOARD)
 
-@dp.message(lambda message: message.text == "✨ Совместимость")
+@buttons.text(BUTTON_COMPATIBILITY, yield_to=TestStates)
 async def find_matches_handler(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    
-    # Получаем ответы пользователя
-    answers_json = db.get_user_answers(user_id)
-    
-    if not answers_json:
+
+    matrix = open_answer_matrix() if COMPATIBILITY_SOURCE == 'matrix' else None
+    snapshot = None
+    if matrix is not None:
+        user_answers = matrix.answers(user_id) or get_own_answers(user_id)
+        population = len(matrix)
+    elif COMPATIBILITY_SOURCE == 'stream':
+        user_answers = get_own_answers(user_id)
+        population = None
+    else:
+        snapshot = await answers_snapshot.get()
+        # Ответы пользователя берём из снимка, в БД идём только если его там нет
+        user_answers = snapshot.answers(user_id) or get_own_answers(user_id)
+        population = len(snapshot)
+
+    if not user_answers:
         await message.answer(
             "Сначала пройдите тест, чтобы найти совместимых людей\n\n"
             "⚠️ Если же вы уже проходили тест, к сожалению, Бот не смог сохранить ваши ответы 😞 Но всё в порядке! Просто пройдите тест заново, и в этот раз результаты точно не пропадут!",
-            reply_markup=get_main_keyboard()
+            reply_markup=MAIN_KEYBOARD
         )
         return
 
-    # Получаем всех пользователей с ответами
-    all_users = db.get_all_users_with_answers()
-    
-    if len(all_users) < 2:
+    if population is not None and population < 2:
         await message.answer(
             "Пока недостаточно пользователей для поиска совпадений.\n"
             "Пригласи друзей пройти тест!",
-            reply_markup=get_main_keyboard()
+            reply_markup=MAIN_KEYBOARD
         )
         return
 
-    user_answers = test_engine.deserialize_answers(answers_json)
+    if matrix is not None:
+        matches = matrix_matches(matrix, user_id, user_answers)
+    else:
+        if snapshot is not None:
+            metrics.SIMILARITY_COMPUTATIONS.inc(len(snapshot))
+            candidates = snapshot.candidates(exclude_id=user_id)
+        else:
+            candidates = stream_candidates(user_id)
 
-    # Рассчитываем совместимость
-    matches = []
-    for other_user in all_users:
-        if other_user['telegram_id'] == user_id:
-            continue
-        
-        other_answers = test_engine.deserialize_answers(other_user['answers_json'])
-        similarity = test_engine.calculate_similarity(user_answers, other_answers)
-        
-        matches.append({
-            'telegram_id': other_user['telegram_id'],
-            'username': other_user['username'],
-            'full_name': other_user['full_name'],
-            'similarity': similarity
-        })
+        # Держим только лучшие TOP_MATCHES, остальное сразу отбрасываем
+        matches = [
+            Match.of(profile, similarity)
+            for profile, similarity in test_engine.top_matches_encoded(user_answers, candidates, TOP_MATCHES)
+        ]
 
-    # Сортируем по убыванию совместимости
-    matches.sort(key=lambda x: x['similarity'], reverse=True)
-    
     # Сохраняем в состояние для дальнейшего использования
     await state.update_data(matches_list=matches)
 
     if matches:
-        # Создаём клавиатуру с двумя вариантами
-        buttons = [
-            [InlineKeyboardButton(text="🌟 ТОП совместимых", callback_data="show_top_matches")],
-            [InlineKeyboardButton(text="🔮 Проверить совместимость с..", callback_data="check_specific_person")]
-        ]
-        keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-        
-        text = (
-            "✨ <b>Отлично! Результаты тестов на совместимость проанализированы!</b>\n\n"
-            "Выберите, что хотите сделать:"
-        )
-        
-        await message.answer(text, reply_markup=keyboard)
+        await message.answer(TEXTS['compatibility_menu'], reply_markup=COMPATIBILITY_MENU_KEYBOARD)
     else:
         await message.answer(
             "😔 Пока не найдено пользователей для сравнения.\n\n"
             "Пригласите друзей пройти тест!",
-            reply_markup=get_main_keyboard()
+            reply_markup=MAIN_KEYBOARD
         )
 
-@dp.callback_query(lambda c: c.data == "show_top_matches")
+def get_own_answers(user_id):
+    answers_record = db.get_user_answers_record(user_id)
+    if not answers_record:
+        return None
+    return test_engine.deserialize_answers(
+        answers_record['answers_json'], answers_record['questionnaire_version']
+    )
+
+def stream_candidates(user_id):
+    """Анкеты из БД порциями через серверный курсор: в памяти одна порция."""
+    for chunk in db.iter_users_with_answers():
+        metrics.SIMILARITY_COMPUTATIONS.inc(len(chunk))
+        for row in chunk:
+            if row['telegram_id'] == user_id:
+                continue
+            answers = test_engine.deserialize_answers(row['answers_json'], row['questionnaire_version'])
+            yield (
+                UserProfile(row['telegram_id'], row['username'], row['full_name']),
+                test_engine.encode_answers(answers)
+            )
+
+def open_answer_matrix():
+    """Общая матрица ответов (только чтение); None, если writer её ещё не создал."""
+    global answer_matrix, answer_matrix_missing_logged
+    if answer_matrix is None:
+        try:
+            answer_matrix = AnswerMatrix(ANSWER_MATRIX_PATH, test_engine)
+        except FileNotFoundError:
+            # Обычное состояние до первого запуска writer — не засоряем лог на каждый запрос
+            if not answer_matrix_missing_logged:
+                logger.warning("Матрицы ответов ещё нет, считаем по снимку", extra={"path": ANSWER_MATRIX_PATH})
+                answer_matrix_missing_logged = True
+            return None
+        except (OSError, ValueError):
+            logger.exception("❌ Матрица ответов недоступна, считаем по снимку", extra={"path": ANSWER_MATRIX_PATH})
+            return None
+    return answer_matrix
+
+def matrix_matches(matrix, user_id, user_answers):
+    """Лучшие совпадения по mmap-матрице; имена — одним запросом для TOP_MATCHES id."""
+    metrics.SIMILARITY_COMPUTATIONS.inc(len(matrix))
+    top = matrix.top_matches(user_answers, TOP_MATCHES, exclude_id=user_id)
+    profiles = db.get_users_by_telegram_ids([telegram_id for telegram_id, _ in top])
+    return [
+        Match.of(profiles[telegram_id], similarity)
+        for telegram_id, similarity in top
+        if telegram_id in profiles
+    ]
+
+@buttons.callback("show_top_matches")
 async def show_top_matches(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     
@@ -377,48 +532,15 @@ async def show_top_matches(callback: CallbackQuery, state: FSMContext):
         )
         return
     
-    text = "⚡ <b>Вау! Вот с какими людьми у тебя наибольшая совместимость! </b>\n\n"
-    
-    for i, match in enumerate(matches[:5], 1):
-        percent = int(match['similarity'] * 100)
-        
-        # Визуальный прогресс-бар
-        filled = "🟩" * (percent // 10)
-        empty = "🟦" * (10 - (percent // 10))
-        progress = f"{filled}{empty}"
-        
-        # Формируем имя
-        if match.get('full_name'):
-            name = match['full_name']
-            if match.get('username'):
-                name += f" (@{match['username']})"
-        elif match.get('username'):
-            name = f"@{match['username']}"
-        else:
-            name = f"Пользователь {match['telegram_id']}"
-        
-        # Медаль за место
-        if i == 1:
-            medal = "🥇"
-        elif i == 2:
-            medal = "🥈"
-        elif i == 3:
-            medal = "🥉"
-        else:
-            medal = "🌟"
-        
-        text += f"{medal} <b>{i}. {name}</b>\n"
-        text += f"   <code>{progress}</code> <b>{percent}%</b>\n\n"
-    
-    text += "\n💫 Как здорово, когда есть люди, с которыми ты на одной волне!"
-    
-    # Кнопка для возврата
-    buttons = [[InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_compatibility_menu")]]
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+    text = (
+        TEXTS['top_matches_header']
+        + format_top_matches(matches[:TOP_MATCHES])
+        + TEXTS['top_matches_footer']
+    )
     
     await callback.message.edit_text(text)
 
-@dp.callback_query(lambda c: c.data == "check_specific_person")
+@buttons.callback("check_specific_person")
 async def ask_for_username(callback: CallbackQuery, state: FSMContext):
     """Запрашивает username для проверки совместимости"""
     await callback.answer()
@@ -433,6 +555,14 @@ async def ask_for_username(callback: CallbackQuery, state: FSMContext):
     
     await callback.message.edit_text(text, reply_markup=None)
 
+async def reject_self_check(message: types.Message, state: FSMContext):
+    # Пару (u, u) не считаем и не сохраняем: иначе человек попадёт в собственный топ
+    await message.answer(
+        "🙃 Это же вы! Введите никнейм другого человека.",
+        reply_markup=MAIN_KEYBOARD
+    )
+    await state.clear()
+
 @dp.message(CompatibilityStates.waiting_for_username)
 async def check_specific_person(message: types.Message, state: FSMContext):
     """Проверяет совместимость с конкретным пользователем"""
@@ -441,46 +571,69 @@ async def check_specific_person(message: types.Message, state: FSMContext):
     # Очищаем username
     clean_username = username[1:] if username.startswith('@') else username
     
-    # Получаем данные пользователя
-    target_user = db.get_user_by_username(clean_username)
-    
-    if not target_user:
-        await message.answer(
-            f"❌ Пользователь @{clean_username} не найден в базе.\n\n"
-            "Убедитесь, что он зарегистрирован в боте и прошел тест.",
-            reply_markup=get_main_keyboard()
-        )
-        await state.clear()
-        return
-    
-    # Получаем ответы текущего пользователя
     current_user_id = message.from_user.id
-    current_answers_json = db.get_user_answers(current_user_id)
-    
-    if not current_answers_json:
-        await message.answer(
-            "❌ Сначала пройдите тест!",
-            reply_markup=get_main_keyboard()
-        )
-        await state.clear()
-        return
-    
-    # Получаем ответы целевого пользователя
-    target_answers_json = db.get_user_answers(target_user['telegram_id'])
-    
-    if not target_answers_json:
-        await message.answer(
-            f"❌ Пользователь @{clean_username} ещё не прошел тест.",
-            reply_markup=get_main_keyboard()
-        )
-        await state.clear()
+    own_username = message.from_user.username
+
+    if own_username and clean_username.lower() == own_username.lower():
+        await reject_self_check(message, state)
         return
-    
-    # Рассчитываем совместимость
-    current_answers = test_engine.deserialize_answers(current_answers_json)
-    target_answers = test_engine.deserialize_answers(target_answers_json)
-    
-    similarity = test_engine.calculate_similarity(current_answers, target_answers)
+
+    # Повторная проверка той же пары — без обращения к БД
+    target = pair_scores.profile(clean_username)
+    similarity = pair_scores.get(current_user_id, target.telegram_id) if target else None
+    if similarity is not None:
+        PAIR_CACHE_LOOKUPS.inc(1, "memory")
+    else:
+        pair = db.get_pair_check(current_user_id, clean_username, test_engine.version)
+
+        if not pair:
+            await message.answer(
+                f"❌ Пользователь @{clean_username} не найден в базе.\n\n"
+                "Убедитесь, что он зарегистрирован в боте и прошел тест.",
+                reply_markup=MAIN_KEYBOARD
+            )
+            await state.clear()
+            return
+
+        # username в БД мог остаться прежним — сверяем ещё и по telegram_id
+        if pair['telegram_id'] == current_user_id:
+            await reject_self_check(message, state)
+            return
+
+        if not pair['own_answers']:
+            await message.answer(
+                "❌ Сначала пройдите тест!",
+                reply_markup=MAIN_KEYBOARD
+            )
+            await state.clear()
+            return
+
+        if not pair['target_answers']:
+            await message.answer(
+                f"❌ Пользователь @{clean_username} ещё не прошел тест.",
+                reply_markup=MAIN_KEYBOARD
+            )
+            await state.clear()
+            return
+
+        target = UserProfile(pair['telegram_id'], pair['username'], pair['full_name'])
+        pair_scores.remember_profile(clean_username, target)
+
+        if pair['stored_score'] is not None:
+            # REAL в БД: округляем обратно до двух знаков, как calculate_similarity
+            similarity = round(pair['stored_score'], 2)
+            PAIR_CACHE_LOOKUPS.inc(1, "matches")
+        else:
+            # Рассчитываем совместимость и сохраняем пару для других экземпляров и перезапусков
+            current_answers = test_engine.deserialize_answers(pair['own_answers'], pair['own_version'])
+            target_answers = test_engine.deserialize_answers(pair['target_answers'], pair['target_version'])
+            similarity = test_engine.calculate_similarity(current_answers, target_answers)
+            metrics.SIMILARITY_COMPUTATIONS.inc()
+            PAIR_CACHE_LOOKUPS.inc(1, "computed")
+            db.save_match(pair['own_id'], pair['target_id'], similarity, test_engine.version)
+
+        pair_scores.put(current_user_id, target.telegram_id, similarity)
+
     percent = int(similarity * 100)
     
     # Визуальный прогресс-бар
@@ -489,12 +642,12 @@ async def check_specific_person(message: types.Message, state: FSMContext):
     progress = f"{filled}{empty}"
     
     # Формируем имя
-    if target_user.get('full_name'):
-        name = target_user['full_name']
-        if target_user.get('username'):
-            name += f" (@{target_user['username']})"
+    if target.full_name:
+        name = target.full_name
+        if target.username:
+            name += f" (@{target.username})"
     else:
-        name = f"@{target_user['username']}"
+        name = f"@{target.username}"
     
     text = (
         f"<b>Результат совместимости!</b>\n\n"
@@ -502,16 +655,10 @@ async def check_specific_person(message: types.Message, state: FSMContext):
         f"  <code>{progress}</code> <b>{percent}%</b>\n\n"
     )
     
-    # Кнопки для действий
-    buttons = [
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="show_top_matches")]
-    ]
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    
     await message.answer(text)
     await state.clear()
 
-@dp.callback_query(lambda c: c.data == "back_to_compatibility_menu")
+@buttons.callback("back_to_compatibility_menu")
 async def back_to_compatibility_menu(callback: CallbackQuery, state: FSMContext):
     """Возврат в меню совместимости"""
     await callback.answer()
@@ -519,42 +666,44 @@ async def back_to_compatibility_menu(callback: CallbackQuery, state: FSMContext)
     
     # Вызываем заново обработчик совместимости
     message = callback.message
-    message.text = "✨ Совместимость"
+    message.text = BUTTON_COMPATIBILITY
     await find_matches_handler(message, state)
 
-def get_main_keyboard():
-    buttons = [
-        [KeyboardButton(text="📝 Пройти тест"), KeyboardButton(text="📊 Мои ответы")],
-        [KeyboardButton(text="💌 Валентинки"), KeyboardButton(text="✨ Совместимость")],
-    ]
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
-
-@dp.message(lambda message: message.text == "💌 Валентинки")
+@buttons.text(BUTTON_VALENTINES, yield_to=TestStates)
 async def valentines_menu(message: types.Message):
-    text = (
-        "💝 <b>Отправка валентинок</b>\n\n"
-        "Здесь ты можешь отправить анонимное или открытое "
-        "поздравление пользователю, зарегистрированному в боте!\n\n"
-        "✨ <b>Как это работает:</b>\n"
-        "1️⃣ Введи никнейм получателя\n"
-        "2️⃣ Напиши текст валентинки\n"
-        "3️⃣ Добавь фото (по желанию)\n"
-        "4️⃣ Выбери: анонимно или открыто\n\n"
-    )
-
-    buttons = [
-        [InlineKeyboardButton(text="💌 Отправить валентинку", callback_data="send_valentine")]
-    ]
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    
-    await message.answer(text, reply_markup=keyboard)
+    await message.answer(TEXTS['valentines_menu'], reply_markup=VALENTINES_MENU_KEYBOARD)
 
-@dp.callback_query(lambda c: c.data == "back_to_valentines")
+@buttons.callback("back_to_valentines")
 async def back_to_valentines(callback: CallbackQuery):
     await callback.answer()
     await valentines_menu(callback.message)
 
-@dp.callback_query(lambda c: c.data == "send_valentine")
+async def show_valentines_page(callback: CallbackQuery, box, direction=None, cursor=None, edit=True):
+    rows, has_newer, has_older = db.get_valentines_page(callback.from_user.id, box, direction, cursor)
+    text = format_valentines_page(box, rows)
+    keyboard = valentines_page_keyboard(box, rows, has_newer, has_older)
+    if edit:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    else:
+        await callback.message.answer(text, reply_markup=keyboard)
+
+@buttons.callback("my_valentines")
+async def my_valentines(callback: CallbackQuery):
+    await callback.answer()
+    await show_valentines_page(callback, "received", edit=False)
+
+@dp.callback_query(ValentinesPage.filter())
+async def valentines_page(callback: CallbackQuery, callback_data: ValentinesPage):
+    await callback.answer()
+    # callback_data приходит от клиента: подделанный или старый ящик — на первую страницу полученных
+    if callback_data.box not in VALENTINE_BOXES:
+        await show_valentines_page(callback, "received")
+    elif callback_data.direction not in VALENTINE_DIRECTIONS:
+        await show_valentines_page(callback, callback_data.box)
+    else:
+        await show_valentines_page(callback, callback_data.box, callback_data.direction, callback_data.cursor)
+
+@buttons.callback("send_valentine")
 async def start_send_valentine(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     await state.set_state(ValentineStates.waiting_for_recipient)
@@ -572,10 +721,7 @@ async def start_send_valentine(callback: CallbackQuery, state: FSMContext):
 async def process_recipient(message: types.Message, state: FSMContext):
     if message.text == "/cancel":
         await state.clear()
-        await message.answer(
-            "❌ Отправка отменена", 
-            reply_markup=get_main_keyboard()
-        )
+        await message.answer(TEXTS['send_cancelled'], reply_markup=MAIN_KEYBOARD)
         return
     
     username = message.text.strip()
@@ -605,7 +751,7 @@ async def process_recipient(message: types.Message, state: FSMContext):
 async def process_message_text(message: types.Message, state: FSMContext):
     if message.text == "/cancel":
         await state.clear()
-        await message.answer("❌ Отправка отменена", reply_markup=get_main_keyboard())
+        await message.answer(TEXTS['send_cancelled'], reply_markup=MAIN_KEYBOARD)
         return
     
     text = message.text.strip()
@@ -617,19 +763,13 @@ async def process_message_text(message: types.Message, state: FSMContext):
     await state.update_data(message_text=text)
     await state.set_state(ValentineStates.waiting_for_photo)
     
-    buttons = [
-        [InlineKeyboardButton(text="📸 Добавить фото", callback_data="add_photo")],
-        [InlineKeyboardButton(text="⏩ Пропустить", callback_data="skip_photo")]
-    ]
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    
     await message.answer(
         "📸 <b>Шаг 3/4</b> - Хотите добавить фото?\n\n"
         "Вы можете прикрепить изображение к валентинке!",
-        reply_markup=keyboard
+        reply_markup=PHOTO_CHOICE_KEYBOARD
     )
 
-@dp.callback_query(lambda c: c.data == "add_photo")
+@buttons.callback("add_photo")
 async def add_photo(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     await state.set_state(ValentineStates.waiting_for_photo)
@@ -638,27 +778,13 @@ async def add_photo(callback: CallbackQuery, state: FSMContext):
         "или нажмите 'Пропустить'"
     )
 
-@dp.callback_query(lambda c: c.data == "skip_photo")
+@buttons.callback("skip_photo")
 async def skip_photo(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     await state.update_data(photo=None)
     await state.set_state(ValentineStates.waiting_for_anonymity)
     
-    buttons = [
-        [
-            InlineKeyboardButton(text="🕵️ Анонимно", callback_data="send_anonymous"),
-            InlineKeyboardButton(text="👤 Открыто", callback_data="send_open")
-        ],
-        [InlineKeyboardButton(text="🔙 Отмена", callback_data="cancel_send")]
-    ]
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    
-    await callback.message.answer(
-        "🕵️ <b>Шаг 4/4</b> - Выберите режим отправки:\n\n"
-        "• <b>Анонимно</b> - получатель не узнает, кто отправитель\n"
-        "• <b>Открыто</b> - получатель увидит ваше имя",
-        reply_markup=keyboard
-    )
+    await callback.message.answer(TEXTS['choose_anonymity_detailed'], reply_markup=ANONYMITY_KEYBOARD)
 
 @dp.message(ValentineStates.waiting_for_photo)
 async def process_photo(message: types.Message, state: FSMContext):
@@ -666,55 +792,33 @@ async def process_photo(message: types.Message, state: FSMContext):
         await state.update_data(photo=None)
         await state.set_state(ValentineStates.waiting_for_anonymity)
         
-        buttons = [
-            [
-                InlineKeyboardButton(text="🕵️ Анонимно", callback_data="send_anonymous"),
-                InlineKeyboardButton(text="👤 Открыто", callback_data="send_open")
-            ],
-            [InlineKeyboardButton(text="🔙 Отмена", callback_data="cancel_send")]
-        ]
-        keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-        
-        await message.answer(
-            "🕵️ <b>Шаг 4/4</b> - Выберите режим отправки:",
-            reply_markup=keyboard
-        )
+        await message.answer(TEXTS['choose_anonymity'], reply_markup=ANONYMITY_KEYBOARD)
         return
     
     if message.photo:
         await state.update_data(photo=message.photo)
         await state.set_state(ValentineStates.waiting_for_anonymity)
         
-        buttons = [
-            [
-                InlineKeyboardButton(text="🕵️ Анонимно", callback_data="send_anonymous"),
-                InlineKeyboardButton(text="👤 Открыто", callback_data="send_open")
-            ],
-            [InlineKeyboardButton(text="🔙 Отмена", callback_data="cancel_send")]
-        ]
-        keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-        
         await message.answer(
-            "✅ Фото добавлено!\n\n"
-            "🕵️ <b>Шаг 4/4</b> - Выберите режим отправки:",
-            reply_markup=keyboard
+            "✅ Фото добавлено!\n\n" + TEXTS['choose_anonymity'],
+            reply_markup=ANONYMITY_KEYBOARD
         )
     else:
         await message.answer(
             "❌ Пожалуйста, отправьте фото или нажмите 'Пропустить'"
         )
 
-@dp.callback_query(lambda c: c.data == "send_anonymous")
+@buttons.callback("send_anonymous")
 async def send_anonymous_valentine(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     await send_valentine(callback, state, is_anonymous=True)
 
-@dp.callback_query(lambda c: c.data == "send_open")
+@buttons.callback("send_open")
 async def send_open_valentine(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     await send_valentine(callback, state, is_anonymous=False)
 
-@dp.callback_query(lambda c: c.data == "cancel_send")
+@buttons.callback("cancel_send")
 async def cancel_send_valentine(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     await state.clear()
@@ -754,12 +858,7 @@ async def send_valentine(callback: CallbackQuery, state: FSMContext, is_anonymou
         if not result['success']:
             error_text = result['message']
 
-            buttons = [
-                [InlineKeyboardButton(text="💌 Попробовать снова", callback_data="send_valentine")]
-            ]
-            keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-            
-            await callback.message.edit_text(error_text, reply_markup=keyboard)
+            await callback.message.edit_text(error_text, reply_markup=RETRY_VALENTINE_KEYBOARD)
             return
 
         await state.clear()
@@ -770,10 +869,84 @@ async def send_valentine(callback: CallbackQuery, state: FSMContext, is_anonymou
             reply_markup=None
         )
 
+@dp.message(Command("profiling"))
+async def toggle_profiling(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    arg = message.text.split(maxsplit=1)[1].strip().lower() if ' ' in message.text else ''
+    if arg in ("on", "off"):
+        profiler.enabled = arg == "on"
+
+    await message.answer(
+        f"🐢 Профилирование медленных обработчиков: <b>{'включено' if profiler.enabled else 'выключено'}</b>\n"
+        f"Порог: {int(profiler.threshold * 1000)} мс, папка: <code>{profiler.directory}</code>\n\n"
+        f"/profiling on | off"
+    )
+
+@dp.message(Command("stats"))
+async def show_stats(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    counters, histogram = stats.refresh(db, test_engine)
+    await message.answer(stats.format_stats(counters, histogram, test_engine))
+
+@dp.message(Command("fanout_matches"))
+async def fanout_matches_command(message: types.Message):
+    """Персональная рассылка совпадений: /fanout_matches [кампания]. Повторный запуск продолжает."""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    campaign = message.text.split(maxsplit=1)[1].strip() if ' ' in message.text else f"matches-{datetime.date.today().year}"
+
+    async def run():
+        async with jobs.exclusive(f"fanout:{campaign}") as lease:
+            if not lease:
+                await message.answer(f"⏳ Рассылка <code>{campaign}</code> уже идёт на другом экземпляре бота")
+                return
+
+            totals = await fan_out_matches(
+                bot, db, answers_snapshot, test_engine, campaign, TOP_MATCHES,
+                stop_event=lifecycle.stopping, lease=lease
+            )
+            delivery_stats = db.get_delivery_stats(campaign)
+            await message.answer(
+                f"📬 Рассылка <code>{campaign}</code>: в этом запуске "
+                f"отправлено {totals['sent']}, без совпадений {totals['skipped']}, "
+                f"заблокировали бота {totals['blocked']}, ошибок {totals['failed']}\n"
+                f"Всего по кампании: {', '.join(f'{k} {v}' for k, v in sorted(delivery_stats.items())) or 'пусто'}"
+            )
+
+    # В фоне: обработчик сразу освобождается, остановка бота дождётся текущей порции
+    lifecycle.spawn(run(), name=f"fanout:{campaign}")
+    await message.answer(f"🚀 Запускаю персональную рассылку <code>{campaign}</code>")
+
+def parse_audience(args):
+    """Аргументы /broadcast: [сегмент] [ГГГГ-ММ-ДД] [after=telegram_id] → kwargs для iter_audience."""
+    audience = {"segment": "all"}
+    for arg in args:
+        if arg in AUDIENCE_SEGMENTS:
+            audience["segment"] = arg
+        elif arg.startswith("after="):
+            audience["after"] = int(arg[len("after="):])
+        else:
+            audience["since"] = datetime.date.fromisoformat(arg)
+    return audience
+
 @dp.message(Command("broadcast"))
 async def broadcast_message(message: types.Message):
-    BATCH_SIZE = 20
-    DELAY = 1.1
+    """/broadcast [all|completed|not_completed|no_valentine] [зарегистрированы с ГГГГ-ММ-ДД] [after=id]"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    try:
+        audience = parse_audience(message.text.split()[1:])
+    except ValueError:
+        await message.answer(
+            f"❌ Формат: /broadcast [{'|'.join(AUDIENCE_SEGMENTS)}] [ГГГГ-ММ-ДД] [after=telegram_id]"
+        )
+        return
 
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -787,23 +960,15 @@ async def broadcast_message(message: types.Message):
         "если вы состоите в Профсоюзе!"
     )
 
-    users = await db.get_all_user_ids()
-    
-    print(f"Начинаю рассылку для {len(users)} пользователей")
-    
-    for i, user_id in enumerate(users, 1):
-        try:
-            await bot.send_message(user_id, MESSAGE, reply_markup=keyboard)
-            print(f"✓ {i}/{len(users)}", end='\r')
-            
-            if i % BATCH_SIZE == 0:
-                await asyncio.sleep(DELAY)
-                
-        except Exception as e:
-            error_msg = f"Ошибка для {user_id}: {e}"
-            print(f"\n{error_msg}")
-    
-    print(f"\n✅ Рассылка завершена!")
+    async with jobs.exclusive("broadcast") as lease:
+        if not lease:
+            await message.answer("⏳ Рассылка уже идёт на другом экземпляре бота")
+            return
+
+        await broadcast(
+            bot, db.iter_audience(**audience), MESSAGE, reply_markup=keyboard,
+            stop_event=lifecycle.stopping, lease=lease
+        )
 
 @dp.message()
 async def handle_everything_else(message: types.Message, state: FSMContext):
@@ -813,7 +978,7 @@ async def handle_everything_else(message: types.Message, state: FSMContext):
 
     if message.text and (
         message.text.startswith('/') or 
-        message.text in ["📝 Пройти тест", "📊 Мои ответы", "💌 Валентинки", "✨ Совместимость"]
+        message.text in MAIN_MENU_BUTTONS
     ):
         return
 
@@ -823,19 +988,33 @@ async def handle_everything_else(message: types.Message, state: FSMContext):
     await message.answer(
         "❌ Некорректный запрос.\n"
         "Пожалуйста, используйте кнопки меню или команду /start",
-        reply_markup=get_main_keyboard()
+        reply_markup=MAIN_KEYBOARD
     )
 
 
 async def main():
+    metrics_runner = await metrics.start_metrics_server()
+    api_runner = await start_api_server(
+        MatchesApi(db, answers_snapshot, test_engine, pair_scores, os.getenv("API_TOKEN"))
+    )
+    loop_lag_task = asyncio.create_task(metrics.watch_event_loop_lag())
+    lifecycle.spawn(stats.refresh_periodically(db, test_engine, lifecycle.stopping), name="stats")
     try:
+        # SIGTERM/SIGINT обрабатывает aiogram: перестаёт опрашивать Telegram и вызывает
+        # lifecycle.shutdown, пока сессия Bot API ещё открыта
         await dp.start_polling(bot)
     except KeyboardInterrupt:
-        print("\nБот останавливается...")
+        logger.info("Бот останавливается...")
     except Exception as e:
-        print(f"Критическая ошибка: {e}")
+        logger.exception("Критическая ошибка")
     finally:
+        loop_lag_task.cancel()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        if api_runner:
+            await api_runner.cleanup()
         db.close()
+        stop_logging()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
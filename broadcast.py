@@ -1,12 +1,75 @@
 import asyncio
 import logging
-from datetime import datetime
+from contextlib import aclosing
+
 from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+from api_session import bulk_lane
+from logs import Sampler
+
+logger = logging.getLogger("broadcast")
+
+BATCH_SIZE = 20
+DELAY = 1.1
+# Прогресс по каждому получателю логируем выборочно
+PROGRESS_LOG_EVERY = 100
+
+
+async def broadcast(bot: Bot, recipients, text, reply_markup=None, stop_event=None, lease=None):
+    """
+    Отправляет одно и то же сообщение всем recipients — async-итератору
+    telegram_id по возрастанию (Database.iter_audience). Возвращает (отправлено, ошибок).
+    Если задан stop_event (Lifecycle.stopping), при остановке бота рассылка
+    прерывается на границе порции и пишет в лог last_recipient: продолжить
+    можно с after=<last_recipient>. Так же рассылка прерывается, если
+    lease (jobs.Lease) потерял блокировку: её мог взять другой экземпляр.
+    """
+    sent = failed = 0
+    done = 0
+    user_id = None
+    progress_sampler = Sampler(PROGRESS_LOG_EVERY)
+
+    logger.info("Начинаю рассылку")
+
+    # Полоса рассылок: ответы пользователям не ждут свободного соединения
+    with bulk_lane():
+        async with aclosing(recipients):
+            async for user_id in recipients:
+                done += 1
+                try:
+                    try:
+                        await bot.send_message(user_id, text, reply_markup=reply_markup)
+                    except TelegramRetryAfter as e:
+                        # 429: ждём сколько просит Telegram и повторяем один раз
+                        metrics.BROADCAST_RETRY_AFTER.inc()
+                        logger.warning("RetryAfter во время рассылки", extra={"retry_after": e.retry_after})
+                        await asyncio.sleep(e.retry_after)
+                        await bot.send_message(user_id, text, reply_markup=reply_markup)
+
+                    sent += 1
+                    metrics.BROADCAST_MESSAGES.inc(1, "sent")
+                    if progress_sampler():
+                        logger.info("Прогресс рассылки", extra={"done": done, "last_recipient": user_id})
 
+                except Exception as e:
+                    failed += 1
+                    metrics.BROADCAST_MESSAGES.inc(1, "failed")
+                    logger.warning("Ошибка отправки", extra={"recipient": user_id, "error": str(e)})
 
-logging.basicConfig(
-    filename=f'broadcast_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(message)s'
-)
+                if done % BATCH_SIZE == 0:
+                    if stop_event is not None and stop_event.is_set():
+                        logger.warning("Рассылка прервана остановкой бота", extra={
+                            "done": done, "last_recipient": user_id
+                        })
+                        break
+                    if lease is not None and not lease.held():
+                        logger.error("Рассылка прервана: блокировка задачи потеряна", extra={
+                            "done": done, "last_recipient": user_id
+                        })
+                        break
+                    await asyncio.sleep(DELAY)
 
+    logger.info("Рассылка завершена", extra={"sent": sent, "failed": failed, "last_recipient": user_id})
+    return sent, failed
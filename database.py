@@ -1,6 +1,46 @@
+import asyncio
+import logging
 import os
 import psycopg
-from psycopg.rows import dict_row
+from psycopg.rows import class_row, dict_row
+
+from questions import QUESTIONNAIRE_VERSION
+from metrics import timed_query
+from migrations import LATEST_VERSION, current_version
+from records import Match, UserProfile
+
+logger = logging.getLogger("database")
+
+# Сколько строк за раз забирает серверный курсор при потоковом чтении
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 2000))
+
+# Валентинок на странице «📬 Мои валентинки»
+VALENTINES_PAGE_SIZE = 5
+
+# Что выгружает copy_out. Колонки и типы должны совпадать с временными
+# таблицами в copy_in: бинарный COPY не приводит типы.
+EXPORT_QUERIES = {
+    "users": "SELECT id, telegram_id, username, full_name, registered_at FROM users ORDER BY id",
+    "user_answers": (
+        "SELECT user_id, answers_json, questionnaire_version, updated_at "
+        "FROM user_answers ORDER BY user_id"
+    ),
+}
+COPY_BUFFER_SIZE = 1 << 16
+
+# Канал LISTEN/NOTIFY об изменённых анкетах (payload — telegram_id или "*"
+# после массовой загрузки); его слушает matrix_writer.py
+ANSWERS_CHANNEL = "answers_changed"
+
+# Сегменты аудитории рассылки: условие на users u. Каждое проверяется по
+# индексу (user_answers.user_id UNIQUE, valentines_recipient_keyset_idx), а обход
+# идёт по UNIQUE-индексу telegram_id, поэтому порядок стабилен
+AUDIENCE_SEGMENTS = {
+    "all": "TRUE",
+    "completed": "EXISTS (SELECT 1 FROM user_answers ua WHERE ua.user_id = u.id)",
+    "not_completed": "NOT EXISTS (SELECT 1 FROM user_answers ua WHERE ua.user_id = u.id)",
+    "no_valentine": "NOT EXISTS (SELECT 1 FROM valentines v WHERE v.recipient_id = u.id)",
+}
 
 class Database:
     def __init__(self):
@@ -9,46 +49,66 @@ class Database:
         if not DATABASE_URL:
             raise Exception("❌ DATABASE_URL не найден. Добавьте PostgreSQL в Railway.")
         
-        self.conn = psycopg.connect(DATABASE_URL)
-        self.cursor = self.conn.cursor(row_factory=psycopg.rows.dict_row)
-
-        self._init_db()
-
-    def _init_db(self):
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            telegram_id BIGINT UNIQUE NOT NULL,
-            username TEXT,
-            full_name TEXT,
-            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_answers (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER UNIQUE NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            answers_json TEXT NOT NULL,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS matches (
-            id SERIAL PRIMARY KEY,
-            user1_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            user2_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            similarity_score REAL NOT NULL,
-            matched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user1_id, user2_id)
-        )
-        """)
-
+        self.database_url = DATABASE_URL
+        # Подключаемся лениво, при первом запросе: импорт бота не ходит в БД
+        self._conn = None
+        self._cursor = None
+        # Отдельное соединение для загрузки снимка анкет из фонового потока
+        self._snapshot_conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None or self._conn.closed:
+            conn = psycopg.connect(self.database_url)
+            try:
+                self._check_schema(conn)
+            except Exception:
+                conn.close()
+                raise
+            self._conn = conn
+            self._cursor = conn.cursor(row_factory=psycopg.rows.dict_row)
+        return self._conn
+
+    @property
+    def cursor(self):
+        self.conn
+        return self._cursor
+
+    def _check_schema(self, conn):
+        """Один SELECT вместо DDL: схему обновляет python migrations.py перед запуском."""
+        version = current_version(conn)
+        if version < LATEST_VERSION:
+            raise Exception(
+                f"❌ Схема БД устарела (версия {version}, нужна {LATEST_VERSION}). "
+                "Запустите: python migrations.py"
+            )
+        logger.info("✅ Подключение к PostgreSQL", extra={"schema_version": version})
+
+    @timed_query
+    def ping(self):
+        self.cursor.execute("SELECT 1")
+        self.conn.rollback()
+
+    @timed_query
+    def try_advisory_lock(self, key):
+        """
+        Сессионная advisory-блокировка на основном соединении. Держится,
+        пока живо соединение: если процесс умер, Postgres снимает её сам.
+        """
+        self.cursor.execute("SELECT pg_try_advisory_lock(%s) AS locked", (key,))
+        locked = self.cursor.fetchone()["locked"]
+        # Сессионная блокировка переживает commit; транзакцию не держим открытой
         self.conn.commit()
-        print("✅ PostgreSQL база данных инициализирована")
+        return locked
 
+    @timed_query
+    def advisory_unlock(self, key):
+        self.cursor.execute("SELECT pg_advisory_unlock(%s) AS unlocked", (key,))
+        unlocked = self.cursor.fetchone()["unlocked"]
+        self.conn.commit()
+        return unlocked
 
+    @timed_query
     def register_user(self, telegram_id, username, full_name):
         try:
             self.cursor.execute("""
@@ -59,21 +119,42 @@ class Database:
             self.conn.commit()
             return True
         except Exception as e:
-            print(f"❌ Ошибка регистрации: {e}")
+            logger.exception("❌ Ошибка регистрации", extra={"telegram_id": telegram_id})
             return False
 
+    @timed_query
     def count_users(self):
-        self.cursor.execute("SELECT COUNT(*) as count FROM users")
-        return self.cursor.fetchone()["count"]
+        return self.get_stats().get("users", 0)
 
+    @timed_query
     def count_users_with_answers(self):
+        return self.get_stats().get("users_with_answers", 0)
+
+    @timed_query
+    def get_stats(self):
+        """
+        Счётчики из stats_counters (users, users_with_answers, valentines_*).
+        Их ведут триггеры и increment_stat, поэтому это несколько строк, а не COUNT по таблицам.
+        """
+        self.cursor.execute("SELECT name, value FROM stats_counters")
+        return {row["name"]: row["value"] for row in self.cursor.fetchall()}
+
+    @timed_query
+    def get_answer_histogram(self, questionnaire_version=QUESTIONNAIRE_VERSION):
+        """{(вопрос, вариант): сколько раз выбран} для версии анкеты."""
         self.cursor.execute("""
-            SELECT COUNT(DISTINCT u.id) as count
-            FROM users u
-            JOIN user_answers ua ON u.id = ua.user_id
-        """)
-        return self.cursor.fetchone()["count"]
+            SELECT question, option, count
+            FROM answer_histogram
+            WHERE questionnaire_version = %s
+        """, (questionnaire_version,))
+        return {(row["question"], row["option"]): row["count"] for row in self.cursor.fetchall()}
+
+    @timed_query
+    def increment_stat(self, name, amount=1):
+        self.cursor.execute("SELECT stats_bump(%s, %s)", (name, amount))
+        self.conn.commit()
 
+    @timed_query
     def is_registered(self, username):
         clean_username = username[1:] if username.startswith('@') else username
 
@@ -90,6 +171,7 @@ class Database:
         else:
             return False
 
+    @timed_query
     def get_user_by_username(self, username):
         clean_username = username[1:] if username.startswith('@') else username
 
@@ -101,7 +183,8 @@ class Database:
 
         return self.cursor.fetchone()
 
-    def save_user_answers(self, telegram_id, answers_json):
+    @timed_query
+    def save_user_answers(self, telegram_id, answers_json, questionnaire_version=QUESTIONNAIRE_VERSION):
         try:
             self.cursor.execute(
                 "SELECT id FROM users WHERE telegram_id = %s",
@@ -115,19 +198,24 @@ class Database:
             user_id = user["id"]
 
             self.cursor.execute("""
-                INSERT INTO user_answers (user_id, answers_json)
-                VALUES (%s, %s)
+                INSERT INTO user_answers (user_id, answers_json, questionnaire_version)
+                VALUES (%s, %s, %s)
                 ON CONFLICT (user_id)
                 DO UPDATE SET
                     answers_json = EXCLUDED.answers_json,
+                    questionnaire_version = EXCLUDED.questionnaire_version,
                     updated_at = CURRENT_TIMESTAMP
-            """, (user_id, answers_json))
+            """, (user_id, answers_json, questionnaire_version))
+
+            # Доставляется слушателям только после commit
+            self.cursor.execute("SELECT pg_notify(%s, %s)", (ANSWERS_CHANNEL, str(telegram_id)))
 
             self.conn.commit()
             return True
         except Exception as e:
-            print(f"❌ Ошибка сохранения ответов: {e}")
+            logger.exception("❌ Ошибка сохранения ответов", extra={"telegram_id": telegram_id})
             return False
+    @timed_query
     def get_user_answers(self, telegram_id):
         self.cursor.execute("""
             SELECT ua.answers_json
@@ -139,9 +227,55 @@ class Database:
         result = self.cursor.fetchone()
         return result["answers_json"] if result else None
 
+    @timed_query
+    def get_user_answers_record(self, telegram_id):
+        """Ответы пользователя вместе с версией анкеты, по которой они даны."""
+        self.cursor.execute("""
+            SELECT ua.answers_json, ua.questionnaire_version
+            FROM users u
+            JOIN user_answers ua ON u.id = ua.user_id
+            WHERE u.telegram_id = %s
+        """, (telegram_id,))
+
+        return self.cursor.fetchone()
+
+    @timed_query
+    def get_pair_check(self, telegram_id, username, questionnaire_version=QUESTIONNAIRE_VERSION):
+        """
+        Всё для проверки совместимости с конкретным человеком одним запросом:
+        профиль по username, обе анкеты и сохранённая оценка пары из matches,
+        если она посчитана по этой версии анкеты и не старше обеих анкет.
+        None, если username не найден; answers_json может быть None, если теста нет.
+        """
+        self.cursor.execute("""
+            SELECT t.id AS target_id, t.telegram_id, t.username, t.full_name,
+                   ta.answers_json AS target_answers, ta.questionnaire_version AS target_version,
+                   c.id AS own_id,
+                   ca.answers_json AS own_answers, ca.questionnaire_version AS own_version,
+                   m.similarity_score AS stored_score
+            FROM users t
+            LEFT JOIN user_answers ta ON ta.user_id = t.id
+            LEFT JOIN users c ON c.telegram_id = %(telegram_id)s
+            LEFT JOIN user_answers ca ON ca.user_id = c.id
+            LEFT JOIN matches m
+                ON m.user1_id = LEAST(t.id, c.id) AND m.user2_id = GREATEST(t.id, c.id)
+               AND m.questionnaire_version = %(version)s
+               AND m.matched_at >= ta.updated_at AND m.matched_at >= ca.updated_at
+            WHERE t.username = %(username)s OR t.username = %(at_username)s
+            LIMIT 1
+        """, {
+            "telegram_id": telegram_id,
+            "version": questionnaire_version,
+            "username": username,
+            "at_username": f"@{username}",
+        })
+
+        return self.cursor.fetchone()
+
+    @timed_query
     def get_all_users_with_answers(self):
         self.cursor.execute("""
-            SELECT u.telegram_id, u.username, u.full_name, ua.answers_json
+            SELECT u.telegram_id, u.username, u.full_name, ua.answers_json, ua.questionnaire_version
             FROM users u
             JOIN user_answers ua ON u.id = ua.user_id
             WHERE ua.answers_json IS NOT NULL
@@ -149,29 +283,307 @@ class Database:
 
         return self.cursor.fetchall()
 
-    async def get_all_user_ids(self):
-        self.cursor.execute('SELECT telegram_id FROM users')
+    def iter_users_with_answers(self, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Те же строки, что get_all_users_with_answers, но порциями по chunk_size
+        через серверный (именованный) курсор: в памяти одна порция, а не вся таблица.
+        Генератор нужно дочитать или закрыть, прежде чем делать другие запросы.
+        """
+        try:
+            with self.conn.cursor(name="users_with_answers", row_factory=dict_row) as cursor:
+                cursor.itersize = chunk_size
+                cursor.execute("""
+                    SELECT u.telegram_id, u.username, u.full_name, ua.answers_json, ua.questionnaire_version
+                    FROM users u
+                    JOIN user_answers ua ON u.id = ua.user_id
+                    WHERE ua.answers_json IS NOT NULL
+                """)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+        finally:
+            # Серверный курсор живёт внутри транзакции — закрываем её
+            self.conn.commit()
 
-        result = self.cursor.fetchall()
+    @timed_query
+    def load_answers_snapshot(self):
+        """
+        То же, что get_all_users_with_answers, но через собственное соединение:
+        вызывается из потока SnapshotCache, параллельно с запросами обработчиков.
+        """
+        if self._snapshot_conn is None or self._snapshot_conn.closed:
+            self._snapshot_conn = psycopg.connect(self.database_url)
+
+        with self._snapshot_conn.cursor(row_factory=dict_row) as cursor:
+            cursor.execute("""
+                SELECT u.telegram_id, u.username, u.full_name, ua.answers_json, ua.questionnaire_version
+                FROM users u
+                JOIN user_answers ua ON u.id = ua.user_id
+                WHERE ua.answers_json IS NOT NULL
+            """)
+            rows = cursor.fetchall()
+
+        self._snapshot_conn.rollback()
+        return rows
+
+    def listen_answers_changes(self):
+        """
+        Отдельное соединение (autocommit) с LISTEN на ANSWERS_CHANNEL.
+        Уведомления копятся с момента вызова; читать через conn.notifies().
+        """
+        conn = psycopg.connect(self.database_url, autocommit=True)
+        conn.execute(f"LISTEN {ANSWERS_CHANNEL}")
+        return conn
+
+    @timed_query
+    def get_users_by_telegram_ids(self, telegram_ids):
+        """{telegram_id: UserProfile} для списка id одним запросом."""
+        with self.conn.cursor(row_factory=class_row(UserProfile)) as cursor:
+            cursor.execute("""
+                SELECT telegram_id, username, full_name
+                FROM users
+                WHERE telegram_id = ANY(%s)
+            """, (list(telegram_ids),))
+
+            return {profile.telegram_id: profile for profile in cursor.fetchall()}
+
+    @timed_query
+    def copy_out(self, table, file):
+        """
+        Выгружает таблицу из EXPORT_QUERIES бинарным COPY в открытый файл ("wb").
+        Данные идут потоком, без создания строк в Python. Возвращает число байт.
+        """
+        written = 0
+        with self.conn.cursor() as cursor:
+            with cursor.copy(f"COPY ({EXPORT_QUERIES[table]}) TO STDOUT (FORMAT BINARY)") as copy:
+                for data in copy:
+                    file.write(data)
+                    written += len(data)
+        self.conn.rollback()
+        return written
+
+    @timed_query
+    def copy_in(self, users_file, answers_file):
+        """
+        Загружает выгрузку copy_out одной транзакцией: бинарный COPY во
+        временные таблицы, затем upsert. Пользователи сопоставляются по
+        telegram_id, поэтому id в исходной и целевой базе могут различаться.
+        Возвращает (пользователей, анкет).
+        """
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute("""
+                    CREATE TEMP TABLE import_users (
+                        id INTEGER, telegram_id BIGINT, username TEXT,
+                        full_name TEXT, registered_at TIMESTAMP
+                    ) ON COMMIT DROP
+                """)
+                cursor.execute("""
+                    CREATE TEMP TABLE import_answers (
+                        user_id INTEGER, answers_json TEXT,
+                        questionnaire_version INTEGER, updated_at TIMESTAMP
+                    ) ON COMMIT DROP
+                """)
+
+                for table, file in (("import_users", users_file), ("import_answers", answers_file)):
+                    with cursor.copy(f"COPY {table} FROM STDIN (FORMAT BINARY)") as copy:
+                        while data := file.read(COPY_BUFFER_SIZE):
+                            copy.write(data)
+
+                cursor.execute("""
+                    INSERT INTO users (telegram_id, username, full_name, registered_at)
+                    SELECT telegram_id, username, full_name, registered_at FROM import_users
+                    ON CONFLICT (telegram_id)
+                    DO UPDATE SET
+                        username = EXCLUDED.username,
+                        full_name = EXCLUDED.full_name
+                """)
+                users = cursor.rowcount
+
+                cursor.execute("""
+                    INSERT INTO user_answers (user_id, answers_json, questionnaire_version, updated_at)
+                    SELECT u.id, ia.answers_json, ia.questionnaire_version, ia.updated_at
+                    FROM import_answers ia
+                    JOIN import_users iu ON iu.id = ia.user_id
+                    JOIN users u ON u.telegram_id = iu.telegram_id
+                    ON CONFLICT (user_id)
+                    DO UPDATE SET
+                        answers_json = EXCLUDED.answers_json,
+                        questionnaire_version = EXCLUDED.questionnaire_version,
+                        updated_at = EXCLUDED.updated_at
+                """)
+                answers = cursor.rowcount
+
+                cursor.execute("SELECT pg_notify(%s, '*')", (ANSWERS_CHANNEL,))
 
-        user_ids = [row['telegram_id'] for row in result]
-        
-        return user_ids
+            self.conn.commit()
+            return users, answers
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    async def iter_audience(self, segment="all", since=None, after=None, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        telegram_id получателей рассылки по возрастанию, по одному.
+        segment — ключ AUDIENCE_SEGMENTS; since — только зарегистрированные не
+        раньше этой даты; after — продолжить после этого telegram_id.
+
+        Читает серверным курсором на собственном соединении порциями по
+        chunk_size, каждую порцию — в отдельном потоке: в памяти одна порция,
+        первая отправка не ждёт всей выборки, а запросы обработчиков идут
+        по основному соединению как обычно. Итерацию, прерванную до конца,
+        закрывайте (contextlib.aclosing), чтобы сразу освободить соединение.
+        """
+        if segment not in AUDIENCE_SEGMENTS:
+            raise ValueError(f"Неизвестный сегмент: {segment}")
+
+        conditions = [AUDIENCE_SEGMENTS[segment]]
+        params = {}
+        if since is not None:
+            conditions.append("u.registered_at >= %(since)s")
+            params["since"] = since
+        if after is not None:
+            conditions.append("u.telegram_id > %(after)s")
+            params["after"] = after
+
+        conn = await asyncio.to_thread(psycopg.connect, self.database_url)
+        try:
+            with conn.cursor(name="audience") as cursor:
+                await asyncio.to_thread(cursor.execute, f"""
+                    SELECT u.telegram_id
+                    FROM users u
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY u.telegram_id
+                """, params)
+                while True:
+                    rows = await asyncio.to_thread(cursor.fetchmany, chunk_size)
+                    if not rows:
+                        break
+                    for (telegram_id,) in rows:
+                        yield telegram_id
+        finally:
+            conn.close()
+
+    @timed_query
+    def record_valentine(self, sender_telegram_id, recipient_telegram_id, is_anonymous,
+                         message_text=None, photo_file_id=None):
+        self.cursor.execute("""
+            INSERT INTO valentines (sender_id, recipient_id, is_anonymous, message_text, photo_file_id)
+            SELECT (SELECT id FROM users WHERE telegram_id = %s), id, %s, %s, %s
+            FROM users WHERE telegram_id = %s
+        """, (sender_telegram_id, is_anonymous, message_text, photo_file_id, recipient_telegram_id))
+        self.conn.commit()
 
-    def save_match(self, user1_id, user2_id, similarity_score):
+    @timed_query
+    def get_valentines_page(self, telegram_id, box, direction=None, cursor=None, limit=VALENTINES_PAGE_SIZE):
+        """
+        Страница истории валентинок, новые сверху. box — "received" или "sent".
+        Keyset-пагинация по (created_at, id) вместо OFFSET: cursor — id крайней
+        валентинки открытой страницы, direction — "older" (следующая) или
+        "newer" (предыдущая); без cursor — первая страница. Любая страница —
+        один проход по индексу (recipient_id|sender_id, created_at, id), без сортировки.
+        Если по cursor ничего нет (устаревшая кнопка), отдаётся первая страница.
+
+        Возвращает (rows, has_newer, has_older). У анонимных полученных
+        валентинок отправитель не выбирается вовсе.
+        """
+        owner, other = ("recipient_id", "sender_id") if box == "received" else ("sender_id", "recipient_id")
+        conditions = [f"v.{owner} = (SELECT id FROM users WHERE telegram_id = %(telegram_id)s)"]
+        if cursor is not None:
+            sign = "<" if direction == "older" else ">"
+            conditions.append(
+                f"(v.created_at, v.id) {sign} (SELECT created_at, id FROM valentines WHERE id = %(cursor)s)"
+            )
+        order = "ASC" if direction == "newer" else "DESC"
+        hidden = "v.is_anonymous" if box == "received" else "FALSE"
+
+        self.cursor.execute(f"""
+            SELECT v.id, v.created_at, v.is_anonymous, v.message_text, v.photo_file_id,
+                   CASE WHEN {hidden} THEN NULL ELSE u.username END AS username,
+                   CASE WHEN {hidden} THEN NULL ELSE u.full_name END AS full_name
+            FROM valentines v
+            LEFT JOIN users u ON u.id = v.{other}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY v.created_at {order}, v.id {order}
+            LIMIT %(limit)s
+        """, {"telegram_id": telegram_id, "cursor": cursor, "limit": limit + 1})
+        rows = self.cursor.fetchall()
+
+        if not rows and cursor is not None:
+            return self.get_valentines_page(telegram_id, box, limit=limit)
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if direction == "newer":
+            rows.reverse()
+            return rows, more, True
+        return rows, cursor is not None, more
+
+    @timed_query
+    def save_match(self, user1_id, user2_id, similarity_score, questionnaire_version=QUESTIONNAIRE_VERSION):
         if user1_id > user2_id:
             user1_id, user2_id = user2_id, user1_id
 
         self.cursor.execute("""
-            INSERT INTO matches (user1_id, user2_id, similarity_score)
-            VALUES (%s, %s, %s)
+            INSERT INTO matches (user1_id, user2_id, similarity_score, questionnaire_version)
+            VALUES (%s, %s, %s, %s)
             ON CONFLICT (user1_id, user2_id)
-            DO UPDATE SET similarity_score = EXCLUDED.similarity_score
-        """, (user1_id, user2_id, similarity_score))
+            DO UPDATE SET
+                similarity_score = EXCLUDED.similarity_score,
+                questionnaire_version = EXCLUDED.questionnaire_version,
+                matched_at = CURRENT_TIMESTAMP
+        """, (user1_id, user2_id, similarity_score, questionnaire_version))
 
         self.conn.commit()
         return True
 
+    @timed_query
+    def get_outdated_answers(self, questionnaire_version, limit=1000):
+        """Строки user_answers, сохранённые по другой версии анкеты."""
+        self.cursor.execute("""
+            SELECT user_id, answers_json, questionnaire_version
+            FROM user_answers
+            WHERE questionnaire_version <> %s
+            ORDER BY user_id
+            LIMIT %s
+        """, (questionnaire_version, limit))
+
+        return self.cursor.fetchall()
+
+    @timed_query
+    def update_answers_version(self, user_id, answers_json, questionnaire_version):
+        """Перезаписывает ответы, перенесённые на новую версию анкеты (updated_at не трогаем)."""
+        self.cursor.execute("""
+            UPDATE user_answers
+            SET answers_json = %s, questionnaire_version = %s
+            WHERE user_id = %s
+        """, (answers_json, questionnaire_version, user_id))
+
+        self.conn.commit()
+
+    @timed_query
+    def get_outdated_matches(self, questionnaire_version, limit=1000):
+        """
+        Совпадения, посчитанные по другой версии анкеты,
+        вместе с ответами обоих пользователей.
+        """
+        self.cursor.execute("""
+            SELECT m.user1_id, m.user2_id,
+                   a1.answers_json AS answers1, a1.questionnaire_version AS version1,
+                   a2.answers_json AS answers2, a2.questionnaire_version AS version2
+            FROM matches m
+            JOIN user_answers a1 ON a1.user_id = m.user1_id
+            JOIN user_answers a2 ON a2.user_id = m.user2_id
+            WHERE m.questionnaire_version <> %s
+            ORDER BY m.user1_id, m.user2_id
+            LIMIT %s
+        """, (questionnaire_version, limit))
+
+        return self.cursor.fetchall()
+
+    @timed_query
     def get_user_matches(self, telegram_id, limit=10):
         self.cursor.execute("SELECT id FROM users WHERE telegram_id = %s", (telegram_id,))
         user = self.cursor.fetchone()
@@ -181,40 +593,190 @@ class Database:
 
         user_id = user["id"]
 
+        with self.conn.cursor(row_factory=class_row(Match)) as cursor:
+            cursor.execute("""
+                SELECT
+                    CASE
+                        WHEN m.user1_id = %s THEN u2.telegram_id
+                        ELSE u1.telegram_id
+                    END as telegram_id,
+                    CASE
+                        WHEN m.user1_id = %s THEN u2.username
+                        ELSE u1.username
+                    END as username,
+                    CASE
+                        WHEN m.user1_id = %s THEN u2.full_name
+                        ELSE u1.full_name
+                    END as full_name,
+                    m.similarity_score as similarity
+                FROM matches m
+                JOIN users u1 ON m.user1_id = u1.id
+                JOIN users u2 ON m.user2_id = u2.id
+                WHERE m.user1_id = %s OR m.user2_id = %s
+                ORDER BY m.similarity_score DESC
+                LIMIT %s
+            """, (user_id, user_id, user_id, user_id, user_id, limit))
+
+            return cursor.fetchall()
+
+    @timed_query
+    def get_fanout_recipients(self, campaign, after_telegram_id=0, limit=200):
+        """
+        Следующая порция telegram_id с анкетой, которым кампания ещё не доставлена
+        (нет строки в deliveries или прошлая попытка failed). Keyset по telegram_id.
+        """
         self.cursor.execute("""
-            SELECT
-                CASE
-                    WHEN m.user1_id = %s THEN u2.telegram_id
-                    ELSE u1.telegram_id
-                END as matched_user_id,
-                CASE
-                    WHEN m.user1_id = %s THEN u2.username
-                    ELSE u1.username
-                END as matched_username,
-                CASE
-                    WHEN m.user1_id = %s THEN u2.full_name
-                    ELSE u1.full_name
-                END as matched_full_name,
-                m.similarity_score
-            FROM matches m
-            JOIN users u1 ON m.user1_id = u1.id
-            JOIN users u2 ON m.user2_id = u2.id
-            WHERE m.user1_id = %s OR m.user2_id = %s
-            ORDER BY m.similarity_score DESC
+            SELECT u.telegram_id
+            FROM users u
+            JOIN user_answers ua ON ua.user_id = u.id
+            LEFT JOIN deliveries d ON d.campaign = %s AND d.telegram_id = u.telegram_id
+            WHERE u.telegram_id > %s AND (d.status IS NULL OR d.status = 'failed')
+            ORDER BY u.telegram_id
             LIMIT %s
-        """, (user_id, user_id, user_id, user_id, user_id, limit))
-
-        return [
-            {
-                "telegram_id": row["matched_user_id"],
-                "username": row["matched_username"],
-                "full_name": row["matched_full_name"],
-                "similarity": row["similarity_score"]
+        """, (campaign, after_telegram_id, limit))
+
+        return [row["telegram_id"] for row in self.cursor.fetchall()]
+
+    @timed_query
+    def get_matches_for_users(self, telegram_ids, limit=5, questionnaire_version=QUESTIONNAIRE_VERSION,
+                              max_age=None):
+        """
+        {telegram_id: [Match, ...]} — сохранённый топ limit совпадений для порции
+        пользователей одним запросом. Только для тех, у кого топ посчитан полностью
+        (отметка в top_matches по этой версии анкеты, не меньше limit, не старше
+        анкеты пользователя и max_age секунд) и строка в matches свежая для каждой
+        пары из записанного списка — по тому же условию, что в get_pair_check.
+        Остальных в результате нет: их топ нужно посчитать.
+        """
+        with self.conn.cursor(row_factory=dict_row) as cursor:
+            cursor.execute("""
+                WITH targets AS (
+                    SELECT u.id, u.telegram_id, ua.updated_at, tm.partner_ids
+                    FROM users u
+                    JOIN user_answers ua ON ua.user_id = u.id
+                    JOIN top_matches tm ON tm.user_id = u.id
+                    WHERE u.telegram_id = ANY(%(telegram_ids)s)
+                      AND tm.questionnaire_version = %(version)s
+                      AND tm.k >= %(limit)s
+                      AND tm.computed_at >= ua.updated_at
+                      AND (%(max_age)s::float IS NULL
+                           OR tm.computed_at >= CURRENT_TIMESTAMP - make_interval(secs => %(max_age)s::float))
+                ),
+                entries AS (
+                    SELECT t.id AS owner_id, t.telegram_id AS owner, t.updated_at AS owner_updated_at,
+                           cardinality(t.partner_ids) AS stored, e.other_id, e.place
+                    FROM targets t
+                    CROSS JOIN LATERAL unnest(t.partner_ids) WITH ORDINALITY AS e(other_id, place)
+                )
+                SELECT e.owner, e.stored, u.telegram_id, u.username, u.full_name, m.similarity_score
+                FROM entries e
+                JOIN users u ON u.id = e.other_id
+                JOIN user_answers oa ON oa.user_id = e.other_id
+                JOIN matches m ON m.user1_id = LEAST(e.owner_id, e.other_id)
+                              AND m.user2_id = GREATEST(e.owner_id, e.other_id)
+                WHERE m.questionnaire_version = %(version)s
+                  AND m.matched_at >= e.owner_updated_at AND m.matched_at >= oa.updated_at
+                ORDER BY e.owner, e.place
+            """, {
+                "telegram_ids": list(telegram_ids),
+                "version": questionnaire_version,
+                "limit": limit,
+                "max_age": max_age,
+            })
+
+            result = {}
+            expected = {}
+            for row in cursor.fetchall():
+                expected[row["owner"]] = row["stored"]
+                # REAL в БД: округляем обратно до двух знаков, как calculate_similarity
+                result.setdefault(row["owner"], []).append(
+                    Match(row["telegram_id"], row["username"], row["full_name"], round(row["similarity_score"], 2))
+                )
+            # Кто-то из списка пересдал тест или удалён — топ неполный, его нужно пересчитать
+            return {
+                owner: matches[:limit]
+                for owner, matches in result.items()
+                if len(matches) == expected[owner]
             }
-            for row in self.cursor.fetchall()
+
+    @timed_query
+    def save_top_matches(self, top_matches, k, questionnaire_version=QUESTIONNAIRE_VERSION):
+        """
+        Записывает посчитанные топы {telegram_id: [Match, ...]} в matches,
+        а сам список партнёров по порядку — в top_matches, одной транзакцией на порцию.
+        """
+        pairs = [
+            (match.similarity, questionnaire_version, owner, match.telegram_id)
+            for owner, matches in top_matches.items()
+            for match in matches
         ]
+        try:
+            if pairs:
+                self.cursor.executemany("""
+                    INSERT INTO matches (user1_id, user2_id, similarity_score, questionnaire_version)
+                    SELECT LEAST(a.id, b.id), GREATEST(a.id, b.id), %s, %s
+                    FROM users a, users b
+                    WHERE a.telegram_id = %s AND b.telegram_id = %s
+                    ON CONFLICT (user1_id, user2_id)
+                    DO UPDATE SET
+                        similarity_score = EXCLUDED.similarity_score,
+                        questionnaire_version = EXCLUDED.questionnaire_version,
+                        matched_at = CURRENT_TIMESTAMP
+                """, pairs)
+            self.cursor.executemany("""
+                INSERT INTO top_matches (user_id, questionnaire_version, k, partner_ids)
+                SELECT id, %s, %s, ARRAY(
+                    SELECT p.id
+                    FROM unnest(%s::bigint[]) WITH ORDINALITY AS t(telegram_id, place)
+                    JOIN users p ON p.telegram_id = t.telegram_id
+                    ORDER BY t.place
+                )
+                FROM users WHERE telegram_id = %s
+                ON CONFLICT (user_id)
+                DO UPDATE SET
+                    questionnaire_version = EXCLUDED.questionnaire_version,
+                    k = EXCLUDED.k,
+                    partner_ids = EXCLUDED.partner_ids,
+                    computed_at = CURRENT_TIMESTAMP
+            """, [
+                (questionnaire_version, k, [match.telegram_id for match in matches], owner)
+                for owner, matches in top_matches.items()
+            ])
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    @timed_query
+    def record_deliveries(self, campaign, results):
+        """results: [(telegram_id, status, error), ...] — одной пачкой после порции отправок."""
+        self.cursor.executemany("""
+            INSERT INTO deliveries (campaign, telegram_id, status, error)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (campaign, telegram_id)
+            DO UPDATE SET
+                status = EXCLUDED.status,
+                error = EXCLUDED.error,
+                attempts = deliveries.attempts + 1,
+                updated_at = CURRENT_TIMESTAMP
+        """, [(campaign, telegram_id, status, error) for telegram_id, status, error in results])
+        self.conn.commit()
+
+    @timed_query
+    def get_delivery_stats(self, campaign):
+        """{статус: число получателей} для кампании."""
+        self.cursor.execute("""
+            SELECT status, COUNT(*) AS count
+            FROM deliveries
+            WHERE campaign = %s
+            GROUP BY status
+        """, (campaign,))
+
+        return {row["status"]: row["count"] for row in self.cursor.fetchall()}
 
     def close(self):
-        if self.conn:
-            self.conn.close()
-            print("✅ Соединение с PostgreSQL закрыто")
\ No newline at end of file
+        if self._snapshot_conn:
+            self._snapshot_conn.close()
+        if self._conn:
+            self._conn.close()
+            logger.info("✅ Соединение с PostgreSQL закрыто")
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""
+Выгрузка и загрузка пользователей и анкет бинарным COPY.
+
+    python dump.py export dumps/2026-02-14     # users.copy, user_answers.copy, answers.matrix
+    python dump.py import dumps/2026-02-14     # upsert в текущую базу
+    python dump.py matrix dumps/2026-02-14     # только answers.matrix
+
+answers.matrix — матрица ответов для подбора без JSON (см. answer_matrix.py),
+её можно открыть через AnswerMatrix без обращения к базе.
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+from answer_matrix import write_answer_matrix
+from database import Database
+from questions import TestEngine
+
+USERS_FILE = "users.copy"
+ANSWERS_FILE = "user_answers.copy"
+MATRIX_FILE = "answers.matrix"
+
+
+def export_tables(db, directory):
+    os.makedirs(directory, exist_ok=True)
+    for table, filename in (("users", USERS_FILE), ("user_answers", ANSWERS_FILE)):
+        path = os.path.join(directory, filename)
+        with open(path, "wb") as f:
+            size = db.copy_out(table, f)
+        print(f"✅ {table}: {size / 1024:.1f} KiB -> {path}")
+
+
+def import_tables(db, directory):
+    with open(os.path.join(directory, USERS_FILE), "rb") as users_file, \
+            open(os.path.join(directory, ANSWERS_FILE), "rb") as answers_file:
+        users, answers = db.copy_in(users_file, answers_file)
+    print(f"✅ Загружено пользователей: {users}, анкет: {answers}")
+
+
+def build_matrix(db, test_engine, directory):
+    """Строит answers.matrix потоково, ответы переносятся на текущую версию анкеты."""
+    os.makedirs(directory, exist_ok=True)
+
+    def rows():
+        for chunk in db.iter_users_with_answers():
+            for row in chunk:
+                yield row['telegram_id'], test_engine.deserialize_answers(
+                    row['answers_json'], row['questionnaire_version']
+                )
+
+    path = os.path.join(directory, MATRIX_FILE)
+    count = write_answer_matrix(path, rows(), test_engine)
+    print(f"✅ Матрица ответов: {count} строк -> {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка и загрузка анкет бинарным COPY")
+    parser.add_argument('command', choices=['export', 'import', 'matrix'])
+    parser.add_argument('directory')
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = Database()
+    test_engine = TestEngine()
+
+    try:
+        start = time.perf_counter()
+        if args.command == 'export':
+            export_tables(db, args.directory)
+            build_matrix(db, test_engine, args.directory)
+        elif args.command == 'import':
+            import_tables(db, args.directory)
+        else:
+            build_matrix(db, test_engine, args.directory)
+        print(f"⏱ {time.perf_counter() - start:.2f} с")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
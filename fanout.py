@@ -0,0 +1,142 @@
+"""
+Персональная рассылка результатов подбора (14 февраля).
+
+Пользователи с анкетой читаются порциями по FANOUT_CHUNK (keyset по
+telegram_id), для каждой порции берётся топ совпадений (top_matches_for:
+сохранённый в matches или посчитанный по снимку анкет), текст собирается
+для каждого получателя отдельно.
+Отправка идёт в FANOUT_CONCURRENCY параллельных запросов, но не быстрее
+FANOUT_RATE сообщений в секунду на бота (у Telegram лимит около 30);
+RetryAfter приостанавливает всех отправителей сразу.
+
+Итог по каждому получателю пишется в deliveries после каждой порции,
+поэтому повторный запуск той же кампании продолжает с недоставленных
+(нет строки или status = 'failed'). При падении посреди порции её часть
+может уйти повторно — не больше FANOUT_CHUNK сообщений.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+import metrics
+from api_session import bulk_lane
+from keyboards import TEXTS, format_top_matches
+from top_matches import top_matches_for
+
+logger = logging.getLogger("fanout")
+
+FANOUT_RATE = float(os.getenv("FANOUT_RATE", 25))
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", 20))
+FANOUT_CHUNK = int(os.getenv("FANOUT_CHUNK", 200))
+MAX_ATTEMPTS = 3
+
+FANOUT_MESSAGES = metrics.Counter(
+    "bot_fanout_messages_total", "Персональная рассылка: итог по получателю", labels=("status",)
+)
+
+
+class RateLimiter:
+    """Равномерно раздаёт слоты на отправку: не больше rate в секунду на всех отправителей."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds):
+        """После RetryAfter: следующий слот не раньше чем через seconds."""
+        self._next = max(self._next, asyncio.get_running_loop().time() + seconds)
+
+
+def render_matches(matches):
+    return TEXTS['fanout_header'] + format_top_matches(matches) + TEXTS['top_matches_footer']
+
+
+async def send_one(bot: Bot, limiter, telegram_id, text):
+    """(status, error): sent, blocked (бот заблокирован — не повторяем) или failed."""
+    error = None
+    for attempt in range(MAX_ATTEMPTS):
+        await limiter.acquire()
+        try:
+            await bot.send_message(telegram_id, text)
+            return "sent", None
+        except TelegramRetryAfter as e:
+            metrics.BROADCAST_RETRY_AFTER.inc()
+            limiter.pause(e.retry_after)
+            error = str(e)
+        except TelegramForbiddenError as e:
+            return "blocked", str(e)
+        except TelegramBadRequest as e:
+            return "failed", str(e)
+        except Exception as e:
+            error = str(e)
+            await asyncio.sleep(2 ** attempt)
+    return "failed", error
+
+
+async def fan_out_matches(bot: Bot, db, snapshot_cache, test_engine, campaign, top_n=5, stop_event=None,
+                          lease=None):
+    """
+    Рассылает каждому его лучшие совпадения. Возвращает Counter статусов этого запуска.
+    stop_event (Lifecycle.stopping) останавливает рассылку между порциями, как и
+    потеря блокировки lease (jobs.Lease): тогда кампанию продолжит другой экземпляр.
+    """
+    limiter = RateLimiter(FANOUT_RATE)
+    semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+    totals = Counter()
+    after = 0
+    start = time.perf_counter()
+
+    logger.info("Начинаю персональную рассылку", extra={"campaign": campaign, "rate": FANOUT_RATE})
+
+    async def deliver(telegram_id, matches):
+        if not matches:
+            return telegram_id, "skipped", None
+        async with semaphore:
+            status, error = await send_one(bot, limiter, telegram_id, render_matches(matches))
+        return telegram_id, status, error
+
+    while stop_event is None or not stop_event.is_set():
+        if lease is not None and not lease.held():
+            logger.error("Персональная рассылка прервана: блокировка потеряна", extra={
+                "campaign": campaign, "after": after
+            })
+            break
+        recipients = db.get_fanout_recipients(campaign, after, FANOUT_CHUNK)
+        if not recipients:
+            break
+
+        stored, computed = await top_matches_for(db, snapshot_cache, test_engine, recipients, top_n)
+        matches = {**stored, **computed}
+        with bulk_lane():
+            results = await asyncio.gather(*(
+                deliver(telegram_id, matches.get(telegram_id)) for telegram_id in recipients
+            ))
+        db.record_deliveries(campaign, results)
+
+        for _, status, _ in results:
+            totals[status] += 1
+            FANOUT_MESSAGES.inc(1, status)
+        after = recipients[-1]
+
+        logger.info("Прогресс персональной рассылки", extra={
+            "campaign": campaign, "after": after, **totals,
+            "rate_per_s": round(totals["sent"] / (time.perf_counter() - start), 1),
+        })
+
+    if stop_event is not None and stop_event.is_set():
+        logger.warning("Персональная рассылка прервана остановкой бота", extra={"campaign": campaign, "after": after})
+    logger.info("Персональная рассылка завершена", extra={"campaign": campaign, **totals})
+    return totals
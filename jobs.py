@@ -0,0 +1,160 @@
+"""
+Координация фоновых задач между несколькими экземплярами бота.
+
+Каждой задаче соответствует advisory-блокировка Postgres
+(pg_try_advisory_lock на основном соединении Database). Кто взял
+блокировку — ведущий для этой задачи, остальные экземпляры только
+периодически пробуют её взять. Блокировка живёт вместе с соединением:
+если ведущий упал, Postgres снимает её при разрыве соединения, и другой
+экземпляр становится ведущим на следующей проверке (HEARTBEAT секунд).
+
+Периодические задачи (run_periodic) проверяют соединение ведущего раз в
+HEARTBEAT: если оно оборвалось и Database переподключилась, блокировка
+потеряна и задача не запускается, пока её не удастся взять снова.
+
+Разовые задачи (exclusive) берут блокировку один раз, а идти могут часами.
+Heartbeat за них никто не делает: долгая задача сама проверяет
+lease.held() между порциями и останавливается, если блокировка потеряна, —
+иначе другой экземпляр возьмёт её и начнёт ту же работу параллельно.
+
+    async with jobs.exclusive("broadcast") as lease:   # разовая задача
+        if lease:
+            for batch in batches:
+                if not lease.held():
+                    break
+                ...
+    lifecycle.spawn(jobs.run_periodic("digest", 3600, send_digest, lifecycle.stopping))
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import metrics
+
+logger = logging.getLogger("jobs")
+
+HEARTBEAT = float(os.getenv("JOBS_HEARTBEAT", 5))
+
+JOB_RUNS = metrics.Counter("bot_job_runs_total", "Запуски фоновых задач на ведущем экземпляре", labels=("job", "status"))
+JOB_LEADERSHIP = metrics.Counter(
+    "bot_job_leadership_changes_total", "Получение и потеря роли ведущего", labels=("job", "event")
+)
+
+
+def job_key(name):
+    """Стабильный int64-ключ advisory-блокировки для имени задачи."""
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+class Lease:
+    """Результат exclusive(): истинен, если блокировка взята; held() — всё ещё наша."""
+
+    def __init__(self, coordinator, name, acquired):
+        self.coordinator = coordinator
+        self.name = name
+        self.acquired = acquired
+
+    def __bool__(self):
+        return self.acquired
+
+    def held(self):
+        return self.acquired and self.coordinator.is_leader(self.name)
+
+
+class JobCoordinator:
+    def __init__(self, db, heartbeat=HEARTBEAT):
+        self.db = db
+        self.heartbeat = heartbeat
+        # имя задачи -> соединение, на котором взята блокировка
+        self._held = {}
+        # Задачи, которые идут в этом процессе: блокировка на общем соединении
+        # реентерабельна, поэтому второй запуск здесь же отсекаем сами
+        self._running = set()
+
+    def try_acquire(self, name):
+        """True, если этот экземпляр теперь (или уже) ведущий для задачи."""
+        if self.is_leader(name):
+            return True
+        try:
+            acquired = self.db.try_advisory_lock(job_key(name))
+        except Exception:
+            logger.exception("❌ Не удалось взять блокировку задачи", extra={"job": name})
+            return False
+        if acquired:
+            self._held[name] = self.db.conn
+            JOB_LEADERSHIP.inc(1, name, "acquired")
+            logger.info("Экземпляр стал ведущим", extra={"job": name})
+        return acquired
+
+    def is_leader(self, name):
+        """Проверяет, что блокировка всё ещё наша: то же соединение, и оно живо."""
+        conn = self._held.get(name)
+        if conn is None:
+            return False
+        try:
+            self.db.ping()
+            alive = self.db.conn is conn
+        except Exception:
+            alive = False
+        if not alive:
+            del self._held[name]
+            JOB_LEADERSHIP.inc(1, name, "lost")
+            logger.warning("Блокировка задачи потеряна вместе с соединением", extra={"job": name})
+        return alive
+
+    def release(self, name):
+        conn = self._held.pop(name, None)
+        if conn is None or conn.closed:
+            return
+        try:
+            self.db.advisory_unlock(job_key(name))
+        except Exception:
+            logger.exception("❌ Не удалось снять блокировку задачи", extra={"job": name})
+
+    @asynccontextmanager
+    async def exclusive(self, name):
+        """
+        Разовая задача: Lease, ложный, если она уже идёт на другом экземпляре
+        или в этом же процессе. Снимает блокировку только тот запуск, что её взял.
+        """
+        acquired = name not in self._running and self.try_acquire(name)
+        if acquired:
+            self._running.add(name)
+        try:
+            yield Lease(self, name, acquired)
+        finally:
+            if acquired:
+                self._running.discard(name)
+                self.release(name)
+
+    async def run_periodic(self, name, interval, job, stop_event):
+        """
+        Запускает async job() раз в interval секунд, только пока экземпляр
+        ведущий. Проверка и перехват лидерства — раз в heartbeat секунд.
+        """
+        if name in self._running:
+            logger.warning("Задача уже запущена в этом процессе", extra={"job": name})
+            return
+        self._running.add(name)
+        next_run = time.monotonic()
+        try:
+            while not stop_event.is_set():
+                if self.try_acquire(name) and time.monotonic() >= next_run:
+                    next_run = time.monotonic() + interval
+                    try:
+                        await job()
+                        JOB_RUNS.inc(1, name, "ok")
+                    except Exception:
+                        JOB_RUNS.inc(1, name, "error")
+                        logger.exception("❌ Ошибка фоновой задачи", extra={"job": name})
+
+                try:
+                    await asyncio.wait_for(stop_event.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._running.discard(name)
+            self.release(name)
@@ -0,0 +1,270 @@
+"""
+Клавиатуры и статические тексты, собранные один раз при старте.
+
+Объекты здесь общие для всех пользователей: отправляйте их как есть
+и не изменяйте. Для каждого вопроса анкеты заранее готовы текст
+и клавиатура (QUESTION_VIEWS[индекс]).
+"""
+import html
+from functools import lru_cache
+from types import MappingProxyType
+from typing import NamedTuple
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardMarkup,
+)
+
+from questions import QUESTIONNAIRES, QUESTIONNAIRE_VERSION
+
+# Тексты кнопок главного меню
+BUTTON_TEST = "📝 Пройти тест"
+BUTTON_MY_ANSWERS = "📊 Мои ответы"
+BUTTON_VALENTINES = "💌 Валентинки"
+BUTTON_COMPATIBILITY = "✨ Совместимость"
+BUTTON_NEXT = "✅ Далее"
+
+MAIN_MENU_BUTTONS = frozenset({BUTTON_TEST, BUTTON_MY_ANSWERS, BUTTON_VALENTINES, BUTTON_COMPATIBILITY})
+
+MAIN_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text=BUTTON_TEST), KeyboardButton(text=BUTTON_MY_ANSWERS)],
+        [KeyboardButton(text=BUTTON_VALENTINES), KeyboardButton(text=BUTTON_COMPATIBILITY)],
+    ],
+    resize_keyboard=True
+)
+
+COMPATIBILITY_MENU_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🌟 ТОП совместимых", callback_data="show_top_matches")],
+    [InlineKeyboardButton(text="🔮 Проверить совместимость с..", callback_data="check_specific_person")]
+])
+
+VALENTINES_MENU_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="💌 Отправить валентинку", callback_data="send_valentine")],
+    [InlineKeyboardButton(text="📬 Мои валентинки", callback_data="my_valentines")]
+])
+
+PHOTO_CHOICE_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📸 Добавить фото", callback_data="add_photo")],
+    [InlineKeyboardButton(text="⏩ Пропустить", callback_data="skip_photo")]
+])
+
+ANONYMITY_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="🕵️ Анонимно", callback_data="send_anonymous"),
+        InlineKeyboardButton(text="👤 Открыто", callback_data="send_open")
+    ],
+    [InlineKeyboardButton(text="🔙 Отмена", callback_data="cancel_send")]
+])
+
+RETRY_VALENTINE_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="💌 Попробовать снова", callback_data="send_valentine")]
+])
+
+
+class QuestionView(NamedTuple):
+    text: str
+    keyboard: ReplyKeyboardMarkup
+
+
+def _build_question_views(questions):
+    total = len(questions)
+    views = []
+    for i, question in enumerate(questions):
+        text = f"<b>Вопрос {i+1}/{total}</b>\n\n{question['text']}"
+        buttons = [[KeyboardButton(text=f"{j+1}. {option}")] for j, option in enumerate(question['options'])]
+        if question['type'] == 'multi':
+            text += " \n\n<b>(несколько вариантов ответа)</b>"
+            buttons.append([KeyboardButton(text=BUTTON_NEXT)])
+        views.append(QuestionView(text, ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)))
+    return tuple(views)
+
+
+QUESTION_VIEWS = _build_question_views(QUESTIONNAIRES[QUESTIONNAIRE_VERSION])
+
+
+VALENTINE_BOXES = ("received", "sent")
+VALENTINE_DIRECTIONS = ("older", "newer")
+
+
+class ValentinesPage(CallbackData, prefix="vp"):
+    """
+    Листание «📬 Мои валентинки»: "vp:<box>:<direction>:<cursor>".
+    box — received | sent, direction — older | newer, cursor — id крайней
+    валентинки текущей страницы (0 и direction "first" — первая страница).
+    """
+    box: str
+    direction: str
+    cursor: int
+
+
+class QuizCallback(CallbackData, prefix="q"):
+    """Кнопка инлайн-теста: "q:<вопрос>:<вариант>", вариант QUIZ_NEXT — «Далее»."""
+    question: int
+    option: int
+
+
+QUIZ_NEXT = -1
+
+
+@lru_cache(maxsize=None)
+def inline_question_keyboard(question_index, selected=frozenset()):
+    """
+    Инлайн-клавиатура вопроса для режима QUIZ_MODE=inline.
+    Для multi-вопросов выбранные варианты помечены галочкой; комбинаций
+    немного, поэтому все встреченные клавиатуры кешируются.
+    """
+    question = QUESTIONNAIRES[QUESTIONNAIRE_VERSION][question_index]
+    buttons = [
+        [InlineKeyboardButton(
+            text=f"{'✅ ' if j in selected else ''}{j+1}. {option}",
+            callback_data=QuizCallback(question=question_index, option=j).pack()
+        )]
+        for j, option in enumerate(question['options'])
+    ]
+    if question['type'] == 'multi':
+        buttons.append([InlineKeyboardButton(
+            text=BUTTON_NEXT,
+            callback_data=QuizCallback(question=question_index, option=QUIZ_NEXT).pack()
+        )])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+TEXTS = MappingProxyType({
+    'welcome': (
+        "👋 Привет, {full_name}!\n\n"
+        "Добро пожаловать в <b>HitsLoversBot</b>!\n\n"
+        "🎯 <b>Как это работает:</b>\n\n"
+        f"📝 Здесь ты можешь пройти тест из {len(QUESTION_VIEWS)} вопросов, чтобы 14 февраля Бот мог определить совместимых с тобой людей!\n\n"
+        "💌 Кроме этого, уже сейчас ты можешь отправить праздничные валентинки людям, которые тоже активировали бота!\n\n"
+        "🔧 Техподдержка: @MerlinLokot"
+    ),
+    'choose_option': "Пожалуйста, выберите вариант из списка.",
+    'test_completed': (
+        "🎉 <b>Поздравляю! Ты завершил тест!</b>\n\n"
+        "Твои ответы сохранены и могут быть использованы для анализа совместимости\n\n"
+        "Теперь ты можешь:\n"
+        "• 📊 Посмотреть свои ответы\n"
+        "• 📝 Перепройти тест\n"
+        "• 💝 Ждать подбора совместимых людей 14 февраля!\n\n"
+    ),
+    'compatibility_menu': (
+        "✨ <b>Отлично! Результаты тестов на совместимость проанализированы!</b>\n\n"
+        "Выберите, что хотите сделать:"
+    ),
+    'valentines_menu': (
+        "💝 <b>Отправка валентинок</b>\n\n"
+        "Здесь ты можешь отправить анонимное или открытое "
+        "поздравление пользователю, зарегистрированному в боте!\n\n"
+        "✨ <b>Как это работает:</b>\n"
+        "1️⃣ Введи никнейм получателя\n"
+        "2️⃣ Напиши текст валентинки\n"
+        "3️⃣ Добавь фото (по желанию)\n"
+        "4️⃣ Выбери: анонимно или открыто\n\n"
+    ),
+    'choose_anonymity': "🕵️ <b>Шаг 4/4</b> - Выберите режим отправки:",
+    'choose_anonymity_detailed': (
+        "🕵️ <b>Шаг 4/4</b> - Выберите режим отправки:\n\n"
+        "• <b>Анонимно</b> - получатель не узнает, кто отправитель\n"
+        "• <b>Открыто</b> - получатель увидит ваше имя"
+    ),
+    'send_cancelled': "❌ Отправка отменена",
+    'valentines_received': "📥 <b>Полученные валентинки</b>\n\n",
+    'valentines_sent': "📤 <b>Отправленные валентинки</b>\n\n",
+    'valentines_empty_received': "Пока никто не прислал тебе валентинку — но всё впереди! 💫",
+    'valentines_empty_sent': "Отправленных валентинок пока нет — самое время начать! 💌",
+    'top_matches_header': "⚡ <b>Вау! Вот с какими людьми у тебя наибольшая совместимость! </b>\n\n",
+    'top_matches_footer': "\n💫 Как здорово, когда есть люди, с которыми ты на одной волне!",
+    'fanout_header': (
+        "💘 <b>С Днём святого Валентина!</b>\n\n"
+        "Бот проанализировал ответы всех участников — вот с кем у тебя наибольшая совместимость:\n\n"
+    ),
+})
+
+MEDALS = ("🥇", "🥈", "🥉")
+
+
+def format_top_matches(matches):
+    """Строки списка совпадений (Match) с прогресс-баром и медалями за первые места."""
+    text = ""
+    for i, match in enumerate(matches, 1):
+        percent = int(match.similarity * 100)
+
+        # Визуальный прогресс-бар
+        filled = "🟩" * (percent // 10)
+        empty = "🟦" * (10 - (percent // 10))
+        progress = f"{filled}{empty}"
+
+        # Формируем имя
+        if match.full_name:
+            name = match.full_name
+            if match.username:
+                name += f" (@{match.username})"
+        elif match.username:
+            name = f"@{match.username}"
+        else:
+            name = f"Пользователь {match.telegram_id}"
+
+        medal = MEDALS[i - 1] if i <= len(MEDALS) else "🌟"
+
+        text += f"{medal} <b>{i}. {name}</b>\n"
+        text += f"   <code>{progress}</code> <b>{percent}%</b>\n\n"
+    return text
+
+
+# Длинные валентинки в списке обрезаем: страница должна поместиться в одно сообщение
+VALENTINE_PREVIEW = 150
+
+
+def format_valentines_page(box, rows):
+    """Текст страницы истории валентинок (строки Database.get_valentines_page)."""
+    text = TEXTS[f'valentines_{box}']
+    if not rows:
+        return text + TEXTS[f'valentines_empty_{box}']
+
+    for row in rows:
+        if row['is_anonymous'] and box == "received":
+            name = "👤 Аноним"
+        elif row['username']:
+            name = f"@{row['username']}"
+        else:
+            name = row['full_name'] or "удалённый пользователь"
+
+        message_text = row['message_text'] or ""
+        if len(message_text) > VALENTINE_PREVIEW:
+            message_text = message_text[:VALENTINE_PREVIEW] + "…"
+
+        direction = "от" if box == "received" else "для"
+        photo = " 📸" if row['photo_file_id'] else ""
+        anonymous = " 🕵️" if row['is_anonymous'] and box == "sent" else ""
+        text += f"💌 <b>{row['created_at']:%d.%m %H:%M}</b> {direction} {html.escape(name)}{photo}{anonymous}\n"
+        if message_text:
+            text += f"<i>«{html.escape(message_text)}»</i>\n"
+        text += "\n"
+    return text
+
+
+def valentines_page_keyboard(box, rows, has_newer, has_older):
+    """Кнопки листания (keyset: курсор — id крайней валентинки), переключения ящика и возврата."""
+    navigation = []
+    if has_newer and rows:
+        navigation.append(InlineKeyboardButton(
+            text="⬅️ Новее",
+            callback_data=ValentinesPage(box=box, direction="newer", cursor=rows[0]['id']).pack()
+        ))
+    if has_older and rows:
+        navigation.append(InlineKeyboardButton(
+            text="Старше ➡️",
+            callback_data=ValentinesPage(box=box, direction="older", cursor=rows[-1]['id']).pack()
+        ))
+
+    other = "sent" if box == "received" else "received"
+    buttons = [navigation] if navigation else []
+    buttons.append([InlineKeyboardButton(
+        text="📤 Отправленные" if other == "sent" else "📥 Полученные",
+        callback_data=ValentinesPage(box=other, direction="first", cursor=0).pack()
+    )])
+    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_valentines")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
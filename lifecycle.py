@@ -0,0 +1,110 @@
+"""
+Корректная остановка бота.
+
+aiogram по SIGTERM/SIGINT перестаёт забирать апдейты, вызывает
+dp.shutdown и сразу закрывает сессию Bot API, не дожидаясь уже
+запущенных обработчиков. Lifecycle.shutdown регистрируется в dp.shutdown
+и до закрытия сессии:
+
+1. поднимает флаг stopping — длинные циклы (рассылка) выходят на границе порции;
+2. ждёт обработчиков, которые уже выполняются (их отмечает InFlightMiddleware);
+3. ждёт фоновых задач, запущенных через spawn;
+4. вызывает хуки on_shutdown (дождаться загрузки снимка и т.п.).
+
+На всё — общий срок SHUTDOWN_TIMEOUT; не успевшее отменяется с записью в лог.
+Соединения с БД и логирование закрываются уже после этого, в main().
+"""
+import asyncio
+import inspect
+import logging
+import os
+
+from aiogram import BaseMiddleware
+
+import metrics
+
+logger = logging.getLogger("lifecycle")
+
+# Railway и Docker по умолчанию ждут 30 секунд между SIGTERM и SIGKILL
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 25))
+
+SHUTDOWN_CANCELLED = metrics.Counter(
+    "bot_shutdown_cancelled_total", "Задачи, отменённые по истечении срока остановки", labels=("kind",)
+)
+UPDATES_IN_FLIGHT = metrics.Gauge("bot_updates_in_flight", "Апдейты, которые сейчас обрабатываются")
+
+
+class Lifecycle:
+    def __init__(self, timeout=SHUTDOWN_TIMEOUT):
+        self.timeout = timeout
+        self.stopping = asyncio.Event()
+        self.updates = set()
+        self.background = set()
+        self._hooks = []
+        # Серия одна на процесс: показывает последний созданный Lifecycle
+        UPDATES_IN_FLIGHT.getter = lambda: len(self.updates)
+
+    def spawn(self, coro, name=None):
+        """Запускает фоновую задачу, которую остановка дождётся."""
+        task = asyncio.create_task(coro, name=name)
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+        return task
+
+    def on_shutdown(self, hook):
+        """Хук (обычная или async-функция) после того, как обработчики и задачи завершились."""
+        self._hooks.append(hook)
+        return hook
+
+    async def shutdown(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        self.stopping.set()
+        logger.info("Остановка: ждём обработчики и фоновые задачи", extra={
+            "updates": len(self.updates), "background": len(self.background), "timeout_s": self.timeout
+        })
+
+        await self._drain(self.updates, "update", deadline)
+        await self._drain(self.background, "background", deadline)
+
+        for hook in self._hooks:
+            try:
+                result = hook()
+                if inspect.isawaitable(result):
+                    await asyncio.wait_for(result, max(0.0, deadline - loop.time()))
+            except Exception:
+                logger.exception("❌ Ошибка в хуке остановки", extra={"hook": getattr(hook, "__qualname__", repr(hook))})
+
+        logger.info("✅ Обработчики и фоновые задачи завершены")
+
+    async def _drain(self, tasks, kind, deadline):
+        current = asyncio.current_task()
+        pending = {task for task in tasks if task is not current and not task.done()}
+        if not pending:
+            return
+
+        timeout = max(0.0, deadline - asyncio.get_running_loop().time())
+        _, pending = await asyncio.wait(pending, timeout=timeout)
+        if not pending:
+            return
+
+        logger.warning("Не успели завершиться к сроку, отменяем", extra={"kind": kind, "count": len(pending)})
+        SHUTDOWN_CANCELLED.inc(len(pending), kind)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+class InFlightMiddleware(BaseMiddleware):
+    """Outer-middleware на update: запоминает задачу, в которой обрабатывается апдейт."""
+
+    def __init__(self, lifecycle):
+        self.lifecycle = lifecycle
+
+    async def __call__(self, handler, event, data):
+        task = asyncio.current_task()
+        self.lifecycle.updates.add(task)
+        try:
+            return await handler(event, data)
+        finally:
+            self.lifecycle.updates.discard(task)
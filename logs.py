@@ -0,0 +1,125 @@
+"""
+Логирование без блокировок в обработчиках.
+
+Обработчики пишут в QueueHandler (только put в очередь), а реальный
+вывод в stdout/файл делает QueueListener в отдельном потоке.
+Записи — JSON в одну строку с update_id/user_id текущего апдейта.
+
+Настройка через окружение:
+    LOG_LEVEL=INFO  LOG_FORMAT=json|text  LOG_FILE=bot.log
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+
+from aiogram import BaseMiddleware
+
+update_id_var = contextvars.ContextVar("update_id", default=None)
+user_id_var = contextvars.ContextVar("user_id", default=None)
+
+# Атрибуты LogRecord, которые не надо дублировать в JSON как доп. поля
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+class CorrelationFilter(logging.Filter):
+    """Добавляет к записи update_id и user_id из контекста апдейта."""
+
+    def filter(self, record):
+        record.update_id = update_id_var.get()
+        record.user_id = user_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and value is not None:
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class CorrelationMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: выставляет update_id/user_id для логов."""
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        update_token = update_id_var.set(event.update_id)
+        user_token = user_id_var.set(user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            update_id_var.reset(update_token)
+            user_id_var.reset(user_token)
+
+
+class Sampler:
+    """
+    Пропускает каждое every-е событие: для частых записей вроде
+    прогресса рассылки по каждому получателю.
+    """
+
+    def __init__(self, every):
+        self.every = max(1, every)
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        return self.count % self.every == 1 or self.every == 1
+
+
+def setup_logging():
+    """Настраивает корневой логгер через очередь. Повторный вызов ничего не делает."""
+    global _listener
+    if _listener is not None:
+        return
+
+    if os.getenv("LOG_FORMAT", "json") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(update_id)s/%(user_id)s] %(message)s")
+
+    handlers = [logging.StreamHandler(sys.stdout)]
+    log_file = os.getenv("LOG_FILE")
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=50 * 1024 * 1024, backupCount=5, encoding="utf-8"
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Фильтр на QueueHandler: contextvars доступны только в потоке обработчика
+    queue_handler.addFilter(CorrelationFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    # aiogram пишет INFO на каждый апдейт; время обработчиков и так есть в metrics
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает поток вывода."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
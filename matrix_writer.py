@@ -0,0 +1,90 @@
+"""
+Процесс-писатель общей матрицы ответов (см. answer_matrix.py).
+
+При старте строит матрицу из БД, затем слушает уведомления, которые
+Database.save_user_answers шлёт в канал ANSWERS_CHANNEL, и обновляет
+строку пользователя на месте. Боты и пакетные задачи на этом хосте
+открывают тот же файл только для чтения (COMPATIBILITY_SOURCE=matrix).
+
+Запуск: python matrix_writer.py
+Писатель должен быть один на файл — второй экземпляр завершится сразу.
+"""
+import fcntl
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from answer_matrix import AnswerMatrixWriter
+from database import Database
+from logs import setup_logging, stop_logging
+from questions import TestEngine
+
+logger = logging.getLogger("matrix_writer")
+
+ANSWER_MATRIX_PATH = os.getenv("ANSWER_MATRIX_PATH", "answers.matrix")
+
+
+def all_answers(db, test_engine):
+    for chunk in db.iter_users_with_answers():
+        for row in chunk:
+            yield row['telegram_id'], test_engine.deserialize_answers(
+                row['answers_json'], row['questionnaire_version']
+            )
+
+
+def rebuild(db, writer, test_engine):
+    count = writer.rebuild(all_answers(db, test_engine))
+    logger.info("✅ Матрица ответов построена", extra={"rows": count, "path": writer.path})
+
+
+def apply_change(db, writer, test_engine, payload):
+    if payload == "*":
+        rebuild(db, writer, test_engine)
+        return
+
+    telegram_id = int(payload)
+    record = db.get_user_answers_record(telegram_id)
+    if record is None:
+        return
+    writer.upsert(telegram_id, test_engine.deserialize_answers(
+        record['answers_json'], record['questionnaire_version']
+    ))
+
+
+def main():
+    load_dotenv()
+    setup_logging()
+
+    lock = open(f"{ANSWER_MATRIX_PATH}.lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        logger.error("❌ Писатель матрицы уже запущен", extra={"path": ANSWER_MATRIX_PATH})
+        return
+
+    db = Database()
+    test_engine = TestEngine()
+    # Подписываемся до построения: изменения во время загрузки не потеряются
+    listener = db.listen_answers_changes()
+    writer = AnswerMatrixWriter(ANSWER_MATRIX_PATH, test_engine)
+
+    try:
+        rebuild(db, writer, test_engine)
+        for notify in listener.notifies():
+            try:
+                apply_change(db, writer, test_engine, notify.payload)
+            except Exception:
+                logger.exception("❌ Не удалось обновить матрицу", extra={"payload": notify.payload})
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+        listener.close()
+        db.close()
+        lock.close()
+        stop_logging()
+
+
+if __name__ == "__main__":
+    main()
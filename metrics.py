@@ -0,0 +1,232 @@
+"""
+Метрики горячих путей в текстовом формате Prometheus.
+
+Без внешних зависимостей: счётчики, gauge и гистограммы хранятся в памяти
+процесса и отдаются по HTTP на /metrics (aiohttp уже есть через aiogram).
+Включается переменной окружения METRICS_PORT.
+"""
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import time
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger("metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_INTERVAL = 0.5
+
+
+def _format_labels(label_names, label_values):
+    if not label_names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(label_names, label_values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        REGISTRY.append(self)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+
+    def inc(self, amount=1, *label_values):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def collect(self):
+        lines = self._header()
+        for label_values, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Gauge; если передан getter, значение вычисляется в момент чтения /metrics."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), getter=None):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+        self.getter = getter
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+    def collect(self):
+        lines = self._header()
+        if self.getter is not None:
+            lines.append(f"{self.name} {self.getter()}")
+            return lines
+        for label_values, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # label_values -> [счётчики по бакетам..., +Inf], сумма
+        self.counts = {}
+        self.sums = {}
+
+    def observe(self, value, *label_values):
+        counts = self.counts.get(label_values)
+        if counts is None:
+            counts = self.counts[label_values] = [0] * (len(self.buckets) + 1)
+            self.sums[label_values] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[label_values] += value
+
+    def collect(self):
+        lines = self._header()
+        for label_values, counts in self.counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names + ("le",), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {self.sums[label_values]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Время выполнения обработчика aiogram", labels=("handler",)
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", labels=("handler",)
+)
+DB_QUERY_SECONDS = Histogram(
+    "bot_db_query_seconds", "Время выполнения метода Database", labels=("query",)
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "bot_event_loop_lag_seconds", "Опоздание event loop относительно таймера",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+BROADCAST_MESSAGES = Counter(
+    "bot_broadcast_messages_total", "Сообщения рассылки по результату", labels=("status",)
+)
+BROADCAST_RETRY_AFTER = Counter(
+    "bot_broadcast_retry_after_total", "Ответы 429 (RetryAfter) во время рассылки"
+)
+SIMILARITY_COMPUTATIONS = Counter(
+    "bot_similarity_computations_total", "Вызовы calculate_similarity"
+)
+
+
+def timed_query(func):
+    """Декоратор для методов Database: пишет длительность в DB_QUERY_SECONDS."""
+    name = func.__name__
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                DB_QUERY_SECONDS.observe(time.perf_counter() - start, name)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, name)
+    return wrapper
+
+
+def handler_name(data):
+    """Имя обработчика апдейта; для кнопок ButtonRouter — имя целевой функции."""
+    handler_object = data.get("button_route") or data.get("handler")
+    return handler_object.callback.__name__ if handler_object else "unknown"
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner-middleware: время каждого обработчика с меткой его имени."""
+
+    async def __call__(self, handler, event, data):
+        name = handler_name(data)
+
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(1, name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, name)
+
+
+def register_fsm_storage(storage):
+    """Gauge с числом записей в MemoryStorage."""
+    Gauge(
+        "bot_fsm_storage_records", "Записи в памяти FSM-хранилища",
+        getter=lambda: len(getattr(storage, "storage", ()))
+    )
+
+
+async def watch_event_loop_lag(interval=LOOP_LAG_INTERVAL):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - interval))
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+async def _metrics_handler(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(port=None, host=None):
+    """
+    Поднимает /metrics, если задан METRICS_PORT (или port).
+    Возвращает AppRunner, который нужно закрыть при остановке, либо None.
+    """
+    port = port or os.getenv("METRICS_PORT")
+    if not port:
+        return None
+
+    host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, int(port)).start()
+    logger.info(f"📈 Метрики доступны на http://{host}:{port}/metrics")
+    return runner
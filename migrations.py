@@ -0,0 +1,297 @@
+"""
+Версионные миграции схемы БД.
+
+Каждая миграция выполняется один раз, в своей транзакции, и записывается
+в schema_version. Бот при старте DDL не выполняет — только проверяет одним
+запросом, что схема не старее LATEST_VERSION (см. Database._check_schema).
+
+    python migrations.py            # применить недостающие миграции
+    python migrations.py --status   # текущая и последняя версии
+
+Новые миграции только добавляйте в конец MIGRATIONS, уже применённые не меняйте.
+"""
+import argparse
+import logging
+import os
+
+import psycopg
+from dotenv import load_dotenv
+
+logger = logging.getLogger("migrations")
+
+# Ключ pg_advisory_lock: два одновременных запуска не применят миграцию дважды
+MIGRATIONS_LOCK_ID = 0x484C4D31
+
+# (версия, описание, SQL-команды)
+MIGRATIONS = [
+    (1, "Начальная схема", [
+        # IF NOT EXISTS: базы, созданные до миграций, принимают эту версию как есть
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            telegram_id BIGINT UNIQUE NOT NULL,
+            username TEXT,
+            full_name TEXT,
+            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_answers (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER UNIQUE NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            answers_json TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS matches (
+            id SERIAL PRIMARY KEY,
+            user1_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            user2_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            similarity_score REAL NOT NULL,
+            matched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user1_id, user2_id)
+        )
+        """,
+    ]),
+    (2, "Версия анкеты у ответов и совпадений", [
+        "ALTER TABLE user_answers ADD COLUMN IF NOT EXISTS questionnaire_version INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE matches ADD COLUMN IF NOT EXISTS questionnaire_version INTEGER NOT NULL DEFAULT 1",
+    ]),
+    (3, "Индексы для поиска по username и совпадений второго участника", [
+        # Поиск получателя валентинки и проверка конкретного человека
+        "CREATE INDEX IF NOT EXISTS users_username_idx ON users (username)",
+        # get_user_matches: WHERE user1_id = %s OR user2_id = %s; user1_id покрыт UNIQUE
+        "CREATE INDEX IF NOT EXISTS matches_user2_id_idx ON matches (user2_id)",
+    ]),
+    (4, "Статус доставки персональных рассылок", [
+        # Строка на получателя кампании: по ней рассылка продолжается после перезапуска
+        """
+        CREATE TABLE deliveries (
+            campaign TEXT NOT NULL,
+            telegram_id BIGINT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (campaign, telegram_id)
+        )
+        """,
+    ]),
+    (5, "Счётчики и распределение ответов, которые ведут триггеры", [
+        "CREATE TABLE stats_counters (name TEXT PRIMARY KEY, value BIGINT NOT NULL DEFAULT 0)",
+        """
+        CREATE TABLE answer_histogram (
+            questionnaire_version INTEGER NOT NULL,
+            question INTEGER NOT NULL,
+            option INTEGER NOT NULL,
+            count BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (questionnaire_version, question, option)
+        )
+        """,
+        """
+        CREATE FUNCTION stats_bump(p_name TEXT, p_delta BIGINT) RETURNS void AS $$
+            INSERT INTO stats_counters (name, value) VALUES (p_name, p_delta)
+            ON CONFLICT (name) DO UPDATE SET value = stats_counters.value + EXCLUDED.value
+        $$ LANGUAGE sql
+        """,
+        # Битый JSON не должен ронять сохранение ответов — только предупреждение
+        """
+        CREATE FUNCTION stats_apply_answers(p_answers TEXT, p_version INTEGER, p_delta BIGINT) RETURNS void AS $$
+        BEGIN
+            INSERT INTO answer_histogram (questionnaire_version, question, option, count)
+            SELECT p_version, q.key::int, o.value::int, p_delta
+            FROM jsonb_each(p_answers::jsonb) AS q, jsonb_array_elements_text(q.value) AS o
+            ON CONFLICT (questionnaire_version, question, option)
+            DO UPDATE SET count = answer_histogram.count + EXCLUDED.count;
+        EXCEPTION WHEN others THEN
+            RAISE WARNING 'stats_apply_answers: %', SQLERRM;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE FUNCTION users_stats_trigger() RETURNS trigger AS $$
+        BEGIN
+            PERFORM stats_bump('users', CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE FUNCTION user_answers_stats_trigger() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM stats_apply_answers(OLD.answers_json, OLD.questionnaire_version, -1);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM stats_apply_answers(NEW.answers_json, NEW.questionnaire_version, 1);
+            END IF;
+            IF TG_OP = 'INSERT' THEN
+                PERFORM stats_bump('users_with_answers', 1);
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM stats_bump('users_with_answers', -1);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        # Сначала триггеры: их блокировка не даёт писать в таблицы, пока идёт начальный подсчёт
+        """
+        CREATE TRIGGER users_stats AFTER INSERT OR DELETE ON users
+            FOR EACH ROW EXECUTE FUNCTION users_stats_trigger()
+        """,
+        """
+        CREATE TRIGGER user_answers_stats
+            AFTER INSERT OR UPDATE OF answers_json, questionnaire_version OR DELETE ON user_answers
+            FOR EACH ROW EXECUTE FUNCTION user_answers_stats_trigger()
+        """,
+        """
+        INSERT INTO stats_counters (name, value) VALUES
+            ('users', (SELECT COUNT(*) FROM users)),
+            ('users_with_answers', (SELECT COUNT(*) FROM user_answers)),
+            ('valentines_anonymous', 0),
+            ('valentines_open', 0)
+        """,
+        """
+        INSERT INTO answer_histogram (questionnaire_version, question, option, count)
+        SELECT ua.questionnaire_version, q.key::int, o.value::int, COUNT(*)
+        FROM user_answers ua,
+             jsonb_each(ua.answers_json::jsonb) AS q,
+             jsonb_array_elements_text(q.value) AS o
+        GROUP BY 1, 2, 3
+        """,
+    ]),
+    (6, "Отправленные валентинки и индексы сегментов рассылки", [
+        # Кто кому отправил: по ней сегмент «не получал валентинок»
+        """
+        CREATE TABLE valentines (
+            id BIGSERIAL PRIMARY KEY,
+            sender_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+            recipient_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            is_anonymous BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX valentines_recipient_idx ON valentines (recipient_id, created_at)",
+        # Сегмент «зарегистрировались после даты»
+        "CREATE INDEX IF NOT EXISTS users_registered_at_idx ON users (registered_at)",
+    ]),
+    (7, "Текст валентинок для истории «📬 Мои валентинки»", [
+        "ALTER TABLE valentines ADD COLUMN message_text TEXT, ADD COLUMN photo_file_id TEXT",
+        # Отправленные; полученные листает valentines_recipient_idx
+        "CREATE INDEX valentines_sender_idx ON valentines (sender_id, created_at)",
+    ]),
+    (8, "Отметка о посчитанном топе совпадений пользователя", [
+        # Строки топа лежат в matches; здесь — когда и сколько их записано,
+        # чтобы отличать полный топ от случайных проверок пар
+        """
+        CREATE TABLE top_matches (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+            questionnaire_version INTEGER NOT NULL,
+            k INTEGER NOT NULL,
+            stored INTEGER NOT NULL,
+            computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (9, "Индекс полученных валентинок под ключ пагинации (created_at, id)", [
+        "CREATE INDEX valentines_recipient_keyset_idx ON valentines (recipient_id, created_at, id)",
+        # Старый индекс — префикс нового; сегмент no_valentine обходится новым
+        "DROP INDEX valentines_recipient_idx",
+    ]),
+    (10, "Запрет совпадения пользователя с самим собой", [
+        # Такие строки могла записать проверка собственного username
+        "DELETE FROM matches WHERE user1_id = user2_id",
+        "ALTER TABLE matches ADD CONSTRAINT matches_distinct_users CHECK (user1_id <> user2_id)",
+    ]),
+    (11, "Список партнёров в отметке о топе совпадений", [
+        # Полнота топа проверяется по точному списку пар, а не по числу свежих строк
+        # в matches: их могли добавить проверки пар вне топа. Старые отметки без
+        # списка удаляем — такие топы просто посчитаются заново
+        "DELETE FROM top_matches",
+        "ALTER TABLE top_matches DROP COLUMN stored, ADD COLUMN partner_ids INTEGER[] NOT NULL",
+    ]),    (12, "Индекс отправленных валентинок под ключ пагинации (created_at, id)", [
+        "CREATE INDEX valentines_sender_keyset_idx ON valentines (sender_id, created_at, id)",
+        # Старый индекс — префикс нового
+        "DROP INDEX valentines_sender_idx",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    """Версия схемы или 0, если миграции ещё не запускались. Транзакцию не оставляет открытой."""
+    try:
+        version = conn.execute("SELECT max(version) FROM schema_version").fetchone()[0]
+    except psycopg.errors.UndefinedTable:
+        version = None
+    conn.rollback()
+    return version or 0
+
+
+def migrate(conn):
+    """Применяет недостающие миграции. Возвращает список применённых версий."""
+    if current_version(conn) >= LATEST_VERSION:
+        return []
+
+    applied = []
+    conn.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+    conn.commit()
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+
+        # Перечитываем под блокировкой: другой запуск мог успеть раньше
+        version = current_version(conn)
+        for number, description, statements in MIGRATIONS:
+            if number <= version:
+                continue
+            with conn.transaction():
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (number, description)
+                )
+            logger.info("✅ Миграция применена", extra={"version": number, "description": description})
+            applied.append(number)
+    finally:
+        conn.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+        conn.commit()
+
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument('--status', action='store_true', help="только показать версии")
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise Exception("❌ DATABASE_URL не найден. Добавьте PostgreSQL в Railway.")
+
+    with psycopg.connect(database_url) as conn:
+        if args.status:
+            print(f"Версия схемы: {current_version(conn)}, последняя: {LATEST_VERSION}")
+            return
+
+        applied = migrate(conn)
+        if applied:
+            print(f"✅ Применены миграции: {', '.join(map(str, applied))}")
+        else:
+            print(f"✅ Схема уже актуальна (версия {LATEST_VERSION})")
+
+
+if __name__ == "__main__":
+    main()
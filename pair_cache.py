@@ -0,0 +1,100 @@
+"""
+Кэш совместимости пары для «🔍 Проверить конкретного человека».
+
+Одних и тех же людей проверяют по многу раз, поэтому результат хранится:
+- в памяти процесса — LRU по симметричному ключу (min_id, max_id), плюс
+  профиль по username, чтобы повторная проверка не ходила в БД вовсе;
+- в таблице matches — её читает тот же единственный запрос, которым
+  Database.get_pair_check достаёт профиль и обе анкеты, так что другой
+  экземпляр бота или перезапуск не пересчитывают пару заново.
+
+Пересдача теста сбрасывает пары пользователя в этом процессе сразу
+(invalidate_user), а строка в matches считается устаревшей, если она
+старше обновления любой из двух анкет. Кэши других экземпляров бота
+обновятся не позже чем через PAIR_CACHE_TTL секунд — как и соответствие
+username -> пользователь, если кто-то сменит или займёт username.
+"""
+import os
+import time
+from collections import OrderedDict
+
+import metrics
+
+PAIR_CACHE_SIZE = int(os.getenv("PAIR_CACHE_SIZE", 50000))
+PAIR_CACHE_TTL = float(os.getenv("PAIR_CACHE_TTL", 600))
+
+PAIR_CACHE_LOOKUPS = metrics.Counter(
+    "bot_pair_cache_lookups_total", "Проверки конкретного человека по источнику результата", labels=("source",)
+)
+
+
+def pair_key(a, b):
+    return (a, b) if a <= b else (b, a)
+
+
+class PairScoreCache:
+    def __init__(self, maxsize=PAIR_CACHE_SIZE, ttl=PAIR_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # (min_id, max_id) -> (similarity, время записи)
+        self._scores = OrderedDict()
+        # telegram_id -> ключи пар с его участием, для invalidate_user
+        self._pairs_by_user = {}
+        # username без @ -> (UserProfile, время записи); username может смениться
+        # или перейти к другому человеку, поэтому тоже живёт не дольше ttl
+        self._profiles = OrderedDict()
+
+    def get(self, a, b):
+        key = pair_key(a, b)
+        entry = self._scores.get(key)
+        if entry is None:
+            return None
+        score, stored_at = entry
+        if time.monotonic() - stored_at > self.ttl:
+            self._drop(key)
+            return None
+        self._scores.move_to_end(key)
+        return score
+
+    def put(self, a, b, score):
+        key = pair_key(a, b)
+        self._scores[key] = (score, time.monotonic())
+        self._scores.move_to_end(key)
+        for user_id in key:
+            self._pairs_by_user.setdefault(user_id, set()).add(key)
+        while len(self._scores) > self.maxsize:
+            self._drop(next(iter(self._scores)))
+
+    def profile(self, username):
+        entry = self._profiles.get(username)
+        if entry is None:
+            return None
+        profile, stored_at = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._profiles[username]
+            return None
+        self._profiles.move_to_end(username)
+        return profile
+
+    def remember_profile(self, username, profile):
+        self._profiles[username] = (profile, time.monotonic())
+        self._profiles.move_to_end(username)
+        while len(self._profiles) > self.maxsize:
+            self._profiles.popitem(last=False)
+
+    def invalidate_user(self, telegram_id):
+        """Пользователь пересдал тест: все его пары считаем заново."""
+        for key in list(self._pairs_by_user.get(telegram_id, ())):
+            self._drop(key)
+
+    def _drop(self, key):
+        self._scores.pop(key, None)
+        for user_id in key:
+            pairs = self._pairs_by_user.get(user_id)
+            if pairs is not None:
+                pairs.discard(key)
+                if not pairs:
+                    del self._pairs_by_user[user_id]
+
+    def __len__(self):
+        return len(self._scores)
@@ -0,0 +1,123 @@
+"""
+Профилирование медленных обработчиков по требованию.
+
+Когда профилирование включено, обработчик запускается под cProfile;
+если он выполнялся дольше порога, профиль сохраняется в PROFILE_DIR
+с типом апдейта и именем обработчика в имени файла. Хранятся только
+последние PROFILE_KEEP файлов (0 — не удалять старые).
+
+Профиль включается только на шагах корутины обработчика — от await до
+await. Пока он ждёт, на event loop выполняются другие апдейты, и в его
+профиль они не попадают. Время ожидания (сеть, БД в другом потоке) в
+профиле не видно, но входит в elapsed_ms в имени файла.
+
+Включается переменной PROFILE_SLOW_HANDLERS=1 или админ-командой
+/profiling on. Смотреть: python -m pstats profiles/<файл>.prof
+"""
+import cProfile
+import logging
+import os
+import random
+import time
+from datetime import datetime
+
+from aiogram import BaseMiddleware
+
+import metrics
+
+logger = logging.getLogger("profiling")
+
+
+class _ProfiledSteps:
+    """
+    Выполняет корутину, включая profile только на время её шагов
+    (coro.send/throw). Между шагами поток занят другими задачами — их
+    cProfile, который видит весь поток, не записывает.
+    """
+
+    def __init__(self, coro, profile):
+        self.coro = coro
+        self.profile = profile
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            self.profile.enable()
+            try:
+                if error is not None:
+                    step = self.coro.throw(error)
+                else:
+                    step = self.coro.send(value)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self.profile.disable()
+
+            value, error = None, None
+            try:
+                value = yield step
+            except BaseException as e:
+                # Отмена задачи и прочие исключения — внутрь корутины обработчика
+                error = e
+
+
+class SlowHandlerProfiler(BaseMiddleware):
+    """
+    Inner-middleware. Одновременно профилируется не больше одного
+    обработчика — ради накладных расходов; апдейты, идущие параллельно
+    с профилируемым, в его профиль не попадают (см. _ProfiledSteps).
+    """
+
+    def __init__(self, directory=None, threshold_ms=None, keep=None, sample_rate=None, enabled=None):
+        if threshold_ms is None:
+            threshold_ms = os.getenv("PROFILE_THRESHOLD_MS", 500)
+        if keep is None:
+            keep = os.getenv("PROFILE_KEEP", 50)
+        if sample_rate is None:
+            sample_rate = os.getenv("PROFILE_SAMPLE_RATE", 1.0)
+        self.directory = directory or os.getenv("PROFILE_DIR", "profiles")
+        self.threshold = float(threshold_ms) / 1000
+        self.keep = int(keep)
+        self.sample_rate = float(sample_rate)
+        if enabled is None:
+            enabled = os.getenv("PROFILE_SLOW_HANDLERS", "0") == "1"
+        self.enabled = enabled
+        self._active = False
+
+    async def __call__(self, handler, event, data):
+        if not self.enabled or self._active or random.random() > self.sample_rate:
+            return await handler(event, data)
+
+        self._active = True
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return await _ProfiledSteps(handler(event, data), profile)
+        finally:
+            self._active = False
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.threshold:
+                self._save(profile, type(event).__name__, metrics.handler_name(data), elapsed)
+
+    def _save(self, profile, update_type, handler_name, elapsed):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            filename = (
+                f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+                f"_{update_type}_{handler_name}_{int(elapsed * 1000)}ms.prof"
+            )
+            profile.dump_stats(os.path.join(self.directory, filename))
+            logger.warning("🐢 Медленный обработчик, профиль сохранён", extra={
+                "handler": handler_name, "update_type": update_type,
+                "elapsed_ms": int(elapsed * 1000), "profile": filename
+            })
+            self._rotate()
+        except OSError as e:
+            logger.error(f"❌ Не удалось сохранить профиль: {e}")
+
+    def _rotate(self):
+        if self.keep <= 0:
+            return
+        files = sorted(f for f in os.listdir(self.directory) if f.endswith(".prof"))
+        for old in files[:-self.keep]:
+            os.remove(os.path.join(self.directory, old))
@@ -1,32 +1,115 @@
+import heapq
 import json
+from functools import lru_cache
+from operator import itemgetter
+
+# Текущая версия анкеты. При любом изменении списка вопросов или вариантов
+# добавляйте новую версию в QUESTIONNAIRES, а не правьте старую: сохранённые
+# ответы ссылаются на индексы той версии, в которой их дали.
+QUESTIONNAIRE_VERSION = 1
+
+# Компактный вид ответов: по байту на вопрос, бит i — выбран вариант i.
+# Поэтому у вопроса не больше MAX_OPTIONS вариантов.
+MAX_OPTIONS = 8
+
+# Реестр версий анкеты. У каждого вопроса есть стабильный "id", по которому
+# ответы переносятся между версиями, даже если вопросы поменяли местами.
+QUESTIONNAIRES = {
+    1: [
+        {"id": "balance", "text": "Как часто вы теряете эмоциональное равновесие?", "type": "single",
+         "options": ["Практически никогда", "Редко", "Иногда", "Часто"]},
+        {"id": "hard_areas", "text": "В каких сферах вам труднее всего справляться с собой?", "type": "multi",
+         "options": ["Отношения", "Работа", "Самооценка", "Здоровье", "Финансы", "Перемены"]},
+        {"id": "support", "text": "Что чаще всего помогает вам в трудные моменты?", "type": "multi",
+         "options": ["Друзья", "Книги/Видео", "Спорт", "Еда/Альтернатива", "Психолог"]},
+        {"id": "sharing_goal", "text": "Что для вас главное, когда вы делитесь переживаниями?", "type": "single",
+         "options": ["Не делюсь", "Понять, что не одинок", "Разобраться"]},
+        {"id": "after_coping", "text": "Что вы чувствуете после того как справились?", "type": "single",
+         "options": ["Лёгкость", "Гордость", "Желание поделиться", "Усталость"]},
+        {"id": "others_stories", "text": "Как вы реагируете на истории других людей?", "type": "single",
+         "options": ["Избегаю", "Молчу", "Сравниваю", "Сопереживаю"]},
+        {"id": "feedback", "text": "Как вы воспринимаете обратную связь?", "type": "single",
+         "options": ["Болезненно", "Игнорирую", "Как идеи", "Как инструмент"]},
+        {"id": "progress", "text": "Как вы замечаете свои успехи?", "type": "single",
+         "options": ["Сам", "Дневник/Трекер", "Признание других", "С психологом"]},
+        {"id": "help_others", "text": "Важно ли вам делиться опытом, чтобы помочь другим?", "type": "single",
+         "options": ["Да", "Нет"]},
+        {"id": "feelings", "text": "Вам легко говорить о своих чувствах?", "type": "single",
+         "options": ["Скрываю", "По ситуации", "Только с близкими", "Да, это сила"]},
+        {"id": "self_work", "text": "Что для вас главное в работе над собой?", "type": "single",
+         "options": ["Шаги", "Поддержка", "Новый взгляд", "Глубина"]}
+    ]
+}
+
+
+@lru_cache(maxsize=None)
+def build_answers_remap(from_version, to_version):
+    """
+    Строит карту переноса ответов между версиями анкеты:
+    {старый индекс вопроса: (новый индекс, {старый вариант: новый вариант})}.
+    Вопросы сопоставляются по "id", варианты — по тексту.
+    Удалённые вопросы и варианты в карту не попадают.
+    """
+    old_questions = QUESTIONNAIRES[from_version]
+    new_questions = QUESTIONNAIRES[to_version]
+    new_index_by_id = {q["id"]: i for i, q in enumerate(new_questions)}
+
+    remap = {}
+    for old_index, old_q in enumerate(old_questions):
+        new_index = new_index_by_id.get(old_q["id"])
+        if new_index is None:
+            continue
+
+        new_options = new_questions[new_index]["options"]
+        new_option_index = {text: i for i, text in enumerate(new_options)}
+        options_map = {
+            i: new_option_index[text]
+            for i, text in enumerate(old_q["options"])
+            if text in new_option_index
+        }
+        remap[old_index] = (new_index, options_map)
+
+    return remap
+
+
+def answers_to_masks(answers, questions_count):
+    """{индекс вопроса: [варианты]} -> bytes с маской на каждый вопрос."""
+    masks = bytearray(questions_count)
+    for question_index, selected in answers.items():
+        if 0 <= question_index < questions_count:
+            for option in selected:
+                if 0 <= option < MAX_OPTIONS:
+                    masks[question_index] |= 1 << option
+    return bytes(masks)
+
+
+def masks_to_answers(masks):
+    return {
+        i: [option for option in range(MAX_OPTIONS) if mask >> option & 1]
+        for i, mask in enumerate(masks)
+        if mask
+    }
+
+
+def is_identity_remap(from_version, to_version):
+    """True, если ответы версии from_version можно сравнивать с to_version без переноса."""
+    if from_version == to_version:
+        return True
+    remap = build_answers_remap(from_version, to_version)
+    old_questions = QUESTIONNAIRES[from_version]
+    return len(remap) == len(old_questions) == len(QUESTIONNAIRES[to_version]) and all(
+        new_index == old_index
+        and all(k == v for k, v in options_map.items())
+        and len(options_map) == len(old_questions[old_index]["options"])
+        for old_index, (new_index, options_map) in remap.items()
+    )
+
 
 class TestEngine:
-    def __init__(self):
-        # Вопросы уже есть в вашем файле, оставляем как есть
-        self.questions = [
-            {"text": "Как часто вы теряете эмоциональное равновесие?", "type": "single",
-             "options": ["Практически никогда", "Редко", "Иногда", "Часто"]},
-            {"text": "В каких сферах вам труднее всего справляться с собой?", "type": "multi",
-             "options": ["Отношения", "Работа", "Самооценка", "Здоровье", "Финансы", "Перемены"]},
-            {"text": "Что чаще всего помогает вам в трудные моменты?", "type": "multi",
-             "options": ["Друзья", "Книги/Видео", "Спорт", "Еда/Альтернатива", "Психолог"]},
-            {"text": "Что для вас главное, когда вы делитесь переживаниями?", "type": "single",
-             "options": ["Не делюсь", "Понять, что не одинок", "Разобраться"]},
-            {"text": "Что вы чувствуете после того как справились?", "type": "single",
-             "options": ["Лёгкость", "Гордость", "Желание поделиться", "Усталость"]},
-            {"text": "Как вы реагируете на истории других людей?", "type": "single",
-             "options": ["Избегаю", "Молчу", "Сравниваю", "Сопереживаю"]},
-            {"text": "Как вы воспринимаете обратную связь?", "type": "single",
-             "options": ["Болезненно", "Игнорирую", "Как идеи", "Как инструмент"]},
-            {"text": "Как вы замечаете свои успехи?", "type": "single",
-             "options": ["Сам", "Дневник/Трекер", "Признание других", "С психологом"]},
-            {"text": "Важно ли вам делиться опытом, чтобы помочь другим?", "type": "single", "options": ["Да", "Нет"]},
-            {"text": "Вам легко говорить о своих чувствах?", "type": "single",
-             "options": ["Скрываю", "По ситуации", "Только с близкими", "Да, это сила"]},
-            {"text": "Что для вас главное в работе над собой?", "type": "single",
-             "options": ["Шаги", "Поддержка", "Новый взгляд", "Глубина"]}
-        ]
-    
+    def __init__(self, version=QUESTIONNAIRE_VERSION):
+        self.version = version
+        self.questions = QUESTIONNAIRES[version]
+
     def get_total_questions(self):
         return len(self.questions)
 
@@ -36,28 +119,58 @@ class TestEngine:
             return self.questions[index]
         return None
 
+    def encode_answers(self, answers_dict):
+        """Ответы в компактном виде: bytes, по маске вариантов на вопрос."""
+        return answers_to_masks(answers_dict, len(self.questions))
+
+    def decode_answers(self, masks):
+        return masks_to_answers(masks)
+
     def serialize_answers(self, answers_dict):
         """Превращает словарь ответов {q_id: [indices]} в строку для БД."""
         # Преобразуем ключи в строки для JSON
         serializable_dict = {str(k): v for k, v in answers_dict.items()}
         return json.dumps(serializable_dict)
 
-    def deserialize_answers(self, answers_str):
-        """Превращает строку из БД обратно в словарь."""
+    def deserialize_answers(self, answers_str, version=None):
+        """
+        Превращает строку из БД обратно в словарь.
+        Если указана версия анкеты, отличная от текущей, ответы
+        переносятся на индексы текущей версии.
+        """
         if not answers_str:
             return {}
-        
+
         try:
             data = json.loads(answers_str)
             # Преобразуем ключи обратно в int
-            return {int(k): v for k, v in data.items()}
+            answers = {int(k): v for k, v in data.items()}
         except (json.JSONDecodeError, ValueError):
             return {}
 
+        if version is None or is_identity_remap(version, self.version):
+            return answers
+        return self.remap_answers(answers, version)
+
+    def remap_answers(self, answers_dict, from_version):
+        """Переносит ответы из версии from_version на индексы текущей версии."""
+        remap = build_answers_remap(from_version, self.version)
+        result = {}
+        for old_index, selected in answers_dict.items():
+            if old_index not in remap:
+                continue
+            new_index, options_map = remap[old_index]
+            new_selected = [options_map[opt] for opt in selected if opt in options_map]
+            if new_selected:
+                result[new_index] = new_selected
+        return result
+
     def calculate_similarity(self, user_a_ans, user_b_ans):
         """
-        Сравнивает два набора ответов. 
+        Сравнивает два набора ответов.
         Возвращает float от 0.0 до 1.0 (процент схожести).
+        Оба набора должны быть в индексах текущей версии анкеты
+        (см. deserialize_answers с параметром version).
         """
         total_weight = 0
         matches = 0
@@ -78,35 +191,78 @@ class TestEngine:
 
         if total_weight == 0:
             return 0.0
-        
+
         return round(matches / total_weight, 2)
 
     def find_matches(self, target_user_ans, all_users_from_db, top_n=5):
         """
         Ищет топ похожих людей.
-        all_users_from_db: список кортежей/словарей [(user_id, answers_json), ...]
+        all_users_from_db: список кортежей [(user_id, answers_json), ...]
+        или [(user_id, answers_json, questionnaire_version), ...]
+        """
+        def candidates():
+            for row in all_users_from_db:
+                version = row[2] if len(row) > 2 else None
+                yield row[0], self.deserialize_answers(row[1], version)
+
+        return self.top_matches(target_user_ans, candidates(), top_n)
+
+    def top_matches(self, target_user_ans, candidates, top_n=5):
+        """
+        Лучшие top_n совпадений без сортировки всего списка.
+        candidates: итерируемое (info, answers) — например, генератор
+        по порциям из БД; в памяти держится только top_n лучших.
+        Возвращает [(info, similarity), ...] по убыванию схожести.
         """
-        results = []
-        for uid, ans_json in all_users_from_db:
-            other_ans = self.deserialize_answers(ans_json)
-            sim = self.calculate_similarity(target_user_ans, other_ans)
-            results.append((uid, sim))
+        scored = (
+            (info, self.calculate_similarity(target_user_ans, answers))
+            for info, answers in candidates
+        )
+        return heapq.nlargest(top_n, scored, key=itemgetter(1))
 
-        # Сортируем по убыванию схожести
-        results.sort(key=lambda x: x[1], reverse=True)
-        return results[:top_n]
+    def score_tables(self, target_user_ans):
+        """
+        Для каждого вопроса таблица 256 значений: вклад в схожесть при данной
+        маске другого человека (формула та же, что в calculate_similarity),
+        и общий вес вопросов.
+        """
+        target_masks = self.encode_answers(target_user_ans)
+        tables = []
+        total_weight = 0
+        for question, a in zip(self.questions, target_masks):
+            weight = 1.5 if question['type'] == 'multi' else 1.0
+            total_weight += weight
+            tables.append(tuple(
+                weight * ((a & b).bit_count() / (a | b).bit_count()) if a & b else 0.0
+                for b in range(256)
+            ))
+        return tables, total_weight
+
+    def top_matches_encoded(self, target_user_ans, candidates, top_n=5):
+        """
+        То же, что top_matches, но candidates — (info, маски из encode_answers):
+        схожесть считается по таблицам, без множеств и словарей на кандидата.
+        """
+        tables, total_weight = self.score_tables(target_user_ans)
+        if not total_weight:
+            return []
+        scored = (
+            (info, round(sum(table[mask] for table, mask in zip(tables, masks)) / total_weight, 2))
+            for info, masks in candidates
+        )
+        return heapq.nlargest(top_n, scored, key=itemgetter(1))
 
     def get_question_summary(self, question_index, selected_options):
         """Возвращает текстовое описание выбранных вариантов"""
         question = self.get_question(question_index)
         if not question:
             return "Вопрос не найден"
-        
+
         options_text = []
         for opt_idx in selected_options:
             if 0 <= opt_idx < len(question['options']):
                 options_text.append(question['options'][opt_idx])
-        
+
         if question['type'] == 'single':
             return options_text[0] if options_text else "Не выбран"
         else:
@@ -115,4 +271,4 @@ class TestEngine:
 # Можно оставить тестовый код или удалить
 if __name__ == "__main__":
     engine = TestEngine()
-    print(f"✅ Тестовый движок загружен: {engine.get_total_questions()} вопросов")
\ No newline at end of file
+    print(f"✅ Тестовый движок загружен: {engine.get_total_questions()} вопросов (версия анкеты {engine.version})")
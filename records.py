@@ -0,0 +1,27 @@
+"""
+Компактные записи для профилей и совпадений.
+
+Вместо словаря с четырьмя строковыми ключами на каждого пользователя —
+dataclass со __slots__: без __dict__ на экземпляр, поля по атрибутам.
+Ответы хранятся отдельно в виде масок (TestEngine.encode_answers).
+"""
+from dataclasses import dataclass
+
+
+@dataclass(slots=True, frozen=True)
+class UserProfile:
+    telegram_id: int
+    username: str | None
+    full_name: str | None
+
+
+@dataclass(slots=True, frozen=True)
+class Match:
+    telegram_id: int
+    username: str | None
+    full_name: str | None
+    similarity: float
+
+    @classmethod
+    def of(cls, profile, similarity):
+        return cls(profile.telegram_id, profile.username, profile.full_name, similarity)
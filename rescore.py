@@ -0,0 +1,68 @@
+"""
+Пересчёт после смены версии анкеты.
+
+Трогает только затронутые строки: ответы, сохранённые по старой версии,
+переносятся на индексы текущей, а совместимость пересчитывается только
+для совпадений, посчитанных по старой версии.
+
+Запуск: python rescore.py
+"""
+from dotenv import load_dotenv
+
+from database import Database
+from questions import TestEngine
+
+BATCH_SIZE = 1000
+
+
+def migrate_answers(db, test_engine):
+    """Переносит ответы старых версий на текущую. Возвращает число строк."""
+    migrated = 0
+    while True:
+        rows = db.get_outdated_answers(test_engine.version, limit=BATCH_SIZE)
+        if not rows:
+            return migrated
+
+        for row in rows:
+            answers = test_engine.deserialize_answers(row['answers_json'], row['questionnaire_version'])
+            db.update_answers_version(
+                row['user_id'],
+                test_engine.serialize_answers(answers),
+                test_engine.version
+            )
+            migrated += 1
+
+
+def rescore_matches(db, test_engine):
+    """Пересчитывает совместимость для совпадений старых версий. Возвращает число строк."""
+    rescored = 0
+    while True:
+        rows = db.get_outdated_matches(test_engine.version, limit=BATCH_SIZE)
+        if not rows:
+            return rescored
+
+        for row in rows:
+            answers1 = test_engine.deserialize_answers(row['answers1'], row['version1'])
+            answers2 = test_engine.deserialize_answers(row['answers2'], row['version2'])
+            similarity = test_engine.calculate_similarity(answers1, answers2)
+            db.save_match(row['user1_id'], row['user2_id'], similarity, test_engine.version)
+            rescored += 1
+
+
+def main():
+    load_dotenv()
+    db = Database()
+    test_engine = TestEngine()
+
+    try:
+        migrated = migrate_answers(db, test_engine)
+        print(f"✅ Ответов перенесено на версию {test_engine.version}: {migrated}")
+
+        rescored = rescore_matches(db, test_engine)
+        print(f"✅ Совпадений пересчитано: {rescored}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Маршрутизация кнопок меню и callback_data через словарь.
+
+Вместо цепочки фильтров lambda message: message.text == "...", которые
+диспетчер проверяет по очереди на каждом апдейте, все кнопки
+обслуживаются одним обработчиком: его фильтр — один поиск в dict,
+а найденный обработчик вызывается с теми же аргументами, что дал бы aiogram.
+"""
+from aiogram.dispatcher.event.handler import CallableObject
+
+
+class ButtonRouter:
+    """
+    Создавайте сразу после Dispatcher: обработчики роутера регистрируются
+    в конструкторе и потому проверяются раньше обработчиков состояний.
+    Кнопка с yield_to=<StatesGroup> уступает апдейт обработчикам этой группы,
+    если пользователь находится в одном из её состояний.
+    """
+
+    def __init__(self, dp):
+        self.text_routes = {}
+        self.callback_routes = {}
+        dp.message.register(self._dispatch, self._match_text)
+        dp.callback_query.register(self._dispatch, self._match_callback)
+
+    def text(self, text, yield_to=None):
+        def decorator(callback):
+            self.text_routes[text] = (CallableObject(callback), yield_to)
+            return callback
+        return decorator
+
+    def callback(self, data, yield_to=None):
+        def decorator(callback):
+            self.callback_routes[data] = (CallableObject(callback), yield_to)
+            return callback
+        return decorator
+
+    @staticmethod
+    def _resolve(routes, key, raw_state):
+        route = routes.get(key)
+        if route is None:
+            return False
+
+        handler, yield_to = route
+        if yield_to is not None and raw_state is not None and raw_state in yield_to:
+            return False
+        return {"button_route": handler}
+
+    def _match_text(self, message, raw_state=None):
+        return self._resolve(self.text_routes, message.text, raw_state)
+
+    def _match_callback(self, callback, raw_state=None):
+        return self._resolve(self.callback_routes, callback.data, raw_state)
+
+    @staticmethod
+    async def _dispatch(event, button_route, **data):
+        return await button_route.call(event, **data)
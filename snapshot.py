@@ -0,0 +1,159 @@
+"""
+Общий снимок всех анкет для подбора совместимости.
+
+Когда сотни людей одновременно жмут «✨ Совместимость», таблица читается
+и декодируется один раз: параллельные запросы ждут одну и ту же загрузку
+(single-flight), а потом считают совместимость по одному снимку.
+Устаревший снимок отдаётся сразу, пока в фоне грузится новый, поэтому
+нагрузка на БД не зависит от числа одновременных запросов.
+"""
+import asyncio
+import logging
+import os
+import time
+
+import metrics
+from records import UserProfile
+
+logger = logging.getLogger("snapshot")
+
+SNAPSHOT_TTL = float(os.getenv("SNAPSHOT_TTL", 30))
+
+SNAPSHOT_LOADS = metrics.Counter("bot_snapshot_loads_total", "Загрузки снимка анкет из БД")
+SNAPSHOT_WAITERS = metrics.Counter(
+    "bot_snapshot_waiters_total", "Запросы, дождавшиеся уже идущей загрузки снимка"
+)
+SNAPSHOT_USERS = metrics.Gauge("bot_snapshot_users", "Пользователей в снимке анкет")
+
+
+class AnswersSnapshot:
+    """
+    Декодированные анкеты в параллельных массивах: профили (UserProfile),
+    ответы — одним bytearray по encode_answers на пользователя, и индекс
+    по telegram_id. На пользователя — один объект со __slots__ и несколько
+    байт ответов вместо словаря со словарём списков.
+    """
+
+    def __init__(self, rows, test_engine):
+        self.loaded_at = time.monotonic()
+        self.test_engine = test_engine
+        self.width = test_engine.get_total_questions()
+        self.profiles = []
+        self.masks = bytearray()
+        self.index = {}
+        for row in rows:
+            self.upsert(
+                row['telegram_id'], row['username'], row['full_name'],
+                test_engine.deserialize_answers(row['answers_json'], row['questionnaire_version'])
+            )
+
+    def upsert(self, telegram_id, username, full_name, answers):
+        profile = UserProfile(telegram_id, username, full_name)
+        masks = self.test_engine.encode_answers(answers)
+        position = self.index.get(telegram_id)
+        if position is None:
+            self.index[telegram_id] = len(self.profiles)
+            self.profiles.append(profile)
+            self.masks += masks
+        else:
+            self.profiles[position] = profile
+            start = position * self.width
+            self.masks[start:start + self.width] = masks
+
+    def get(self, telegram_id):
+        position = self.index.get(telegram_id)
+        return self.profiles[position] if position is not None else None
+
+    def answers(self, telegram_id):
+        """Ответы {индекс вопроса: [варианты]} или None."""
+        position = self.index.get(telegram_id)
+        if position is None:
+            return None
+        start = position * self.width
+        return self.test_engine.decode_answers(self.masks[start:start + self.width])
+
+    def candidates(self, exclude_id=None):
+        """(UserProfile, маски) для TestEngine.top_matches_encoded."""
+        width = self.width
+        masks = self.masks
+        for position, profile in enumerate(self.profiles):
+            if profile.telegram_id != exclude_id:
+                yield profile, masks[position * width:(position + 1) * width]
+
+    def __len__(self):
+        return len(self.profiles)
+
+
+class SnapshotCache:
+    """
+    loader — синхронная функция, возвращающая строки как
+    Database.get_all_users_with_answers(); выполняется в отдельном потоке.
+    """
+
+    def __init__(self, loader, test_engine, ttl=SNAPSHOT_TTL):
+        self.loader = loader
+        self.test_engine = test_engine
+        self.ttl = ttl
+        self._snapshot = None
+        self._inflight = None
+        # Ответы, сохранённые во время загрузки: применяются к новому снимку
+        self._pending = []
+        # Серия одна на процесс: показывает последний созданный кэш
+        SNAPSHOT_USERS.getter = lambda: len(self._snapshot) if self._snapshot else 0
+
+    async def get(self):
+        snapshot = self._snapshot
+        if snapshot is not None:
+            if time.monotonic() - snapshot.loaded_at >= self.ttl:
+                self._start_load()
+            return snapshot
+
+        if self._inflight is not None:
+            SNAPSHOT_WAITERS.inc()
+        # shield: отмена одного ожидающего не отменяет общую загрузку
+        return await asyncio.shield(self._start_load())
+
+    def upsert(self, telegram_id, username, full_name, answers):
+        """Обновляет анкету в текущем снимке без перезагрузки таблицы."""
+        if self._snapshot is not None:
+            self._snapshot.upsert(telegram_id, username, full_name, answers)
+        if self._inflight is not None:
+            self._pending.append((telegram_id, username, full_name, answers))
+
+    async def wait_idle(self):
+        """Дожидается идущей загрузки снимка (при остановке, до закрытия соединений)."""
+        if self._inflight is not None:
+            await asyncio.wait([self._inflight])
+
+    def invalidate(self):
+        """Сбрасывает снимок: следующий запрос загрузит таблицу заново."""
+        self._snapshot = None
+
+    def _start_load(self):
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._load())
+        return self._inflight
+
+    async def _load(self):
+        try:
+            start = time.perf_counter()
+            snapshot = await asyncio.to_thread(self._build)
+            for pending in self._pending:
+                snapshot.upsert(*pending)
+            self._snapshot = snapshot
+            SNAPSHOT_LOADS.inc()
+            logger.info("Снимок анкет загружен", extra={
+                "users": len(snapshot), "elapsed_ms": int((time.perf_counter() - start) * 1000)
+            })
+            return snapshot
+        except Exception:
+            logger.exception("❌ Не удалось загрузить снимок анкет")
+            if self._snapshot is None:
+                raise
+            return self._snapshot
+        finally:
+            self._pending = []
+            self._inflight = None
+
+    def _build(self):
+        return AnswersSnapshot(self.loader(), self.test_engine)
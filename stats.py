@@ -0,0 +1,69 @@
+"""
+Статистика для администраторов: /stats и gauge на /metrics.
+
+Всё читается из таблиц stats_counters и answer_histogram, которые ведут
+триггеры БД (миграция 5) и Database.increment_stat, поэтому запрос не
+зависит от размера users/user_answers. Gauge обновляются фоновой
+задачей раз в STATS_REFRESH секунд, а не при каждом чтении /metrics.
+"""
+import asyncio
+import logging
+import os
+
+import metrics
+
+logger = logging.getLogger("stats")
+
+STATS_REFRESH = float(os.getenv("STATS_REFRESH", 60))
+
+STATS = metrics.Gauge("bot_stats", "Счётчики из stats_counters", labels=("counter",))
+ANSWER_OPTIONS = metrics.Gauge(
+    "bot_answer_option_choices", "Сколько раз выбран вариант ответа (текущая версия анкеты)",
+    labels=("question", "option")
+)
+
+COUNTER_TITLES = {
+    'users': "👥 Пользователей",
+    'users_with_answers': "📝 Прошли тест",
+    'valentines_anonymous': "🕵️ Анонимных валентинок",
+    'valentines_open': "💌 Открытых валентинок",
+}
+
+
+def refresh(db, test_engine):
+    """Читает счётчики и распределение ответов, обновляет gauge. Возвращает (counters, histogram)."""
+    counters = db.get_stats()
+    histogram = db.get_answer_histogram(test_engine.version)
+
+    for name, value in counters.items():
+        STATS.set(value, name)
+    for (question, option), count in histogram.items():
+        ANSWER_OPTIONS.set(count, question, option)
+    return counters, histogram
+
+
+def format_stats(counters, histogram, test_engine):
+    lines = ["📊 <b>Статистика</b>\n"]
+    for name, title in COUNTER_TITLES.items():
+        lines.append(f"{title}: <b>{counters.get(name, 0)}</b>")
+
+    lines.append(f"\n<b>Ответы (версия анкеты {test_engine.version})</b>")
+    for index, question in enumerate(test_engine.questions):
+        counts = [histogram.get((index, option), 0) for option in range(len(question['options']))]
+        total = sum(counts) or 1
+        lines.append(f"\n<i>{index + 1}. {question['text']}</i>")
+        for text, count in zip(question['options'], counts):
+            lines.append(f"  {text}: {count} ({count * 100 // total}%)")
+    return "\n".join(lines)
+
+
+async def refresh_periodically(db, test_engine, stop_event, interval=STATS_REFRESH):
+    while not stop_event.is_set():
+        try:
+            refresh(db, test_engine)
+        except Exception:
+            logger.exception("❌ Не удалось обновить статистику")
+        try:
+            await asyncio.wait_for(stop_event.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,170 @@
+"""
+Ограничение частоты запросов на пользователя (token bucket).
+
+У каждого пользователя есть общий бакет на все апдейты и отдельные
+бакеты для дорогих действий (подбор совместимости, отправка валентинок).
+Заблокированный апдейт отбрасывается до обработчика, без обращений к БД.
+
+По умолчанию бакеты хранятся в памяти процесса; для нескольких
+экземпляров бота задайте THROTTLE_REDIS_URL (нужен пакет redis).
+"""
+import logging
+import os
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+import metrics
+
+logger = logging.getLogger("throttling")
+
+# Ограничения: (токенов в секунду, размер бакета)
+DEFAULT_LIMIT = (2.0, 10)
+ACTION_LIMITS = {
+    # Полный перебор всех анкет — не чаще раза в 10 секунд, запас 2
+    "find_matches_handler": (0.1, 2),
+    "back_to_compatibility_menu": (0.1, 2),
+    "check_specific_person": (0.2, 3),
+    "send_anonymous_valentine": (0.05, 5),
+    "send_open_valentine": (0.05, 5),
+}
+
+THROTTLED_TEXT = "⏳ Слишком много запросов. Подождите немного и попробуйте снова."
+# Как часто можно напоминать пользователю, что он упёрся в лимит
+NOTIFY_INTERVAL = 10.0
+
+THROTTLED = metrics.Counter(
+    "bot_throttled_total", "Апдейты, отброшенные ограничителем частоты", labels=("action",)
+)
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class MemoryBucketStorage:
+    """
+    Бакеты в dict {(user_id, action): _Bucket}. Бакет, простоявший дольше
+    времени полного восполнения, всё равно полон, поэтому такие записи
+    периодически удаляются без потери информации.
+    """
+
+    SWEEP_EVERY = 10000
+
+    def __init__(self):
+        self.buckets = {}
+        self._calls = 0
+
+    async def consume(self, key, rate, capacity):
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = _Bucket(capacity, now)
+        else:
+            bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+
+        self._calls += 1
+        if self._calls >= self.SWEEP_EVERY:
+            self._sweep(now)
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return True
+        return False
+
+    def _sweep(self, now):
+        self._calls = 0
+        max_idle = max(capacity / rate for rate, capacity in (DEFAULT_LIMIT, *ACTION_LIMITS.values()))
+        stale = [key for key, bucket in self.buckets.items() if now - bucket.updated > max_idle]
+        for key in stale:
+            del self.buckets[key]
+
+
+class RedisBucketStorage:
+    """Бакеты в Redis, общие для всех экземпляров бота. Списание атомарно (Lua)."""
+
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - updated) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+    return allowed
+    """
+
+    def __init__(self, url):
+        try:
+            from redis.asyncio import Redis
+        except ImportError:
+            raise Exception("❌ Для THROTTLE_REDIS_URL нужен пакет redis: pip install redis")
+
+        self.redis = Redis.from_url(url)
+        self.script = self.redis.register_script(self.SCRIPT)
+
+    async def consume(self, key, rate, capacity):
+        user_id, action = key
+        allowed = await self.script(
+            keys=[f"throttle:{user_id}:{action}"],
+            args=[rate, capacity, time.time()]
+        )
+        return bool(allowed)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Inner-middleware: общий лимит на пользователя плюс лимит на действие."""
+
+    def __init__(self, storage=None):
+        if storage is None:
+            redis_url = os.getenv("THROTTLE_REDIS_URL")
+            storage = RedisBucketStorage(redis_url) if redis_url else MemoryBucketStorage()
+        self.storage = storage
+        self.notified_at = {}
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        action = metrics.handler_name(data)
+        allowed = await self.storage.consume((user.id, "*"), *DEFAULT_LIMIT)
+        if allowed and action in ACTION_LIMITS:
+            allowed = await self.storage.consume((user.id, action), *ACTION_LIMITS[action])
+
+        if allowed:
+            return await handler(event, data)
+
+        THROTTLED.inc(1, action)
+        await self._notify(event, user.id)
+        return None
+
+    async def _notify(self, event, user_id):
+        if isinstance(event, CallbackQuery):
+            # На callback всё равно нужно ответить, чтобы убрать «часики» на кнопке
+            await event.answer(THROTTLED_TEXT)
+            return
+
+        now = time.monotonic()
+        if now - self.notified_at.get(user_id, 0.0) < NOTIFY_INTERVAL:
+            return
+        self.notified_at[user_id] = now
+        # Старые отметки не нужны: через NOTIFY_INTERVAL они ничего не блокируют
+        if len(self.notified_at) > 10000:
+            self.notified_at = {k: v for k, v in self.notified_at.items() if now - v < NOTIFY_INTERVAL}
+
+        if isinstance(event, Message):
+            await event.answer(THROTTLED_TEXT)
@@ -0,0 +1,49 @@
+"""
+Топ совпадений для персональной рассылки и HTTP API.
+
+Сначала берётся сохранённый топ из matches (Database.get_matches_for_users
+отдаёт только полные и свежие), недостающие считаются по снимку анкет,
+как в «✨ Совместимость», и при save=True сохраняются для следующих
+запросов — это делает рассылка; HTTP API только читает. Топ
+старше TOP_MATCHES_TTL секунд пересчитывается: в нём нет тех, кто прошёл
+тест позже.
+"""
+import asyncio
+import os
+
+import metrics
+from records import Match
+
+TOP_MATCHES_TTL = float(os.getenv("TOP_MATCHES_TTL", 3600))
+
+
+async def top_matches_for(db, snapshot_cache, test_engine, telegram_ids, top_n, save=True):
+    """
+    Возвращает (сохранённые, посчитанные) — два словаря {telegram_id: [Match]}.
+    Пользователей без анкеты нет ни в одном из них. save=False — посчитанные
+    топы не записываются в БД.
+    """
+    stored = db.get_matches_for_users(telegram_ids, top_n, test_engine.version, TOP_MATCHES_TTL)
+    missing = [telegram_id for telegram_id in telegram_ids if telegram_id not in stored]
+    if not missing:
+        return stored, {}
+
+    snapshot = await snapshot_cache.get()
+    computed = {}
+    for telegram_id in missing:
+        answers = snapshot.answers(telegram_id)
+        if answers is None:
+            continue
+        metrics.SIMILARITY_COMPUTATIONS.inc(len(snapshot))
+        computed[telegram_id] = [
+            Match.of(profile, similarity)
+            for profile, similarity in test_engine.top_matches_encoded(
+                answers, snapshot.candidates(exclude_id=telegram_id), top_n
+            )
+        ]
+        # Порция считается на event loop — отдаём ход обработчикам между пользователями
+        await asyncio.sleep(0)
+
+    if save and computed:
+        db.save_top_matches(computed, top_n, test_engine.version)
+    return stored, computed
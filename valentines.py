@@ -2,15 +2,29 @@ from aiogram import Bot, types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from typing import Optional, Dict, List
 import asyncio
+import logging
 import re
 
 import psycopg
 from psycopg.rows import dict_row
 
+from keyboards import ANONYMITY_KEYBOARD, PHOTO_CHOICE_KEYBOARD, VALENTINES_MENU_KEYBOARD
+
+logger = logging.getLogger("valentines")
+
 class ValentinesManager:
-    def __init__(self, bot: Bot, db_connection):
+    def __init__(self, bot: Bot, db):
         self.bot = bot
-        self.cursor = db_connection.cursor(row_factory=psycopg.rows.dict_row)
+        self.db = db
+        self._cursor = None
+
+    @property
+    def cursor(self):
+        # Database подключается лениво и может переподключиться — курсор берём от текущего соединения
+        conn = self.db.conn
+        if self._cursor is None or self._cursor.connection is not conn:
+            self._cursor = conn.cursor(row_factory=psycopg.rows.dict_row)
+        return self._cursor
     
     async def send_valentine(self, sender_id: int, recipient_username: str, 
                             message_text: str, image_url: Optional[str] = None,
@@ -79,6 +93,13 @@ class ValentinesManager:
                     parse_mode='HTML'
                 )
             
+            # Валентинка уже у получателя — сбой учёта не должен превращаться в ошибку отправки
+            try:
+                self.db.record_valentine(sender_id, recipient_id, is_anonymous, message_text, image_url)
+                self.db.increment_stat('valentines_anonymous' if is_anonymous else 'valentines_open')
+            except Exception:
+                logger.exception("❌ Не удалось записать валентинку")
+
             confirm_text = (
                 f"<i><b>Ваше сообщение доставлено!</b></i> 💝\n\n"
                 f"<b>Получатель:</b> @{clean_username}\n"
@@ -99,12 +120,12 @@ class ValentinesManager:
             }
             result['message'] = confirm_text
             
-            print(f"💌 Валентинка отправлена: {sender_id} -> @{clean_username}")
+            logger.info("💌 Валентинка отправлена", extra={"sender_id": sender_id, "recipient": clean_username})
             return result
             
         except Exception as e:
             error_msg = f"❌ Ошибка при отправке валентинки: {str(e)}"
-            print(error_msg)
+            logger.exception("❌ Ошибка при отправке валентинки", extra={"sender_id": sender_id})
 
             try:
                 await self.bot.send_message(
@@ -151,56 +172,10 @@ class ValentinesManager:
         return f"@{clean}"
 
 def get_valentine_menu_keyboard() -> InlineKeyboardMarkup:
-    buttons = [
-        [
-            InlineKeyboardButton(
-                text="💌 Отправить", 
-                callback_data="send_valentine"
-            )
-        ]
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return VALENTINES_MENU_KEYBOARD
 
 def get_anonymity_keyboard() -> InlineKeyboardMarkup:
-    buttons = [
-        [
-            InlineKeyboardButton(
-                text="👤 Анонимно", 
-                callback_data="send_anonymous"
-            ),
-            InlineKeyboardButton(
-                text="🙍‍♂️ Открыто", 
-                callback_data="send_open"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                text="🔙 Отмена", 
-                callback_data="cancel_send"
-            )
-        ]
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return ANONYMITY_KEYBOARD
 
 def get_photo_choice_keyboard() -> InlineKeyboardMarkup:
-    buttons = [
-        [
-            InlineKeyboardButton(
-                text="📸 Добавить фото", 
-                callback_data="add_photo"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                text="⏩ Пропустить", 
-                callback_data="skip_photo"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                text="🔙 Отмена", 
-                callback_data="cancel_send"
-            )
-        ]
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
\ No newline at end of file
+    return PHOTO_CHOICE_KEYBOARD